@@ -1,31 +1,102 @@
 import os.path
 
-from config import config_by_name, db
-from controllers import tag_ns, taxon_ns
+import click
+from config import Config, config_by_name, db
+from controllers import image_ns, tag_ns, taxon_ns
 from flask import Blueprint, Flask
 from flask_cors import CORS
 from flask_restx import Api
 from flask_restx.swagger import Swagger
 from flask_sqlalchemy import SQLAlchemy
-from seeders import seed_db
+from seeders import seed_db, seed_db_synthetic_taxonomy
+from services import (
+    get_autocomplete_index,
+    import_taxon_file,
+    init_instrumentation,
+    rebuild_taxon_aggregates,
+    rebuild_taxon_closure,
+    rebuild_taxon_search_index,
+)
 
 
 def create_app(config_name: str) -> Flask:
     app = Flask(__name__)
     app.config.from_object(config_by_name[config_name])
     db.init_app(app)
+    if app.config["INSTRUMENTATION"]:
+        init_instrumentation(app)
     return app
 
 
+blueprint = Blueprint("api", __name__)
+
+api = Api(
+    blueprint, version="1.0", title="Bio Tree API", description="A mini Bio Tree API"
+)
+api.add_namespace(tag_ns, path="/tag")
+api.add_namespace(taxon_ns, path="/taxon")
+api.add_namespace(image_ns, path="/image")
+
 env_name = os.environ.get("ENV_NAME", "dev")
 app = create_app(env_name)
+app.register_blueprint(blueprint)
 CORS(app)
 
-blueprint = Blueprint("api", __name__)
 
-api = Api(app, version="1.0", title="Bio Tree API", description="A mini Bio Tree API")
-api.add_namespace(tag_ns, path="/tag")
-api.add_namespace(taxon_ns, path="/taxon")
+@app.cli.command("rebuild_closure")
+def rebuild_closure():
+    """Rebuild the taxon closure table from the superior_taxon pointers"""
+    print("Rebuilt {} closure rows".format(rebuild_taxon_closure()))
+
+
+@app.cli.command("rebuild_aggregates")
+def rebuild_aggregates():
+    """Recompute the taxon subtree aggregates from the closure table"""
+    print("Rebuilt the aggregates of {} taxons".format(rebuild_taxon_aggregates()))
+
+
+@app.cli.command("rebuild_search")
+def rebuild_search():
+    """Create and refill the taxon full-text search index"""
+    rebuild_taxon_search_index()
+    print("Rebuilt taxon search index")
+
+
+@app.cli.command("seed_synthetic")
+@click.argument("size", type=int)
+@click.option("--seed", type=int, default=0)
+@click.option("--max-tags", "max_tags_per_taxon", type=int, default=3)
+@click.option("--extinction-rate", type=float, default=0.2)
+def seed_synthetic(size, seed, max_tags_per_taxon, extinction_rate):
+    """Write a synthetic taxonomy of about SIZE taxons, for scale testing"""
+    report = seed_db_synthetic_taxonomy(
+        size,
+        seed=seed,
+        max_tags_per_taxon=max_tags_per_taxon,
+        extinction_rate=extinction_rate,
+    )
+    print(
+        "Seeded {taxons} taxons, {closure_rows} closure rows and {tags} tags "
+        "in {seconds}s".format(**report)
+    )
+
+
+@app.cli.command("import_taxons")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "file_format", type=click.Choice(["csv", "ndjson"]))
+@click.option("--chunk-size", type=int, default=Config.IMPORT_CHUNK_SIZE)
+def import_taxons(path, file_format, chunk_size):
+    """Bulk import a csv or ndjson taxon file"""
+    if file_format is None:
+        file_format = "csv" if path.endswith(".csv") else "ndjson"
+    with open(path, encoding="utf-8", newline="") as stream:
+        report = import_taxon_file(stream, file_format, chunk_size=chunk_size)
+    for rejected in report["rejected"]:
+        print("line {line}: {name} rejected ({reason})".format(**rejected))
+    print(
+        "Imported {imported} taxons, rejected {rejected_count} "
+        "in {seconds}s ({rows_per_second} rows/s)".format(**report)
+    )
 
 
 if __name__ == "__main__":
@@ -35,4 +106,5 @@ if __name__ == "__main__":
         db.create_all()
         seed_db()
         db.session.commit()
+        get_autocomplete_index()
     app.run(debug=True)
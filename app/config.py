@@ -29,6 +29,55 @@ class Config:
     # Pagination
     CONTENT_PER_PAGE = [10, 20, 30, 50, 100]
     DEFAULT_CONTENT_PER_PAGE = CONTENT_PER_PAGE[0]
+    # Taxon tree
+    DEFAULT_TREE_DEPTH = 2
+    # In-process payload cache
+    TAXON_CACHE_SIZE = 10000
+    TAG_CACHE_SIZE = 1000
+    CACHE_TTL_SECONDS = 60
+    # Tag facet counts, cached per filter set. A size of 0 disables it
+    FACET_CACHE_SIZE = 256
+    FACET_CACHE_TTL_SECONDS = 10
+    # Tag filters matching up to this many taxons are resolved in memory
+    TAG_FILTER_MAX_IDS = 10000
+    # In-memory taxonomy snapshot
+    SNAPSHOT_MAX_AGE_SECONDS = 300
+    # Taxon and tag name autocomplete, writes waiting for a reload of the index
+    AUTOCOMPLETE_MAX_PENDING = 10000
+    # Batch taxon name resolution. Fuzzy matches need this trigram similarity
+    # and skip trigrams shared by more names than RESOLVE_MAX_POSTINGS
+    RESOLVE_MAX_NAMES = 10000
+    RESOLVE_MIN_SCORE = 0.5
+    RESOLVE_MAX_POSTINGS = 10000
+    # Lowest common ancestor queries
+    LCA_MAX_IDS = 100
+    # Taxonomy export
+    EXPORT_BATCH_SIZE = 1000
+    # Taxon batch writes
+    BATCH_MAX_ITEMS = 1000
+    # Bulk taxon import
+    IMPORT_CHUNK_SIZE = 5000
+    IMPORT_MAX_REJECTED_REPORTED = 1000
+    # Encode conditional responses with orjson when it is installed, otherwise
+    # flask_restx encodes them (indented under DEBUG)
+    ORJSON_RESPONSES = True
+    # Per endpoint SQL and timing metrics, opt-in
+    INSTRUMENTATION = os.getenv("INSTRUMENTATION", "false").lower() in ("1", "true")
+    INSTRUMENTATION_SERVER_TIMING = True
+    METRICS_PATH = "/metrics"
+    # Uploaded images, stored by content hash. Renditions are WebP, fitted in a
+    # square of the given size, rendered by IMAGE_WORKERS processes (0 renders
+    # them in the request)
+    IMAGE_STORAGE_PATH = os.getenv(
+        "IMAGE_STORAGE_PATH", os.path.join(basedir, "images")
+    )
+    IMAGE_RENDITIONS = {"thumbnail": 256, "large": 1600}
+    IMAGE_WEBP_QUALITY = 80
+    IMAGE_WORKERS = 2
+    IMAGE_RENDER_TIMEOUT_SECONDS = 30
+    IMAGE_CACHE_MAX_AGE_SECONDS = 365 * 24 * 3600
+    # Let the front server send the image files
+    USE_X_SENDFILE = os.getenv("USE_X_SENDFILE", "false").lower() in ("1", "true")
     # The maximum file size for upload
     MAX_CONTENT_LENGTH = 5 * 1024 * 1024  # 5 megas
 
@@ -43,11 +92,12 @@ class DevelopmentConfig(Config):
 
     # uncomment the line below to see SQLALCHEMY queries
     # SQLALCHEMY_ECHO = True
+    # or start with INSTRUMENTATION=1 for per endpoint metrics at /metrics
 
 class TestingConfig(Config):
     DEBUG = True
     TESTING = True
-    SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(basedir, "storage.db")
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
     PRESERVE_CONTEXT_ON_EXCEPTION = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     ENV = "testing"
@@ -1,5 +1,6 @@
 from .tag_controller import *
 from .taxon_controller import *
+from .image_controller import *
 '''
 import sys
 import os
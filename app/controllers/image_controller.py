@@ -0,0 +1,120 @@
+from config import Config
+from flask import request
+from flask_restx import Resource, fields
+from models import IMAGES_ORIGINS
+from responses import Namespace
+from services.image_service import *
+from werkzeug.datastructures import FileStorage
+
+
+class ImageDto:
+    api = Namespace("image", description="image related operations")
+
+    image_upload = api.parser()
+    image_upload.add_argument(
+        "file", location="files", type=FileStorage, required=True, help="image file"
+    )
+    image_upload.add_argument(
+        "origin", location="form", required=True, choices=IMAGES_ORIGINS
+    )
+    image_upload.add_argument(
+        "origin_id", location="form", type=int, required=True, help="tag or taxon id"
+    )
+
+    image_renditions = api.model(
+        "image_renditions",
+        {
+            name: fields.String(
+                description="url of the WebP rendition fitted in {}px".format(size)
+            )
+            for name, size in Config.IMAGE_RENDITIONS.items()
+        },
+    )
+
+    image_get = api.model(
+        "image_get",
+        {
+            "id": fields.Integer(required=True, description="image id"),
+            "origin": fields.String(
+                required=True, description="image origin", enum=IMAGES_ORIGINS
+            ),
+            "origin_id": fields.Integer(required=True, description="tag or taxon id"),
+            "url": fields.String(required=True, description="url of the original"),
+            "content_hash": fields.String(description="sha256 of the original"),
+            "content_type": fields.String(description="type of the original"),
+            "size": fields.Integer(description="size of the original in bytes"),
+            "width": fields.Integer(description="width in pixels"),
+            "height": fields.Integer(description="height in pixels"),
+            "created_at": fields.DateTime(description="upload time"),
+            "renditions": fields.Nested(image_renditions),
+            "renditions_ready": fields.Boolean(
+                description="whether the renditions are rendered yet"
+            ),
+        },
+    )
+
+    image_get_list = api.model(
+        "image_get_list", {"items": fields.List(fields.Nested(image_get))}
+    )
+
+
+api = ImageDto.api
+image_ns = api
+
+
+@api.route("")
+class Image(Resource):
+    @api.doc(
+        "list_images",
+        params={"origin": "tag or taxon", "origin_id": "Tag or taxon id"},
+        description="Images of a tag or taxon, in upload order.",
+    )
+    @api.marshal_with(ImageDto.image_get_list, code=200, description="List images")
+    @api.response(400, "Invalid_image_origin")
+    def get(self):
+        """List the images of a tag or taxon"""
+        params = request.args
+        return get_images(params=params)
+
+    @api.doc(
+        "upload_image",
+        description="Upload a JPEG, PNG, GIF or WebP image of a tag or taxon. Files are stored once by content hash. The WebP renditions are rendered in background processes, {renditions_ready} tells whether they are done, and asking for one before waits for it.",
+    )
+    @api.expect(ImageDto.image_upload)
+    @api.marshal_with(ImageDto.image_get, code=201, description="Image uploaded")
+    @api.response(200, "Image already uploaded for this origin")
+    @api.response(400, "Invalid_image")
+    def post(self):
+        """Upload an image"""
+        return save_new_image(file=request.files.get("file"), form=request.form)
+
+
+@api.route("/<int:image_id>")
+class ImageById(Resource):
+    @api.doc("get_image")
+    @api.marshal_with(ImageDto.image_get, code=200, description="Image")
+    @api.response(404, "Image_not_found")
+    def get(self, image_id):
+        """Get an image"""
+        return serialize_image(get_image(image_id))
+
+    @api.doc("delete_image")
+    @api.response(200, "Image_successfully_deleted")
+    @api.response(404, "Image_not_found")
+    def delete(self, image_id):
+        """Delete an image"""
+        return delete_image_by_id(image_id)
+
+
+@api.route("/file/<string:content_hash>/<string:rendition>")
+class ImageFile(Resource):
+    @api.doc(
+        "get_image_file",
+        params={"rendition": "original or a rendition name"},
+        description="Bytes of a stored image. Served with Range support and cached for good, the url changes with the content.",
+    )
+    @api.response(200, "Image file")
+    @api.response(404, "Image_not_found")
+    def get(self, content_hash, rendition):
+        """Get an image file"""
+        return send_image_file(content_hash, rendition)
@@ -1,6 +1,9 @@
 from flask import request
-from flask_restx import Namespace, Resource, fields
+from flask_restx import Resource, fields
+from responses import Namespace, conditional_response, project_page_model
+from services.pagination_service import page_etag
 from services.tag_service import *
+from services.tag_facet_service import *
 
 
 class TagDto:
@@ -14,8 +17,18 @@ class TagDto:
         },
     )
 
+    revision = {
+        "version": fields.Integer(
+            readonly=True, description="incremented on every update"
+        ),
+        "updated_at": fields.DateTime(readonly=True, description="last update"),
+    }
+
     tag_get = api.clone(
-        "tag_get", tag_post, {"id": fields.Integer(required=True, description="tag id")}
+        "tag_get",
+        tag_post,
+        revision,
+        {"id": fields.Integer(required=True, description="tag id")},
     )
     tag_get_list = api.model(
         "tag_get_list",
@@ -23,10 +36,27 @@ class TagDto:
             "current_page": fields.Integer(required=True, description="current page"),
             "total_items": fields.Integer(required=True, description="total items"),
             "total_pages": fields.Integer(required=True, description="total pages"),
+            "next_cursor": fields.String(
+                required=False, description="cursor of the next page (cursor mode)"
+            ),
             "items": fields.List(fields.Nested(tag_get)),
         },
     )
 
+    tag_facet = api.model(
+        "tag_facet",
+        {
+            "id": fields.Integer(required=True, description="tag id"),
+            "name": fields.String(required=True, description="tag name"),
+            "taxons_count": fields.Integer(
+                required=True, description="number of matching taxons with the tag"
+            ),
+        },
+    )
+    tag_facets = api.model(
+        "tag_facets", {"items": fields.List(fields.Nested(tag_facet))}
+    )
+
 
 api = TagDto.api
 tag_ns = api
@@ -39,16 +69,26 @@ class Tag(Resource):
         params={
             "page": "Page number",
             "per_page": "Items per page",
+            "after": "Cursor returned as {next_cursor} by the previous page",
+            "limit": "Items per page in cursor mode",
+            "with_total": "Also count {total_items} in cursor mode",
             "name": "Tag name",
             "description": "Tag description",
+            "fields": "Comma separated fields to return",
         },
-        description="List all tags. {page} and {per_page} are optional. If not provided, the default values are 1 and 10 respectively. {name} and {description} are optional. If provided, the results will be filtered by the provided values.",
+        description="List all tags. {page} and {per_page} are optional. If not provided, the default values are 1 and 10 respectively. Passing {after} or {limit} switches to cursor pagination, which seeks on the id and only counts the total when {with_total} is true. {name} and {description} are optional. If provided, the results will be filtered by the provided values.",
     )
-    @api.marshal_with(TagDto.tag_get_list, code=200, description="Get all tags")
+    @api.response(200, "Get all tags", TagDto.tag_get_list)
+    @api.response(304, "Not modified")
     def get(self):
         """List all tags"""
         params = request.args
-        return get_tags(params=params)
+        tags = get_tags(params=params)
+        return conditional_response(
+            tags,
+            project_page_model(TagDto.tag_get_list, tags["fields"]),
+            etag=page_etag("tag", params, tags),
+        )
 
     @api.doc("create_tag")
     @api.expect(TagDto.tag_post)
@@ -61,16 +101,47 @@ class Tag(Resource):
         return save_new_tag(data=data)
 
 
+@api.route("/facets")
+class TagFacets(Resource):
+    @api.doc(
+        "get_tag_facets",
+        params={
+            "taxon_class": "Taxon class",
+            "name": "Taxon name",
+            "popular_name": "Taxon popular name",
+            "description": "Taxon description",
+            "origin_min": "Minimum taxon origin",
+            "origin_max": "Maximum taxon origin",
+            "alive_at": "Only taxons alive at this time",
+            "superior_taxon_id": "Superior taxon id",
+            "ancestor_id": "Only taxons under this taxon",
+            "tag_id": "Only taxons with this tag",
+            "tags_all": "Only taxons with every tag of this comma separated list",
+            "tags_any": "Only taxons with one of the tags of this comma separated list",
+        },
+        description="Every tag with the number of taxons carrying it, most used first. Accepts the filters of the taxon list, in which case only the matching taxons are counted. Counts may be a few seconds old.",
+    )
+    @api.marshal_with(TagDto.tag_facets, code=200, description="Get tag facets")
+    def get(self):
+        """Count the taxons of each tag"""
+        params = request.args
+        return get_tag_facets(params=params)
+
+
 @api.route("/<int:tag_id>")
 class TagById(Resource):
     @api.doc(
         "get_tag",
     )
-    @api.marshal_with(TagDto.tag_get, code=200, description="Get tag by id")
+    @api.response(200, "Get tag by id", TagDto.tag_get)
+    @api.response(304, "Not modified")
     @api.response(404, "Tag_not_found")
     def get(self, tag_id):
         """Get tag by id"""
-        return get_tag(tag_id)
+        tag = get_tag_payload(tag_id)
+        return conditional_response(
+            tag, TagDto.tag_get, etag=tag_etag(tag), last_modified=tag["updated_at"]
+        )
 
     @api.doc("update_tag")
     @api.expect(TagDto.tag_post)
@@ -1,7 +1,16 @@
 from flask import request
-from flask_restx import Namespace, Resource, fields
+from flask_restx import Resource, fields
 from models import TAXON_CLASS_TYPES
+from responses import Namespace, conditional_response, project_page_model
+from services.pagination_service import page_etag
 from services.taxon_service import *
+from services.taxon_search_service import *
+from services.taxon_timeline_service import *
+from services.taxon_lineage_service import *
+from services.taxon_autocomplete_service import *
+from services.taxon_resolve_service import *
+from services.taxon_export_service import *
+from services.taxon_batch_service import *
 from controllers.tag_controller import TagDto
 
 
@@ -9,7 +18,7 @@ class TaxonDto:
     api = Namespace("taxon", description="taxon related operations")
 
     tags_ids = {
-        "tags_id": fields.List(
+        "tags_ids": fields.List(
             fields.Integer(required=True, description="tag id"),
             required=False,
             description="taxon tags id",
@@ -49,19 +58,192 @@ class TaxonDto:
         tags_ids,
     )
 
+    taxon_batch_item = api.clone(
+        "taxon_batch_item",
+        taxon_post,
+        {
+            "id": fields.Integer(required=False, description="taxon id, to update it"),
+            "superior_taxon_name": fields.String(
+                required=False,
+                description="superior taxon name, may be created by the batch",
+            ),
+        },
+    )
+
+    taxon_batch = api.model(
+        "taxon_batch",
+        {"items": fields.List(fields.Nested(taxon_batch_item), required=True)},
+    )
+
+    aggregates = {
+        "descendant_count": fields.Integer(
+            readonly=True, description="number of taxons under the taxon"
+        ),
+        "species_count": fields.Integer(
+            readonly=True, description="species in the subtree, the taxon included"
+        ),
+        "individuals_sum": fields.Integer(
+            readonly=True,
+            description="individuals number summed over the subtree, the taxon included",
+        ),
+    }
+
     taxon_get = api.clone(
         "taxon_get",
         taxon_base,
         tags,
+        aggregates,
+        TagDto.revision,
         {"id": fields.Integer(required=True, description="taxon id")},
     )
 
+    taxon_search = api.model(
+        "taxon_search",
+        {
+            "query": fields.String(required=True, description="search query"),
+            "items": fields.List(fields.Nested(taxon_get)),
+        },
+    )
+
+    taxon_timeline_ranks = api.model(
+        "taxon_timeline_ranks",
+        {
+            taxon_class: fields.Integer(
+                description="{} taxons alive at time".format(taxon_class)
+            )
+            for taxon_class in TAXON_CLASS_TYPES
+        },
+    )
+
+    taxon_timeline_point = api.model(
+        "taxon_timeline_point",
+        {
+            "at": fields.Integer(required=True, description="time"),
+            "total": fields.Integer(required=True, description="taxons alive at time"),
+            "ranks": fields.Nested(taxon_timeline_ranks),
+        },
+    )
+
+    taxon_timeline = api.model(
+        "taxon_timeline",
+        {"items": fields.List(fields.Nested(taxon_timeline_point))},
+    )
+
+    taxon_summary = api.model(
+        "taxon_summary",
+        {
+            "id": fields.Integer(required=True, description="taxon id"),
+            "name": fields.String(required=True, description="taxon name"),
+            "taxon_class": fields.String(
+                required=True, description="taxon class", enum=TAXON_CLASS_TYPES
+            ),
+        },
+    )
+
+    taxon_autocomplete_taxon = api.clone(
+        "taxon_autocomplete_taxon",
+        taxon_summary,
+        {"popular_name": fields.String(description="taxon popular name")},
+    )
+
+    taxon_autocomplete_tag = api.model(
+        "taxon_autocomplete_tag",
+        {
+            "id": fields.Integer(required=True, description="tag id"),
+            "name": fields.String(required=True, description="tag name"),
+            "taxon_count": fields.Integer(description="number of tagged taxons"),
+        },
+    )
+
+    taxon_autocomplete = api.model(
+        "taxon_autocomplete",
+        {
+            "prefix": fields.String(required=True, description="typed prefix"),
+            "taxons": fields.List(fields.Nested(taxon_autocomplete_taxon)),
+            "tags": fields.List(fields.Nested(taxon_autocomplete_tag)),
+        },
+    )
+
+    taxon_resolve = api.model(
+        "taxon_resolve",
+        {
+            "names": fields.List(
+                fields.String(description="raw taxon name"), required=True
+            ),
+            "fuzzy": fields.Boolean(
+                default=True, description="fall back to the closest name"
+            ),
+            "min_score": fields.Float(
+                description="minimum similarity of a fuzzy match, 0 to 1"
+            ),
+        },
+    )
+
+    taxon_resolution = api.model(
+        "taxon_resolution",
+        {
+            "name": fields.String(required=True, description="name as sent"),
+            "taxon": fields.Nested(
+                taxon_summary, allow_null=True, description="best matching taxon"
+            ),
+            "match_type": fields.String(
+                description="how the taxon matched, null when it did not",
+                enum=["exact", "normalized", "fuzzy"],
+            ),
+            "score": fields.Float(description="similarity, 1 for exact matches"),
+        },
+    )
+
+    taxon_resolution_list = api.model(
+        "taxon_resolution_list",
+        {
+            "matched": fields.Integer(description="names with a matching taxon"),
+            "items": fields.List(fields.Nested(taxon_resolution)),
+        },
+    )
+
+    taxon_lca_taxon = api.clone(
+        "taxon_lca_taxon",
+        taxon_summary,
+        {"depth": fields.Integer(description="parent links up to the root")},
+    )
+
+    taxon_lca_pair = api.model(
+        "taxon_lca_pair",
+        {
+            "first_id": fields.Integer(required=True, description="taxon id"),
+            "second_id": fields.Integer(required=True, description="taxon id"),
+            "lca_id": fields.Integer(
+                description="lowest common ancestor id, null in different trees"
+            ),
+            "distance": fields.Integer(
+                description="parent links between the taxons through their lca"
+            ),
+        },
+    )
+
+    taxon_lca = api.model(
+        "taxon_lca",
+        {
+            "lca": fields.Nested(
+                taxon_summary,
+                allow_null=True,
+                description="lowest common ancestor of every taxon",
+            ),
+            "taxons": fields.List(fields.Nested(taxon_lca_taxon)),
+            "pairs": fields.List(fields.Nested(taxon_lca_pair)),
+        },
+    )
+
     taxon_get_list = api.model(
         "taxon_get_list",
         {
             "current_page": fields.Integer(required=True, description="current page"),
             "total_items": fields.Integer(required=True, description="total items"),
             "total_pages": fields.Integer(required=True, description="total pages"),
+            "next_cursor": fields.String(
+                required=False, description="cursor of the next page (cursor mode)"
+            ),
             "items": fields.List(fields.Nested(taxon_get)),
         },
     )
@@ -78,20 +260,39 @@ class Taxon(Resource):
         params={
             "page": "Page number",
             "per_page": "Items per page",
+            "after": "Cursor returned as {next_cursor} by the previous page",
+            "limit": "Items per page in cursor mode",
+            "with_total": "Also count {total_items} in cursor mode",
             "taxon": "Taxon name",
             "name": "Taxon name",
             "popular_name": "Taxon popular name",
             "description": "Taxon description",
             "origin": "Taxon origin",
             "extinction": "Taxon extinction",
+            "origin_min": "Minimum taxon origin",
+            "origin_max": "Maximum taxon origin",
+            "extinction_min": "Minimum taxon extinction",
+            "extinction_max": "Maximum taxon extinction",
+            "alive_at": "Only taxons alive at this time",
+            "sort": "Sort field, prefixed with - for descending order",
+            "fields": "Comma separated fields to return, tags excluded",
+            "tags_all": "Only taxons with every tag of this comma separated list",
+            "tags_any": "Only taxons with one of the tags of this comma separated list",
         },
-        description="List all taxons. {page} and {per_page} are optional. If not provided, the default values are 1 and 10 respectively. {name} and {description} are optional. If provided, the results will be filtered by the provided values.",
+        description="List all taxons. {page} and {per_page} are optional. If not provided, the default values are 1 and 10 respectively. Passing {after} or {limit} switches to cursor pagination, which seeks on the id and only counts the total when {with_total} is true. {name} and {description} are optional. If provided, the results will be filtered by the provided values. {alive_at} keeps the taxons alive at that time, origin and extinction counting time before present. {sort} accepts id, name, origin, extinction, individuals_number, descendant_count, species_count and individuals_sum, it is not supported in cursor mode.",
     )
-    @api.marshal_with(TaxonDto.taxon_get_list, code=200, description="Get all taxons")
+    @api.response(200, "Get all taxons", TaxonDto.taxon_get_list)
+    @api.response(304, "Not modified")
+    @api.response(400, "Invalid_origin_range")
     def get(self):
         """List all taxons"""
         params = request.args
-        return get_taxons(params=params)
+        taxons = get_taxons(params=params)
+        return conditional_response(
+            taxons,
+            project_page_model(TaxonDto.taxon_get_list, taxons["fields"]),
+            etag=page_etag("taxon", params, taxons),
+        )
 
     @api.doc("create_taxon")
     @api.expect(TaxonDto.taxon_post)
@@ -104,19 +305,147 @@ class Taxon(Resource):
         return save_new_taxon(data=data)
 
 
+@api.route("/search")
+class TaxonSearch(Resource):
+    @api.doc(
+        "search_taxons",
+        params={
+            "q": "Search terms",
+            "limit": "Maximum number of results",
+        },
+        description="Full-text search over taxon name, popular name and description. Every term of {q} is matched as a prefix and the results are ranked by relevance, name matches first. {limit} is optional, if not provided the default value is 10.",
+    )
+    @api.marshal_with(TaxonDto.taxon_search, code=200, description="Search taxons")
+    @api.response(400, "Search_query_is_required")
+    def get(self):
+        """Search taxons"""
+        params = request.args
+        return search_taxons(params=params)
+
+
+@api.route("/autocomplete")
+class TaxonAutocomplete(Resource):
+    @api.doc(
+        "autocomplete_taxons",
+        params={
+            "prefix": "Start of a taxon name, popular name or tag name",
+            "limit": "Maximum number of taxons and of tags",
+        },
+        description="Taxons and tags whose name starts with {prefix}, ignoring case and accents, answered from an in-memory index of sorted names. Taxons also match on their popular name and are ranked by rank, then number of descendants. Tags are ranked by number of tagged taxons. {limit} is optional, if not provided the default value is 10.",
+    )
+    @api.marshal_with(
+        TaxonDto.taxon_autocomplete, code=200, description="Autocomplete taxons"
+    )
+    @api.response(400, "Prefix_is_required")
+    def get(self):
+        """Autocomplete taxon and tag names"""
+        params = request.args
+        return autocomplete(params=params)
+
+
+@api.route("/resolve")
+class TaxonResolve(Resource):
+    @api.doc(
+        "resolve_taxon_names",
+        description="Best matching taxon of each of {names}, in order. A name matches exactly, then ignoring case, accents, punctuation and spacing, then, unless {fuzzy} is false, the closest name by trigram similarity if it scores at least {min_score}. {min_score} is optional, if not provided the default value is 0.5. Answered from an in-memory name index.",
+    )
+    @api.expect(TaxonDto.taxon_resolve)
+    @api.marshal_with(
+        TaxonDto.taxon_resolution_list, code=200, description="Resolve taxon names"
+    )
+    @api.response(400, "Names_are_required")
+    def post(self):
+        """Resolve raw names to taxons"""
+        data = request.json
+        return resolve_taxon_names(data=data)
+
+
+@api.route("/batch")
+class TaxonBatch(Resource):
+    @api.doc(
+        "save_taxon_batch",
+        description="Create or update many taxons in one transaction. Items with an {id} update that taxon and only change the fields they carry, items without it are created. A new item can give {superior_taxon_name} instead of {superior_taxon} to sit under an existing taxon or under another new item of the batch. Nothing is written if any item is invalid, the errors are listed by item {index} in {info}.",
+    )
+    @api.expect(TaxonDto.taxon_batch)
+    @api.response(200, "Taxons_successfully_saved")
+    @api.response(400, "Invalid_batch")
+    def post(self):
+        """Create or update many taxons"""
+        data = request.json
+        return save_taxon_batch(data=data)
+
+
+@api.route("/export")
+class TaxonExport(Resource):
+    @api.doc(
+        "export_taxons",
+        params={"format": "ndjson or csv"},
+        description="Stream every taxon with its {superior_taxon}, {superior_taxon_name} and {tags_ids}. {format} is optional, if not provided the default value is ndjson. The csv layout is the one read by the bulk import, which links the taxons through {superior_taxon_name}, so an export can be imported into another database.",
+    )
+    @api.response(200, "Taxons exported")
+    @api.response(400, "Invalid_export_format")
+    def get(self):
+        """Export the whole taxonomy"""
+        params = request.args
+        return export_taxons(params=params)
+
+
+@api.route("/timeline")
+class TaxonTimeline(Resource):
+    @api.doc(
+        "get_taxon_timeline",
+        params={
+            "at": "Time, repeat it for several points",
+            "ancestor_id": "Only count taxons under this taxon",
+        },
+        description="Number of taxons alive at each {at} time, grouped by rank. Times count before present: a taxon is alive from its origin down to its extinction, if any.",
+    )
+    @api.marshal_with(TaxonDto.taxon_timeline, code=200, description="Taxon timeline")
+    @api.response(400, "Timeline_time_is_required")
+    def get(self):
+        """Count the taxons alive at given times"""
+        params = request.args
+        return get_taxon_timeline(params=params)
+
+
+@api.route("/lca")
+class TaxonLca(Resource):
+    @api.doc(
+        "get_taxon_lca",
+        params={"ids": "Comma separated taxon ids, or repeat it"},
+        description="Lowest common ancestor of the {ids} taxons and, for every pair of them, their own lowest common ancestor and the number of parent links between them. Answered from the in-memory taxonomy snapshot.",
+    )
+    @api.marshal_with(TaxonDto.taxon_lca, code=200, description="Taxon lca")
+    @api.response(400, "At_least_two_ids_are_required")
+    @api.response(404, "Taxon_not_found")
+    def get(self):
+        """Lowest common ancestor of taxons"""
+        params = request.args
+        return get_taxons_lca(params=params)
+
+
 @api.route("/<int:taxon_id>")
 class TaxonById(Resource):
     @api.doc("get_taxon")
-    @api.marshal_with(TaxonDto.taxon_get, code=200, description="Get taxon")
+    @api.response(200, "Get taxon", TaxonDto.taxon_get)
+    @api.response(304, "Not modified")
+    @api.response(404, "Taxon_not_found")
     def get(self, taxon_id):
         """Get taxon by id"""
-        return get_taxon(taxon_id=taxon_id)
+        taxon = get_taxon_payload(taxon_id=taxon_id)
+        return conditional_response(
+            taxon,
+            TaxonDto.taxon_get,
+            etag=taxon_etag(taxon),
+            last_modified=taxon["updated_at"],
+        )
 
     @api.doc("update_taxon")
     @api.expect(TaxonDto.taxon_post)
     @api.response(200, "Taxon_successfully_updated")
     @api.response(400, "Invalid_data")
     @api.response(404, "Taxon_not_found")
+    @api.response(409, "Taxon_has_inferior_taxons")
     def put(self, taxon_id):
         """Update taxon by id"""
         data = request.json
@@ -128,3 +457,34 @@ class TaxonById(Resource):
     def delete(self, taxon_id):
         """Delete taxon by id"""
         return delete_taxon_by_id(taxon_id=taxon_id)
+
+
+@api.route("/<int:taxon_id>/export")
+class TaxonTreeExport(Resource):
+    @api.doc(
+        "export_taxon_tree",
+        params={"format": "newick or phyloxml"},
+        description="Stream the subtree under the taxon as a tree file. {format} is optional, if not provided the default value is newick. Branch lengths are the time between the origin of the superior taxon and the taxon's.",
+    )
+    @api.response(200, "Taxon tree exported")
+    @api.response(400, "Invalid_export_format")
+    @api.response(404, "Taxon_not_found")
+    def get(self, taxon_id):
+        """Export the subtree under a taxon"""
+        params = request.args
+        return export_taxon_tree(taxon_id=taxon_id, params=params)
+
+
+@api.route("/<int:taxon_id>/tree")
+class TaxonTreeById(Resource):
+    @api.doc(
+        "get_taxon_tree",
+        params={"depth": "How many levels below the taxon to return"},
+        description="Get the nested branch under a taxon. {depth} is optional, if not provided the default value is 2. Each node carries its {children}.",
+    )
+    @api.response(200, "Get taxon tree")
+    @api.response(404, "Taxon_not_found")
+    def get(self, taxon_id):
+        """Get the branch under a taxon"""
+        params = request.args
+        return get_taxon_tree(taxon_id=taxon_id, params=params)
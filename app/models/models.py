@@ -1,9 +1,39 @@
+from datetime import datetime, timezone
+
 from config import db
+from sqlalchemy import DDL, event
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def revision_columns() -> tuple:
+    """version and updated_at of a resource. Every UPDATE of the row, ORM or
+    Core, bumps both; they back the HTTP validators"""
+    return (
+        db.Column(
+            db.Integer,
+            nullable=False,
+            default=1,
+            server_default="1",
+            onupdate=db.literal_column("version") + 1,
+        ),
+        db.Column(
+            db.DateTime(timezone=True),
+            nullable=False,
+            default=utcnow,
+            onupdate=utcnow,
+        ),
+    )
+
 
 taxon_tag = db.Table(
     "taxon_tag",
     db.Column("taxon_id", db.Integer, db.ForeignKey("taxons.id"), primary_key=True),
     db.Column("tag_id", db.Integer, db.ForeignKey("tags.id"), primary_key=True),
+    # Tag filters and facets look taxons up by tag
+    db.Index("ix_taxon_tag_tag_taxon", "tag_id", "taxon_id"),
 )
 
 class Tag(db.Model):
@@ -11,6 +41,7 @@ class Tag(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), unique=True, nullable=False)
     description = db.Column(db.String(500), unique=False, nullable=True)
+    version, updated_at = revision_columns()
 
     # Relationships
     # images = many to many with images table
@@ -25,7 +56,17 @@ class Image(db.Model):
     __tablename__ = "images"
     id = db.Column(db.Integer, primary_key=True)
     origin = db.Column(db.Enum(*IMAGES_ORIGINS), unique=False, nullable=False)
-    url = db.Column(db.String(500), unique=True, nullable=False)
+    # Content addressed, images of the same file share it
+    url = db.Column(db.String(500), unique=False, nullable=False)
+    origin_id = db.Column(db.Integer, nullable=False)
+    content_hash = db.Column(db.String(64), nullable=False, index=True)
+    content_type = db.Column(db.String(40), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    width = db.Column(db.Integer, nullable=False)
+    height = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=utcnow)
+
+    __table_args__ = (db.Index("ix_images_origin", "origin", "origin_id"),)
 
     def __repr__(self):
         return "<Image %r>" % self.id
@@ -52,13 +93,21 @@ taxon_tag = db.Table(
     db.Column("tag_id", db.Integer, db.ForeignKey("tags.id"), primary_key=True),
 )
 '''
-taxon_ancestors = db.Table(
-    "taxon_ancestors",
-    db.Column("taxon_id", db.Integer, db.ForeignKey("taxons.id"), primary_key=True),
+taxon_closure = db.Table(
+    "taxon_closure",
     db.Column("ancestor_id", db.Integer, db.ForeignKey("taxons.id"), primary_key=True),
+    db.Column(
+        "descendant_id", db.Integer, db.ForeignKey("taxons.id"), primary_key=True
+    ),
+    db.Column("depth", db.Integer, nullable=False),
+    db.Index("ix_taxon_closure_descendant_depth", "descendant_id", "depth"),
 )
 class Taxon(db.Model):
     __tablename__ = "taxons"
+    __table_args__ = (
+        # origin/extinction range and alive-at filters
+        db.Index("ix_taxons_origin_extinction", "origin", "extinction"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     taxon_class = db.Column(db.Enum(*TAXON_CLASS_TYPES), unique=False, nullable=False)
     name = db.Column(db.String(80), unique=True, nullable=False)
@@ -67,20 +116,47 @@ class Taxon(db.Model):
     origin = db.Column(db.Integer, unique=False, nullable=False)
     extinction = db.Column(db.Integer, unique=False, nullable=True)
     individuals_number = db.Column(db.Integer, unique=False, nullable=True)
-    superior_taxon = db.Column(db.Integer, db.ForeignKey("taxons.id"), nullable=True)
+    superior_taxon = db.Column(
+        db.Integer, db.ForeignKey("taxons.id"), nullable=True, index=True
+    )
+    # Subtree aggregates, maintained by services.taxon_aggregate_service.
+    # descendant_count leaves the taxon out, the other two count it
+    descendant_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+    species_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+    individuals_sum = db.Column(
+        db.Integer, nullable=False, default=0, server_default="0"
+    )
+    version, updated_at = revision_columns()
     tags = db.relationship(
         "Tag", secondary=taxon_tag, backref=db.backref("taxons", lazy="dynamic")
     )
+    # Both sides of the closure are maintained by services.taxon_closure_service
     ancestors = db.relationship(
         "Taxon",
-        secondary=taxon_ancestors,
-        primaryjoin=id==taxon_ancestors.c.taxon_id,
-        secondaryjoin=id==taxon_ancestors.c.ancestor_id,
-        backref="descendants"
+        secondary=taxon_closure,
+        primaryjoin=db.and_(
+            id == taxon_closure.c.descendant_id, taxon_closure.c.depth > 0
+        ),
+        secondaryjoin=id == taxon_closure.c.ancestor_id,
+        order_by=taxon_closure.c.depth,
+        viewonly=True,
+    )
+    descendants = db.relationship(
+        "Taxon",
+        secondary=taxon_closure,
+        primaryjoin=db.and_(
+            id == taxon_closure.c.ancestor_id, taxon_closure.c.depth > 0
+        ),
+        secondaryjoin=id == taxon_closure.c.descendant_id,
+        lazy="dynamic",
+        viewonly=True,
     )
 
     # Relationships
-    # ancestors = many to many with same table
     # images = one to many with images table
     # Opcional fields
     # fossils?
@@ -89,6 +165,57 @@ class Taxon(db.Model):
         reprer = self.taxon + " " + self.name
         return "<Taxon - %r>" % reprer
 
+
+# Full-text search over name, popular_name and description.
+# SQLite: an external content FTS5 table kept in sync by triggers.
+# Postgres: a generated tsvector column plus pg_trgm indexes.
+TAXON_SEARCH_SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS taxons_fts USING fts5("
+    "name, popular_name, description, content='taxons', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS taxons_fts_insert AFTER INSERT ON taxons BEGIN "
+    "INSERT INTO taxons_fts(rowid, name, popular_name, description) "
+    "VALUES (new.id, new.name, new.popular_name, new.description); END",
+    "CREATE TRIGGER IF NOT EXISTS taxons_fts_delete AFTER DELETE ON taxons BEGIN "
+    "INSERT INTO taxons_fts(taxons_fts, rowid, name, popular_name, description) "
+    "VALUES ('delete', old.id, old.name, old.popular_name, old.description); END",
+    "CREATE TRIGGER IF NOT EXISTS taxons_fts_update "
+    "AFTER UPDATE OF name, popular_name, description ON taxons BEGIN "
+    "INSERT INTO taxons_fts(taxons_fts, rowid, name, popular_name, description) "
+    "VALUES ('delete', old.id, old.name, old.popular_name, old.description); "
+    "INSERT INTO taxons_fts(rowid, name, popular_name, description) "
+    "VALUES (new.id, new.name, new.popular_name, new.description); END",
+]
+TAXON_SEARCH_POSTGRESQL_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "ALTER TABLE taxons ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(popular_name, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'C')) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_taxons_search_vector "
+    "ON taxons USING gin (search_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_taxons_name_trgm "
+    "ON taxons USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_taxons_popular_name_trgm "
+    "ON taxons USING gin (popular_name gin_trgm_ops)",
+]
+for statement in TAXON_SEARCH_SQLITE_DDL:
+    event.listen(
+        Taxon.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite")
+    )
+for statement in TAXON_SEARCH_POSTGRESQL_DDL:
+    event.listen(
+        Taxon.__table__,
+        "after_create",
+        DDL(statement).execute_if(dialect="postgresql"),
+    )
+event.listen(
+    Taxon.__table__,
+    "before_drop",
+    DDL("DROP TABLE IF EXISTS taxons_fts").execute_if(dialect="sqlite"),
+)
+
 """
 class Life(db.Model):
     __tablename__ = "life"
@@ -1,2 +1,5 @@
 from .exceptions import *
-from .responses import *
\ No newline at end of file
+from .responses import *
+from .serializer import *
+from .marshalling import *
+from .conditional import *
@@ -0,0 +1,55 @@
+from datetime import datetime, timezone
+from hashlib import blake2b
+from time import perf_counter
+
+from flask import Response, current_app, request
+from flask_restx import Model, marshal
+from werkzeug.http import http_date, quote_etag
+
+from .marshalling import add_marshal_time
+from .serializer import dump_json, get_serializer
+
+
+def make_etag(*parts) -> str:
+    """Opaque validator of a representation, built from what identifies it"""
+    return blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+
+
+def _not_modified(etag: str, last_modified: datetime = None) -> bool:
+    # If-Modified-Since only counts when the client sent no If-None-Match
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is None or request.if_modified_since is None:
+        return False
+    return last_modified.replace(microsecond=0) <= request.if_modified_since
+
+
+def serialize(data: any, model: Model) -> any:
+    """Same output as marshal_with: the compiled serializer of the model, or
+    flask_restx itself when the client sent a field mask"""
+    mask = request.headers.get(current_app.config.get("RESTX_MASK_HEADER", "X-Fields"))
+    if mask:
+        return marshal(data, model, mask=mask)
+    return get_serializer(model)(data)
+
+
+def conditional_response(
+    data: any, model: Model, etag: str, last_modified: datetime = None
+) -> tuple[any, int, dict]:
+    """Answer 304 when the request validators match, without serializing data.
+    Otherwise serialize data with model. Both carry the validators"""
+    headers = {"ETag": quote_etag(etag, weak=True)}
+    if last_modified is not None:
+        if last_modified.tzinfo is None:  # SQLite drops the timezone
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        headers["Last-Modified"] = http_date(last_modified)
+    if _not_modified(etag, last_modified):
+        return None, 304, headers
+
+    start = perf_counter()
+    body = serialize(data, model)
+    dumped = dump_json(body) if current_app.config["ORJSON_RESPONSES"] else None
+    add_marshal_time(start)
+    if dumped is None:  # flask_restx encodes it
+        return body, 200, headers
+    return Response(dumped, 200, headers, mimetype="application/json")
@@ -5,5 +5,7 @@ class DefaultException(HTTPException):
         self.code = code
         self.description = message
         self.info = info
+        if info is not None:  # flask_restx renders {data} as the response body
+            self.data = {"message": message, "info": info}
 
         super().__init__()
\ No newline at end of file
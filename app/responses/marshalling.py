@@ -0,0 +1,48 @@
+from functools import wraps
+from http import HTTPStatus
+from time import perf_counter
+
+import flask_restx
+from flask import g
+
+
+def add_marshal_time(start: float) -> None:
+    """Count the time since start as marshalling time of the request, when the
+    app is instrumented"""
+    stats = g.get("request_stats")
+    if stats is not None:
+        stats.marshal_seconds += perf_counter() - start
+
+
+class TimedMarshal(flask_restx.marshal_with):
+    """flask_restx marshal_with that times the marshalling of the response,
+    apart from the handler"""
+
+    def __call__(self, f):
+        marshal_response = super().__call__(lambda response: response)
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            response = f(*args, **kwargs)
+            start = perf_counter()
+            try:
+                return marshal_response(response)
+            finally:
+                add_marshal_time(start)
+
+        return wrapper
+
+
+class Namespace(flask_restx.Namespace):
+    """flask_restx Namespace whose marshal_with is timed by TimedMarshal"""
+
+    def marshal_with(
+        self, fields, as_list=False, code=HTTPStatus.OK, description=None, **kwargs
+    ):
+        document = super().marshal_with(fields, as_list, code, description, **kwargs)
+
+        def wrapper(func):
+            document(func)  # documents func, wraps copies it to the wrapper
+            return TimedMarshal(fields, ordered=self.ordered, **kwargs)(func)
+
+        return wrapper
@@ -0,0 +1,141 @@
+from datetime import datetime
+from typing import Callable
+
+from flask_restx import Model, fields, marshal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_serializers = {}
+_projections = {}
+
+
+def _scalar_code(field: fields.Raw, value: str, env: dict) -> str:
+    """Expression formatting value like field.format, or None if the field has
+    no fast path"""
+    if type(field) is fields.String:
+        return "str({})".format(value)
+    if type(field) is fields.Integer:
+        return "int({})".format(value)
+    if type(field) is fields.DateTime and field.dt_format == "iso8601":
+        name = "_format_{}".format(len(env))
+        env[name] = field.format
+        return "({0}.isoformat() if type({0}) is _datetime else {1}({0}))".format(
+            value, name
+        )
+    return None
+
+
+def _fallback_code(field: fields.Raw, key: str, env: dict) -> str:
+    name = "_field_{}".format(len(env))
+    env[name] = field
+    return "{}.output({!r}, _data)".format(name, key)
+
+
+def _field_code(field: fields.Raw, key: str, access: str, var: str, env: dict) -> str:
+    """Expression producing the marshalled value of a field read with access"""
+    if field.default is not None or access is None:
+        return _fallback_code(field, key, env)
+    if isinstance(field, fields.Nested) and not field.skip_none:
+        serializer = "_nested_{}".format(len(env))
+        env[serializer] = get_serializer(field.nested)
+        if field.allow_null:
+            return "(None if ({0} := {1}) is None else {2}({0}))".format(
+                var, access, serializer
+            )
+        return "{}({})".format(serializer, access)
+    if type(field) is fields.List and field.container.default is None:
+        container = field.container
+        if isinstance(container, fields.Nested) and not container.skip_none:
+            serializer = "_nested_{}".format(len(env))
+            env[serializer] = get_serializer(container.nested)
+            item = "{}(_item)".format(serializer)
+            if container.allow_null:
+                item = "(None if _item is None else {})".format(item)
+        else:
+            item = _scalar_code(container, "_item", env)
+            if item is not None:
+                item = "(None if _item is None else {})".format(item)
+        if item is None:
+            return _fallback_code(field, key, env)
+        return "(None if ({0} := {1}) is None else [{2} for _item in {0}])".format(
+            var, access, item
+        )
+    scalar = _scalar_code(field, var, env)
+    if scalar is None:
+        return _fallback_code(field, key, env)
+    return "(None if ({0} := {1}) is None else {2})".format(var, access, scalar)
+
+
+def compile_serializer(model: Model) -> Callable[[any], dict]:
+    """Build a function producing the same dict as flask_restx.marshal(data,
+    model) for one dict or object, without walking the field machinery on
+    each call. Fields without a fast path still go through flask_restx"""
+    env = {"_datetime": datetime, "_marshal": marshal}
+    entries = {"dict": [], "object": []}
+    for index, (key, field) in enumerate(model.items()):
+        var = "_v{}".format(index)
+        if isinstance(field, dict):  # inline nested model
+            name = "_fields_{}".format(len(env))
+            env[name] = field
+            for kind in entries:
+                entries[kind].append("{!r}: _marshal(_data, {})".format(key, name))
+            continue
+        field = field() if isinstance(field, type) else field
+        attribute = key if field.attribute is None else field.attribute
+        simple = isinstance(attribute, str) and "." not in attribute
+        accesses = {
+            "dict": "_data.get({!r})".format(attribute) if simple else None,
+            "object": (
+                "getattr(_data, {!r}, None)".format(attribute) if simple else None
+            ),
+        }
+        for kind in entries:
+            code = _field_code(field, key, accesses[kind], var, env)
+            entries[kind].append("{!r}: {}".format(key, code))
+
+    source = (
+        "def serialize(_data):\n"
+        "    if isinstance(_data, dict):\n"
+        "        return {{{}}}\n"
+        "    return {{{}}}\n"
+    ).format(", ".join(entries["dict"]), ", ".join(entries["object"]))
+    exec(compile(source, "<serializer {}>".format(model.name), "exec"), env)
+    return env["serialize"]
+
+
+def get_serializer(model: Model) -> Callable[[any], dict]:
+    """Compiled serializer of a model, built on first use"""
+    serializer = _serializers.get(model.name)
+    if serializer is None:
+        serializer = _serializers[model.name] = compile_serializer(model)
+    return serializer
+
+
+def project_page_model(model: Model, names: list[str]) -> Model:
+    """Copy of a list model whose {items} only keep the named fields. None
+    names keeps the model as it is"""
+    if names is None:
+        return model
+    name = "{}[{}]".format(model.name, ",".join(names))
+    projected = _projections.get(name)
+    if projected is None:
+        items = model["items"].container.nested
+        item_fields = [(key, field) for key, field in items.items() if key in names]
+        page_fields = dict(model)
+        page_fields["items"] = fields.List(
+            fields.Nested(
+                Model("{}[{}]".format(items.name, ",".join(names)), item_fields)
+            )
+        )
+        projected = _projections[name] = Model(name, page_fields)
+    return projected
+
+
+def dump_json(data: any) -> bytes:
+    """orjson encoding of an already marshalled body, None without orjson"""
+    if orjson is None:
+        return None
+    return orjson.dumps(data) + b"\n"
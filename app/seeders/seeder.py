@@ -1,5 +1,21 @@
+from itertools import islice
+from time import perf_counter
+
+import numpy as np
 from config import Config, db
-from services import save_new_tag, save_new_taxon
+from models import TAXON_CLASS_TYPES, Tag, Taxon, taxon_closure, taxon_tag, utcnow
+from services import (
+    autocomplete_index,
+    clear_caches,
+    rebuild_taxon_search_index,
+    save_new_tag,
+    save_new_taxon,
+    taxon_tag_index,
+    taxonomy_snapshot,
+)
+from sqlalchemy import func, insert, select, text
+
+_CHUNK_SIZE = Config.IMPORT_CHUNK_SIZE
 
 tag_seeder_list = [
     {
@@ -42,7 +58,7 @@ taxon_seeder_list = [
         "extinction": None,
         "individuals_number": 10000,
         "superior_taxon": None,
-        "tags": [1, 2, 3]
+        "tags_ids": [1, 2, 3],
     },
     {
         "taxon_class": "domain",
@@ -53,7 +69,7 @@ taxon_seeder_list = [
         "extinction": None,
         "individuals_number": 1000,
         "superior_taxon": 1,
-        "tags": [1, 2, 3]
+        "tags_ids": [1, 2, 3],
     },
     {
         "taxon_class": "kingdom",
@@ -64,7 +80,7 @@ taxon_seeder_list = [
         "extinction": None,
         "individuals_number": 100,
         "superior_taxon": 2,
-        "tags": [1, 2]
+        "tags_ids": [1, 2],
     },
 ]
 
@@ -73,6 +89,7 @@ def seed_db_tags():
     for tag in tag_seeder_list:
         save_new_tag(tag)
 
+
 def seed_db_taxons():
     for taxon in taxon_seeder_list:
         save_new_taxon(taxon)
@@ -81,3 +98,281 @@ def seed_db_taxons():
 def seed_db():
     seed_db_tags()
     seed_db_taxons()
+
+
+# Mean number of inferior taxons per rank of a synthetic taxonomy, most of the
+# tree being species
+SYNTHETIC_BRANCHING = {
+    "domain": 3,
+    "kingdom": 3,
+    "phylum": 4,
+    "class": 4,
+    "order": 5,
+    "family": 5,
+    "genus": 6,
+    "species": 8,
+}
+
+
+def _scale_branching(
+    branching: dict[str, float], level_size: int, size: float
+) -> dict[str, float]:
+    """branching multiplied by the factor making the expected number of
+    inferiors of level_size taxons about size"""
+
+    def expected(scale):
+        total, level = 0.0, level_size
+        for mean in branching.values():
+            level *= max(1.0, mean * scale)
+            total += level
+        return total
+
+    low, high = 0.0, 100.0
+    for _ in range(60):
+        scale = (low + high) / 2
+        low, high = (scale, high) if expected(scale) < size else (low, scale)
+    return {rank: max(1.0, mean * high) for rank, mean in branching.items()}
+
+
+def generate_taxonomy(
+    size: int,
+    branching: dict[str, float] = None,
+    tags_ids: list[int] = (),
+    tags_weights: list[float] = None,
+    max_tags_per_taxon: int = 3,
+    origin_range: tuple[int, int] = (1, 4000),
+    extinction_rate: float = 0.2,
+    first_id: int = 1,
+    seed: int = 0,
+) -> dict[str, np.ndarray]:
+    """Columns of a valid synthetic tree of at most size taxons, built breadth
+    first in TAXON_CLASS_TYPES order under one new life taxon.
+
+    Each taxon gets 1 + Poisson(branching[rank] - 1) inferiors. Without
+    branching, SYNTHETIC_BRANCHING is rescaled at each rank so that the tree
+    reaches about size taxons whatever the draws of the upper ranks. Origins
+    fall within the superior's lifetime and, with extinction_rate or when the
+    superior is extinct, extinctions before the superior's. Tags are drawn
+    without replacement with tags_weights, by default 1/n so a few tags are
+    much more common. Ids are contiguous from first_id, in generation order.
+    """
+    rng = np.random.default_rng(seed)
+    adaptive = branching is None
+    branching = {
+        taxon_class: mean
+        for taxon_class, mean in (branching or SYNTHETIC_BRANCHING).items()
+        if taxon_class in TAXON_CLASS_TYPES[1:]
+    }
+    oldest, youngest = origin_range[1], origin_range[0]
+
+    ranks = [np.zeros(1, np.int64)]
+    superiors = [np.full(1, -1, np.int64)]
+    origins = [np.array([oldest], np.int64)]
+    extinctions = [np.full(1, -1, np.int64)]
+    count = 1
+    for rank, taxon_class in enumerate(TAXON_CLASS_TYPES[1:], start=1):
+        if taxon_class not in branching or count >= size:
+            break
+        level_size = len(origins[-1])
+        mean = branching[taxon_class]
+        if adaptive:
+            remaining = dict(list(branching.items())[rank - 1 :])
+            mean = _scale_branching(remaining, level_size, size - count)[taxon_class]
+        children = 1 + rng.poisson(max(0.0, mean - 1), level_size)
+        parents = np.repeat(np.arange(level_size), children)[: size - count]
+        first_parent = count - level_size
+
+        parent_origin = origins[-1][parents]
+        parent_extinction = extinctions[-1][parents]
+        low = np.maximum(youngest, parent_extinction + 1)
+        origin = rng.integers(low, np.maximum(low, parent_origin) + 1)
+        extinct = (parent_extinction >= 0) | (
+            rng.random(len(parents)) < extinction_rate
+        )
+        extinction = rng.integers(np.maximum(parent_extinction, 0), origin)
+        extinction = np.where(extinct, extinction, -1)
+
+        ranks.append(np.full(len(parents), rank, np.int64))
+        superiors.append(parents + first_parent)
+        origins.append(origin)
+        extinctions.append(extinction)
+        count += len(parents)
+
+    superior = np.concatenate(superiors)
+    taxonomy = {
+        "id": np.arange(first_id, first_id + count, dtype=np.int64),
+        "rank": np.concatenate(ranks),
+        "superior_taxon": np.where(superior >= 0, superior + first_id, -1),
+        "origin": np.concatenate(origins),
+        "extinction": np.concatenate(extinctions),
+        "individuals_number": rng.integers(1, 10000, count),
+    }
+
+    # Distinct weighted tags per taxon: the smallest keys of Exp(1)/weight
+    tags_ids = np.asarray(tags_ids, np.int64)
+    taxon_ids = tag_ids = np.zeros(0, np.int64)
+    if len(tags_ids) and max_tags_per_taxon > 0:
+        if tags_weights is None:
+            tags_weights = 1 / np.arange(1, len(tags_ids) + 1)
+        keys = rng.exponential(size=(count, len(tags_ids))) / np.asarray(tags_weights)
+        order = np.argsort(keys, axis=1)
+        tags_count = rng.integers(0, min(max_tags_per_taxon, len(tags_ids)) + 1, count)
+        picked = np.arange(len(tags_ids)) < tags_count[:, None]
+        taxon_ids = np.repeat(taxonomy["id"], tags_count)
+        tag_ids = tags_ids[order[picked]]
+    taxonomy["tag_taxon_id"] = taxon_ids
+    taxonomy["tag_id"] = tag_ids
+    return taxonomy
+
+
+def _closure_and_aggregates(taxonomy: dict[str, np.ndarray]) -> tuple:
+    """Closure columns (ancestor, descendant, depth) of a generated taxonomy
+    and the descendant_count, species_count and individuals_sum of each taxon,
+    computed from the ancestor chains instead of SQL"""
+    ids, rank = taxonomy["id"], taxonomy["rank"]
+    superior = taxonomy["superior_taxon"] - ids[0]
+    count = len(ids)
+    species = (rank == TAXON_CLASS_TYPES.index("species")).astype(np.int64)
+    ancestors, descendants, depths = [], [], []
+    # chain[:, d] is the ancestor at depth d of the nodes of the current rank
+    for level in np.unique(rank):
+        nodes = np.flatnonzero(rank == level)
+        if level == 0:
+            chain = nodes[:, None]
+        else:
+            parent_row = np.searchsorted(previous, superior[nodes])
+            chain = np.column_stack([chain[parent_row], nodes])
+        previous = nodes
+        for depth in range(chain.shape[1]):
+            ancestors.append(chain[:, depth])
+            descendants.append(nodes)
+            depths.append(np.full(len(nodes), chain.shape[1] - 1 - depth, np.int64))
+
+    # Primary key order, so the inserts append to the closure b-tree
+    ancestor = np.concatenate(ancestors)
+    descendant = np.concatenate(descendants)
+    order = np.lexsort((descendant, ancestor))
+    ancestor, descendant = ancestor[order], descendant[order]
+    depth = np.concatenate(depths)[order]
+    aggregates = {
+        "descendant_count": np.bincount(ancestor, minlength=count) - 1,
+        "species_count": np.bincount(
+            ancestor, weights=species[descendant], minlength=count
+        ).astype(np.int64),
+        "individuals_sum": np.bincount(
+            ancestor,
+            weights=taxonomy["individuals_number"][descendant],
+            minlength=count,
+        ).astype(np.int64),
+    }
+    return (ancestor + ids[0], descendant + ids[0], depth), aggregates
+
+
+def _insert_columns(table, columns: dict[str, list], chunk_size: int) -> None:
+    """executemany INSERT of equal length columns straight on the DBAPI cursor,
+    applying the column bind processors up front instead of SQLAlchemy building
+    the parameters of every row"""
+    connection = db.session.connection()
+    dialect = connection.dialect
+    statement = insert(table).compile(dialect=dialect, column_keys=list(columns))
+    for key, values in columns.items():
+        processor = table.c[key].type.dialect_impl(dialect).bind_processor(dialect)
+        if processor is not None:
+            columns[key] = [processor(value) for value in values]
+    if dialect.positional:
+        order = [columns[key] for key in statement.positiontup]
+        rows = zip(*order)
+    else:
+        rows = (dict(zip(columns, row)) for row in zip(*columns.values()))
+    cursor = connection.connection.cursor()
+    try:
+        while chunk := list(islice(rows, chunk_size)):
+            cursor.executemany(statement.string, chunk)
+    finally:
+        cursor.close()
+
+
+def _nullable(values: np.ndarray) -> list:
+    """-1 marks a missing value in the generated columns"""
+    return [None if value < 0 else value for value in values.tolist()]
+
+
+def seed_db_synthetic_taxonomy(
+    size: int, chunk_size: int = _CHUNK_SIZE, **options
+) -> dict[str, any]:
+    """Write a generate_taxonomy tree straight to the taxons, taxon_closure and
+    taxon_tag tables, aggregates included, in one transaction. The tags are the
+    ones already in the database"""
+    start = perf_counter()
+    first_id = (db.session.execute(select(func.max(Taxon.id))).scalar() or 0) + 1
+    tags_ids = db.session.execute(select(Tag.id).order_by(Tag.id)).scalars().all()
+    taxonomy = generate_taxonomy(size, tags_ids=tags_ids, first_id=first_id, **options)
+    (ancestor, descendant, depth), aggregates = _closure_and_aggregates(taxonomy)
+
+    # The search index and the closure lookup index are built once at the end
+    # instead of row by row
+    if db.engine.dialect.name == "sqlite":
+        db.session.execute(text("DROP TRIGGER IF EXISTS taxons_fts_insert"))
+    connection = db.session.connection()
+    for index in taxon_closure.indexes:
+        index.drop(connection)
+
+    taxon_classes = [TAXON_CLASS_TYPES[rank] for rank in taxonomy["rank"].tolist()]
+    ids = taxonomy["id"].tolist()
+    _insert_columns(
+        Taxon.__table__,
+        {
+            "id": ids,
+            "taxon_class": taxon_classes,
+            "name": [
+                "{} {}".format(taxon_class, taxon_id)
+                for taxon_class, taxon_id in zip(taxon_classes, ids)
+            ],
+            "description": [
+                "Synthetic {} description".format(taxon_class)
+                for taxon_class in taxon_classes
+            ],
+            "origin": taxonomy["origin"].tolist(),
+            "extinction": _nullable(taxonomy["extinction"]),
+            "individuals_number": taxonomy["individuals_number"].tolist(),
+            "superior_taxon": _nullable(taxonomy["superior_taxon"]),
+            "descendant_count": aggregates["descendant_count"].tolist(),
+            "species_count": aggregates["species_count"].tolist(),
+            "individuals_sum": aggregates["individuals_sum"].tolist(),
+            "version": [1] * len(ids),
+            "updated_at": [utcnow()] * len(ids),
+        },
+        chunk_size,
+    )
+    _insert_columns(
+        taxon_closure,
+        {
+            "ancestor_id": ancestor.tolist(),
+            "descendant_id": descendant.tolist(),
+            "depth": depth.tolist(),
+        },
+        chunk_size,
+    )
+    _insert_columns(
+        taxon_tag,
+        {
+            "taxon_id": taxonomy["tag_taxon_id"].tolist(),
+            "tag_id": taxonomy["tag_id"].tolist(),
+        },
+        chunk_size,
+    )
+    for index in taxon_closure.indexes:
+        index.create(connection)
+    db.session.commit()
+    rebuild_taxon_search_index()
+    clear_caches()
+    taxonomy_snapshot.mark_stale()
+    taxon_tag_index.mark_stale()
+    autocomplete_index.mark_stale()
+    return {
+        "taxons": len(ids),
+        "closure_rows": len(ancestor),
+        "tags": len(taxonomy["tag_id"]),
+        "first_id": first_id,
+        "seconds": round(perf_counter() - start, 3),
+    }
@@ -1,2 +1,18 @@
 from .tag_service import *
-from .taxon_service import *
\ No newline at end of file
+from .tag_facet_service import *
+from .taxon_service import *
+from .taxon_closure_service import *
+from .taxon_aggregate_service import *
+from .taxon_import_service import *
+from .taxon_search_service import *
+from .cache_service import *
+from .taxonomy_snapshot_service import *
+from .taxon_tag_index_service import *
+from .taxon_timeline_service import *
+from .taxon_lineage_service import *
+from .taxon_autocomplete_service import *
+from .taxon_resolve_service import *
+from .taxon_export_service import *
+from .taxon_batch_service import *
+from .instrumentation_service import *
+from .image_service import *
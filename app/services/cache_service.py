@@ -0,0 +1,100 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Callable, Hashable
+
+from config import Config
+
+
+class PayloadCache:
+    """Bounded LRU cache whose entries also expire after ttl seconds.
+
+    The cache lives in the worker process: writes handled by this process
+    invalidate it precisely, writes from other processes only show up once the
+    ttl expires. A max_size of 0 disables it.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._generation = 0  # bumped by every invalidation
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: any, generation: int = None) -> None:
+        """Store a value. With a generation, nothing is stored when the cache
+        was invalidated since that generation was read"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[key] = (monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_load(self, key: Hashable, loader: Callable[[], any]) -> any:
+        """Cached value of key, or the loader's. A write invalidating the cache
+        while the loader runs may have been missed by it, so that value is
+        returned but not stored"""
+        with self._lock:
+            generation = self._generation
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            self.set(key, value, generation)
+        return value
+
+    def invalidate(self, *keys: Hashable) -> None:
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+taxon_cache = PayloadCache(Config.TAXON_CACHE_SIZE, Config.CACHE_TTL_SECONDS)
+tag_cache = PayloadCache(Config.TAG_CACHE_SIZE, Config.CACHE_TTL_SECONDS)
+facet_cache = PayloadCache(Config.FACET_CACHE_SIZE, Config.FACET_CACHE_TTL_SECONDS)
+
+
+def get_cache_stats() -> dict[str, dict[str, int]]:
+    return {
+        "taxon": taxon_cache.stats(),
+        "tag": tag_cache.stats(),
+        "facet": facet_cache.stats(),
+    }
+
+
+def clear_caches() -> None:
+    taxon_cache.clear()
+    tag_cache.clear()
+    facet_cache.clear()
@@ -0,0 +1,300 @@
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+
+from config import Config, db
+from flask import Response, send_file
+from models import IMAGES_ORIGINS, Image, Tag, Taxon
+from PIL import Image as PillowImage
+from PIL import ImageOps, UnidentifiedImageError
+from responses import DefaultException, response
+from sqlalchemy import delete, select
+from werkzeug.datastructures import FileStorage, ImmutableMultiDict
+
+_STORAGE_PATH = Config.IMAGE_STORAGE_PATH
+_RENDITIONS = Config.IMAGE_RENDITIONS
+_WEBP_QUALITY = Config.IMAGE_WEBP_QUALITY
+_WORKERS = Config.IMAGE_WORKERS
+_RENDER_TIMEOUT = Config.IMAGE_RENDER_TIMEOUT_SECONDS
+_CACHE_MAX_AGE = Config.IMAGE_CACHE_MAX_AGE_SECONDS
+_READ_CHUNK = 64 * 1024
+_CONTENT_HASH = re.compile(r"[0-9a-f]{64}")
+# Pillow formats accepted on upload
+IMAGE_CONTENT_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "GIF": "image/gif",
+    "WEBP": "image/webp",
+}
+IMAGE_FILE_URL = "/image/file/{}/{}"
+# Images belong to a tag or a taxon, they are deleted with it
+_ORIGIN_MODELS = {"tag": (Tag, "Tag_not_found"), "taxon": (Taxon, "Taxon_not_found")}
+
+
+def _directory(content_hash: str) -> str:
+    return os.path.join(_STORAGE_PATH, content_hash[:2], content_hash)
+
+
+def _file_path(content_hash: str, rendition: str) -> str:
+    """Path of the original, or of a WebP rendition"""
+    name = "original" if rendition == "original" else rendition + ".webp"
+    return os.path.join(_directory(content_hash), name)
+
+
+def render_image(original: str, renditions: dict[str, int], quality: int) -> None:
+    """Write the WebP renditions next to the original, largest first, each one
+    shrunk from the previous. Runs in a worker process"""
+    directory = os.path.dirname(original)
+    with PillowImage.open(original) as image:
+        largest = max(renditions.values())
+        image.draft("RGB", (largest, largest))  # JPEGs decode at a reduced scale
+        image = ImageOps.exif_transpose(image)
+        transparent = "A" in image.getbands() or "transparency" in image.info
+        image = image.convert("RGBA" if transparent else "RGB")
+        for name, size in sorted(renditions.items(), key=lambda item: -item[1]):
+            image.thumbnail((size, size), PillowImage.Resampling.LANCZOS)
+            path = os.path.join(directory, name + ".webp")
+            temporary = "{}.{}.tmp".format(path, os.getpid())
+            image.save(temporary, "WEBP", quality=quality)
+            os.replace(temporary, path)
+
+
+_pool = None
+_jobs = {}  # content hash -> Future of its renditions
+_jobs_lock = Lock()
+
+
+def _render_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=_WORKERS)
+    return _pool
+
+
+def _renditions_ready(content_hash: str) -> bool:
+    return all(os.path.exists(_file_path(content_hash, name)) for name in _RENDITIONS)
+
+
+def _submit_renditions(content_hash: str) -> Future:
+    """Render the missing renditions in the pool, at most one job per file"""
+    with _jobs_lock:
+        job = _jobs.get(content_hash)
+        if job is None:
+            job = _render_pool().submit(
+                render_image,
+                _file_path(content_hash, "original"),
+                _RENDITIONS,
+                _WEBP_QUALITY,
+            )
+            _jobs[content_hash] = job
+            job.add_done_callback(lambda _: _jobs.pop(content_hash, None))
+    return job
+
+
+def _ensure_renditions(content_hash: str) -> None:
+    """Wait for the renditions of a file, rendering them here when no job
+    is running, e.g. after a restart or with IMAGE_WORKERS at 0"""
+    if _renditions_ready(content_hash):
+        return
+    try:
+        job = _jobs.get(content_hash)
+        if job is not None:
+            job.result(timeout=_RENDER_TIMEOUT)
+        else:
+            render_image(
+                _file_path(content_hash, "original"), _RENDITIONS, _WEBP_QUALITY
+            )
+    except (OSError, ValueError, BrokenProcessPool, FutureTimeoutError):
+        raise DefaultException(message="Image_rendition_failed", code=503)
+
+
+def _store_upload(file: FileStorage) -> tuple[str, str, tuple[int, int]]:
+    """Hash the upload while writing it to disk, then move it to its content
+    address unless that file is already stored. Returns the hash, the content
+    type and the size in pixels"""
+    os.makedirs(_STORAGE_PATH, exist_ok=True)
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=_STORAGE_PATH, delete=False) as temporary:
+        for chunk in iter(lambda: file.stream.read(_READ_CHUNK), b""):
+            digest.update(chunk)
+            temporary.write(chunk)
+    try:
+        with PillowImage.open(temporary.name) as image:
+            image_format, dimensions = image.format, image.size
+            image.verify()
+        if image_format not in IMAGE_CONTENT_TYPES:
+            raise DefaultException(message="Unsupported_image_format", code=400)
+        content_hash = digest.hexdigest()
+        os.makedirs(_directory(content_hash), exist_ok=True)
+        original = _file_path(content_hash, "original")
+        if not os.path.exists(original):
+            os.replace(temporary.name, original)
+    except (
+        UnidentifiedImageError,
+        OSError,
+        SyntaxError,
+        PillowImage.DecompressionBombError,
+    ):
+        raise DefaultException(message="Invalid_image", code=400)
+    finally:
+        if os.path.exists(temporary.name):
+            os.remove(temporary.name)
+    return content_hash, IMAGE_CONTENT_TYPES[image_format], dimensions
+
+
+def _origin_param(params: ImmutableMultiDict) -> tuple[str, int]:
+    origin = params.get("origin", type=str)
+    origin_id = params.get("origin_id", type=int)
+    if origin not in IMAGES_ORIGINS or origin_id is None:
+        raise DefaultException(message="Invalid_image_origin", code=400)
+    return origin, origin_id
+
+
+def serialize_image(image: Image) -> dict[str, any]:
+    return {
+        "id": image.id,
+        "origin": image.origin,
+        "origin_id": image.origin_id,
+        "url": image.url,
+        "content_hash": image.content_hash,
+        "content_type": image.content_type,
+        "size": image.size,
+        "width": image.width,
+        "height": image.height,
+        "created_at": image.created_at,
+        "renditions": {
+            name: IMAGE_FILE_URL.format(image.content_hash, name)
+            for name in _RENDITIONS
+        },
+        "renditions_ready": _renditions_ready(image.content_hash),
+    }
+
+
+def get_image(image_id: int) -> Image:
+    image = db.session.get(Image, image_id)
+    if image is None:
+        raise DefaultException(message="Image_not_found", code=404)
+    return image
+
+
+def get_images(params: ImmutableMultiDict) -> dict[str, any]:
+    """Images of the {origin} tag or taxon with id {origin_id}"""
+    origin, origin_id = _origin_param(params)
+    images = Image.query.filter_by(origin=origin, origin_id=origin_id).order_by(
+        Image.id
+    )
+    return {"items": [serialize_image(image) for image in images]}
+
+
+def save_new_image(file: FileStorage, form: ImmutableMultiDict) -> tuple[dict, int]:
+    """Store an uploaded image of a tag or taxon. The same file uploaded again
+    for the same origin returns the existing image"""
+    origin, origin_id = _origin_param(form)
+    model, not_found = _ORIGIN_MODELS[origin]
+    if db.session.get(model, origin_id) is None:
+        raise DefaultException(message=not_found, code=404)
+    if file is None:
+        raise DefaultException(message="Image_file_is_required", code=400)
+
+    content_hash, content_type, (width, height) = _store_upload(file)
+    image = Image.query.filter_by(
+        origin=origin, origin_id=origin_id, content_hash=content_hash
+    ).first()
+    if image is not None:
+        return serialize_image(image), 200
+
+    image = Image(
+        origin=origin,
+        origin_id=origin_id,
+        url=IMAGE_FILE_URL.format(content_hash, "original"),
+        content_hash=content_hash,
+        content_type=content_type,
+        size=os.path.getsize(_file_path(content_hash, "original")),
+        width=width,
+        height=height,
+    )
+    db.session.add(image)
+    db.session.commit()
+    if not _renditions_ready(content_hash):
+        if _WORKERS:
+            _submit_renditions(content_hash)
+        else:
+            _ensure_renditions(content_hash)
+    return serialize_image(image), 201
+
+
+def delete_origin_images(origin: str, origin_id: int) -> list[str]:
+    """Delete the images of a tag or taxon in the current transaction. Returns
+    their content hashes, to pass to remove_unused_image_files once committed"""
+    owned = (Image.origin == origin, Image.origin_id == origin_id)
+    content_hashes = (
+        db.session.execute(select(Image.content_hash).where(*owned)).scalars().all()
+    )
+    if content_hashes:
+        db.session.execute(delete(Image).where(*owned))
+    return content_hashes
+
+
+def remove_unused_image_files(content_hashes: list[str]) -> None:
+    """Remove the stored files that no image references anymore. A rendition
+    job still writing into a directory is cancelled, or waited for when it
+    already runs, before the directory goes"""
+    if not content_hashes:
+        return
+    used = set(
+        db.session.execute(
+            select(Image.content_hash).where(Image.content_hash.in_(content_hashes))
+        ).scalars()
+    )
+    for content_hash in set(content_hashes) - used:
+        job = _jobs.get(content_hash)
+        if job is not None and not job.cancel():
+            wait([job], timeout=_RENDER_TIMEOUT)
+        shutil.rmtree(_directory(content_hash), ignore_errors=True)
+
+
+def delete_image_by_id(image_id: int) -> dict[str, any]:
+    """Delete an image, and its files once no other image shares them"""
+    image = get_image(image_id)
+    content_hash = image.content_hash
+    db.session.delete(image)
+    db.session.commit()
+    remove_unused_image_files([content_hash])
+    return response(status="success", message="Image_successfully_deleted", code=200)
+
+
+def send_image_file(content_hash: str, rendition: str) -> Response:
+    """Original or rendition of a stored file. Content addressed files never
+    change, so they are cached for good; send_file answers Range and
+    If-None-Match requests and hands the file to the server's sendfile"""
+    if rendition != "original" and rendition not in _RENDITIONS:
+        raise DefaultException(message="Image_rendition_not_found", code=404)
+    content_type = None
+    if _CONTENT_HASH.fullmatch(content_hash):
+        content_type = db.session.execute(
+            select(Image.content_type)
+            .where(Image.content_hash == content_hash)
+            .limit(1)
+        ).scalar()
+    if content_type is None:
+        raise DefaultException(message="Image_not_found", code=404)
+
+    if rendition != "original":
+        _ensure_renditions(content_hash)
+        content_type = "image/webp"
+    file_response = send_file(
+        _file_path(content_hash, rendition),
+        mimetype=content_type,
+        conditional=True,
+        etag="{}-{}".format(content_hash, rendition),
+        max_age=_CACHE_MAX_AGE,
+    )
+    file_response.cache_control.public = True
+    file_response.cache_control.immutable = True
+    return file_response
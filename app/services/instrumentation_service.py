@@ -0,0 +1,246 @@
+from bisect import bisect_left
+from collections import defaultdict
+from threading import Lock
+from time import perf_counter
+
+from config import db
+from flask import Flask, Response, g, has_request_context, request
+from flask.signals import request_finished, request_started
+from sqlalchemy import event
+
+from .cache_service import get_cache_stats
+
+# Upper bounds of the request duration histogram, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+_STATEMENT_MAX_LENGTH = 200
+
+
+class RequestStats:
+    """SQL and marshalling time of the request being handled, kept in g"""
+
+    __slots__ = ("start", "queries", "sql_seconds", "slowest", "marshal_seconds")
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.slowest = (0.0, None)
+        self.marshal_seconds = 0.0
+
+    def add_query(self, statement: str, seconds: float) -> None:
+        self.queries += 1
+        self.sql_seconds += seconds
+        if seconds > self.slowest[0]:
+            self.slowest = (seconds, statement)
+
+    def server_timing(self, total_seconds: float) -> str:
+        return (
+            'db;dur={:.3f};desc="{} queries", marshal;dur={:.3f}, '
+            "total;dur={:.3f}".format(
+                self.sql_seconds * 1000,
+                self.queries,
+                self.marshal_seconds * 1000,
+                total_seconds * 1000,
+            )
+        )
+
+
+class EndpointMetrics:
+    """Totals of every request served by one endpoint and method"""
+
+    def __init__(self):
+        self.requests = defaultdict(int)  # by status code
+        self.buckets = [0] * (len(DURATION_BUCKETS) + 1)
+        self.duration_seconds = 0.0
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.marshal_seconds = 0.0
+        self.slowest = (0.0, None)
+
+    def add(self, stats: RequestStats, status: int, seconds: float) -> None:
+        self.requests[status] += 1
+        self.buckets[bisect_left(DURATION_BUCKETS, seconds)] += 1
+        self.duration_seconds += seconds
+        self.queries += stats.queries
+        self.sql_seconds += stats.sql_seconds
+        self.marshal_seconds += stats.marshal_seconds
+        if stats.slowest[0] > self.slowest[0]:
+            self.slowest = stats.slowest
+
+
+def _labels(**labels) -> str:
+    return ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels.items()
+    )
+
+
+class Instrumentation:
+    """Per endpoint request metrics of one app, rendered in the Prometheus text
+    format"""
+
+    def __init__(self):
+        self.endpoints = defaultdict(EndpointMetrics)
+        self._lock = Lock()
+
+    def record(self, stats: RequestStats, status: int, seconds: float) -> None:
+        key = (request.endpoint or "unmatched", request.method)
+        with self._lock:
+            self.endpoints[key].add(stats, status, seconds)
+
+    def render(self) -> str:
+        lines = []
+
+        def metric(name: str, kind: str, text: str, samples) -> None:
+            lines.append("# HELP {} {}".format(name, text))
+            lines.append("# TYPE {} {}".format(name, kind))
+            for suffix, labels, value in samples:
+                lines.append("{}{}{{{}}} {}".format(name, suffix, labels, value))
+
+        def per_endpoint(value) -> list:
+            return [
+                ("", _labels(endpoint=endpoint, method=method), value(metrics))
+                for (endpoint, method), metrics in endpoints
+            ]
+
+        with self._lock:
+            endpoints = sorted(self.endpoints.items())
+            metric(
+                "http_requests_total",
+                "counter",
+                "Requests served, by endpoint, method and status",
+                [
+                    (
+                        "",
+                        _labels(endpoint=endpoint, method=method, status=status),
+                        count,
+                    )
+                    for (endpoint, method), metrics in endpoints
+                    for status, count in sorted(metrics.requests.items())
+                ],
+            )
+            histogram = []
+            for (endpoint, method), metrics in endpoints:
+                bounds = DURATION_BUCKETS + ("+Inf",)
+                cumulative = 0
+                for bound, count in zip(bounds, metrics.buckets):
+                    cumulative += count
+                    labels = _labels(endpoint=endpoint, method=method, le=bound)
+                    histogram.append(("_bucket", labels, cumulative))
+                labels = _labels(endpoint=endpoint, method=method)
+                histogram.append(("_sum", labels, round(metrics.duration_seconds, 6)))
+                histogram.append(("_count", labels, cumulative))
+            metric(
+                "http_request_duration_seconds",
+                "histogram",
+                "Request handling time",
+                histogram,
+            )
+            metric(
+                "db_queries_total",
+                "counter",
+                "SQL statements executed",
+                per_endpoint(lambda metrics: metrics.queries),
+            )
+            metric(
+                "db_query_seconds_total",
+                "counter",
+                "Time spent in SQL statements",
+                per_endpoint(lambda metrics: round(metrics.sql_seconds, 6)),
+            )
+            metric(
+                "db_slowest_query_seconds",
+                "gauge",
+                "Slowest SQL statement seen",
+                per_endpoint(lambda metrics: round(metrics.slowest[0], 6)),
+            )
+            metric(
+                "marshal_seconds_total",
+                "counter",
+                "Time spent serializing responses",
+                per_endpoint(lambda metrics: round(metrics.marshal_seconds, 6)),
+            )
+            # Scrapers ignore comments, the statements are there for humans
+            for (endpoint, method), metrics in endpoints:
+                if metrics.slowest[1] is not None:
+                    statement = " ".join(metrics.slowest[1].split())
+                    lines.append(
+                        "# slowest {} {}: {}".format(
+                            method, endpoint, statement[:_STATEMENT_MAX_LENGTH]
+                        )
+                    )
+
+        caches = get_cache_stats()
+        for name, key, kind in (
+            ("cache_hits_total", "hits", "counter"),
+            ("cache_misses_total", "misses", "counter"),
+            ("cache_entries", "size", "gauge"),
+        ):
+            metric(
+                name,
+                kind,
+                "Payload cache {}".format(key),
+                [
+                    ("", _labels(cache=cache), stats[key])
+                    for cache, stats in caches.items()
+                ],
+            )
+        return "\n".join(lines) + "\n"
+
+
+# Start times are keyed by execution context, so a statement that fails, and
+# never reaches after_cursor_execute, cannot shift the times of the next ones
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", {})[context] = perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info["query_start"].pop(context, None)
+    if start is None:
+        return
+    seconds = perf_counter() - start
+    if has_request_context():
+        stats = g.get("request_stats")
+        if stats is not None:
+            stats.add_query(statement, seconds)
+
+
+def _handle_error(exception_context) -> None:
+    """Drop the start time of a failed statement"""
+    conn = exception_context.connection
+    if conn is not None:
+        conn.info.get("query_start", {}).pop(exception_context.execution_context, None)
+
+
+def _request_started(app: Flask, **extra) -> None:
+    g.request_stats = RequestStats()
+
+
+def _request_finished(app: Flask, response: Response, **extra) -> None:
+    stats = g.pop("request_stats", None)
+    if stats is None:
+        return
+    seconds = perf_counter() - stats.start
+    app.extensions["instrumentation"].record(stats, response.status_code, seconds)
+    if app.config["INSTRUMENTATION_SERVER_TIMING"]:
+        response.headers["Server-Timing"] = stats.server_timing(seconds)
+
+
+def init_instrumentation(app: Flask) -> Instrumentation:
+    """Record per endpoint query counts, SQL time, slowest statement and
+    marshalling time, served at METRICS_PATH and in a Server-Timing header"""
+    instrumentation = app.extensions["instrumentation"] = Instrumentation()
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(db.engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(db.engine, "handle_error", _handle_error)
+    request_started.connect(_request_started, app)
+    request_finished.connect(_request_finished, app)
+    app.add_url_rule(
+        app.config["METRICS_PATH"],
+        "metrics",
+        lambda: Response(
+            instrumentation.render(), mimetype="text/plain; version=0.0.4"
+        ),
+    )
+    return instrumentation
@@ -0,0 +1,83 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as Base64Error
+
+from config import Config
+from responses import DefaultException, make_etag
+from werkzeug.datastructures import ImmutableMultiDict
+
+_CONTENT_PER_PAGE = Config.DEFAULT_CONTENT_PER_PAGE
+_MAX_CONTENT_PER_PAGE = max(Config.CONTENT_PER_PAGE)
+
+
+def encode_cursor(last_id: int) -> str:
+    """Opaque cursor pointing right after last_id"""
+    return urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        return int(urlsafe_b64decode((cursor + padding).encode()).decode())
+    except (Base64Error, UnicodeError, ValueError):
+        raise DefaultException(message="Invalid_cursor", code=400)
+
+
+def is_cursor_request(params: ImmutableMultiDict) -> bool:
+    """Cursor pagination is opt-in through {after} or {limit}"""
+    return "after" in params or "limit" in params
+
+
+def projection_param(params: ImmutableMultiDict, columns: dict) -> list[str]:
+    """Field names asked for with {fields}=a,b,c, in the order of columns.
+    None when the parameter is absent"""
+    if "fields" not in params:
+        return None
+    names = {name.strip() for name in params.get("fields").split(",") if name.strip()}
+    if not names or not names.issubset(columns):
+        raise DefaultException(message="Invalid_fields", code=400)
+    return [name for name in columns if name in names]
+
+
+def projected_query(query, columns: dict, names: list[str]):
+    """Only select the named columns, plus id and version that cursors and
+    validators need. The items are then plain rows, not ORM instances"""
+    selected = dict.fromkeys(["id", "version", *names])
+    return query.with_entities(*[columns[name] for name in selected])
+
+
+def page_etag(kind: str, params: ImmutableMultiDict, page: dict[str, any]) -> str:
+    """Validator of a list page: the query, the totals and the version of every
+    item, so any write to a listed item or to the list membership changes it"""
+    return make_etag(
+        kind,
+        sorted(params.items(multi=True)),
+        page["total_items"],
+        page.get("next_cursor"),
+        [(item.id, item.version) for item in page["items"]],
+    )
+
+
+def paginate_by_cursor(query, id_column, params: ImmutableMultiDict) -> dict[str, any]:
+    """Seek on id_column instead of OFFSET. The total is only counted when
+    {with_total} is true"""
+    limit = params.get("limit", type=int, default=_CONTENT_PER_PAGE)
+    limit = max(1, min(limit, _MAX_CONTENT_PER_PAGE))
+    after = params.get("after", type=str)
+    with_total = params.get("with_total", default="false").lower() in ("1", "true")
+
+    seek_query = query
+    if after:
+        seek_query = seek_query.filter(id_column > decode_cursor(after))
+    items = seek_query.order_by(id_column).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1].id)
+    return {
+        "current_page": None,
+        "total_items": query.order_by(None).count() if with_total else None,
+        "total_pages": None,
+        "next_cursor": next_cursor,
+        "items": items,
+    }
@@ -0,0 +1,36 @@
+from config import db
+from models import Tag, Taxon, taxon_tag
+from sqlalchemy import func, select
+from werkzeug.datastructures import ImmutableMultiDict
+
+from .cache_service import facet_cache
+from .taxon_service import taxon_filters
+
+
+def count_tag_facets(params: ImmutableMultiDict) -> list[dict[str, any]]:
+    """Number of taxons carrying each tag, among the taxons matched by the taxon
+    list filters in params, with one GROUP BY over taxon_tag"""
+    counts = select(
+        taxon_tag.c.tag_id, func.count(taxon_tag.c.taxon_id).label("taxons_count")
+    ).group_by(taxon_tag.c.tag_id)
+    filters = taxon_filters(params)
+    if filters:
+        counts = counts.join(Taxon, Taxon.id == taxon_tag.c.taxon_id).where(*filters)
+    counts = counts.subquery()
+
+    taxons_count = func.coalesce(counts.c.taxons_count, 0)
+    rows = db.session.execute(
+        select(Tag.id, Tag.name, taxons_count)
+        .outerjoin(counts, counts.c.tag_id == Tag.id)
+        .order_by(taxons_count.desc(), Tag.name)
+    )
+    return [
+        {"id": tag_id, "name": name, "taxons_count": count}
+        for tag_id, name, count in rows
+    ]
+
+
+def get_tag_facets(params: ImmutableMultiDict) -> dict[str, any]:
+    """Tag facet counts, read through the facet cache"""
+    key = tuple(sorted(params.items(multi=True)))
+    return {"items": facet_cache.get_or_load(key, lambda: count_tag_facets(params))}
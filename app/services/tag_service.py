@@ -1,11 +1,31 @@
 from math import ceil
 
 from config import Config, db
-from models import Tag
-from responses import DefaultException, response
+from models import Tag, Taxon, taxon_tag
+from responses import DefaultException, make_etag, response
+from sqlalchemy import select, update
 from werkzeug.datastructures import ImmutableMultiDict
 
+from .cache_service import facet_cache, tag_cache, taxon_cache
+from .image_service import delete_origin_images, remove_unused_image_files
+from .pagination_service import (
+    is_cursor_request,
+    paginate_by_cursor,
+    projected_query,
+    projection_param,
+)
+from .taxon_autocomplete_service import autocomplete_index
+from .taxon_tag_index_service import taxon_tag_index
+
 _CONTENT_PER_PAGE = Config.DEFAULT_CONTENT_PER_PAGE
+# Columns a list can be projected on with {fields}
+TAG_PROJECTION_COLUMNS = {
+    "name": Tag.name,
+    "description": Tag.description,
+    "version": Tag.version,
+    "updated_at": Tag.updated_at,
+    "id": Tag.id,
+}
 
 
 def get_tags(params: ImmutableMultiDict) -> dict[str, any]:
@@ -13,22 +33,29 @@ def get_tags(params: ImmutableMultiDict) -> dict[str, any]:
     per_page = params.get("per_page", type=int, default=_CONTENT_PER_PAGE)
     name = params.get("name", type=str)
     description = params.get("description", type=str)
+    projection = projection_param(params, TAG_PROJECTION_COLUMNS)
     filters = []
     if name:
         filters.append(Tag.name.ilike(f"%{name}%"))
     if description:
         filters.append(Tag.description.ilike(f"%{description}%"))
-    pagination = (
-        Tag.query.filter(*filters)
-        .order_by(Tag.id)
-        .paginate(page=page, per_page=per_page, error_out=False)
-    )
-    return {
-        "current_page": page,
-        "total_items": pagination.total,
-        "total_pages": ceil(pagination.total / per_page),
-        "items": pagination.items,
-    }
+    query = Tag.query.filter(*filters)
+    if projection is not None:
+        query = projected_query(query, TAG_PROJECTION_COLUMNS, projection)
+    if is_cursor_request(params):
+        page = paginate_by_cursor(query, Tag.id, params)
+    else:
+        pagination = query.order_by(Tag.id).paginate(
+            page=page, per_page=per_page, error_out=False
+        )
+        page = {
+            "current_page": page,
+            "total_items": pagination.total,
+            "total_pages": ceil(pagination.total / per_page),
+            "items": pagination.items,
+        }
+    page["fields"] = projection
+    return page
 
 
 def get_tag(tag_id: int, options: list = None) -> Tag:
@@ -41,6 +68,45 @@ def get_tag(tag_id: int, options: list = None) -> Tag:
     return tag
 
 
+def serialize_tag(tag: Tag) -> dict[str, any]:
+    return {
+        "name": tag.name,
+        "description": tag.description,
+        "version": tag.version,
+        "updated_at": tag.updated_at,
+        "id": tag.id,
+    }
+
+
+def tag_etag(tag: dict[str, any]) -> str:
+    return make_etag("tag", tag["id"], tag["version"], tag["updated_at"])
+
+
+def get_tag_payload(tag_id: int) -> dict[str, any]:
+    """Get a serialized tag, read through the tag cache"""
+    return tag_cache.get_or_load(tag_id, lambda: serialize_tag(get_tag(tag_id)))
+
+
+def get_tagged_taxons_ids(tag_id: int) -> list[int]:
+    return (
+        db.session.execute(
+            select(taxon_tag.c.taxon_id).where(taxon_tag.c.tag_id == tag_id)
+        )
+        .scalars()
+        .all()
+    )
+
+
+def bump_taxons_version(taxon_ids: list[int]) -> None:
+    """New version for taxons whose representation changed through their tags"""
+    if taxon_ids:
+        db.session.execute(
+            update(Taxon.__table__)
+            .where(Taxon.id.in_(taxon_ids))
+            .values(version=Taxon.version + 1)
+        )
+
+
 def save_new_tag(data: dict[str, any]) -> dict[str, any]:
     tag = Tag.query.filter_by(name=data["name"]).first()
 
@@ -53,12 +119,13 @@ def save_new_tag(data: dict[str, any]) -> dict[str, any]:
     )
     db.session.add(new_tag)
     db.session.commit()
+    facet_cache.clear()
+    autocomplete_index.mark_tags_changed()
     return response(status="success", message="Tag_successfully_created", code=201)
 
 
 def update_tag_by_id(tag_id, data) -> dict[str, any]:
     updated_tag = get_tag(tag_id)
-    print(updated_tag)
     if data.get("name") != updated_tag.name:  # Means that the name is being updated
         tag = Tag.query.filter_by(name=data.get("name")).first()
         if tag is not None:  # Means that the new name already exists
@@ -66,12 +133,27 @@ def update_tag_by_id(tag_id, data) -> dict[str, any]:
 
     updated_tag.name = data.get("name")
     updated_tag.description = data.get("description")
+    tagged_taxons_ids = get_tagged_taxons_ids(tag_id)
+    bump_taxons_version(tagged_taxons_ids)
     db.session.commit()
+    tag_cache.invalidate(tag_id)
+    taxon_cache.invalidate(*tagged_taxons_ids)
+    facet_cache.clear()
+    autocomplete_index.mark_tags_changed()
     return response(status="success", message="Tag_successfully_updated", code=200)
 
 
 def delete_tag_by_id(tag_id):
     tag = get_tag(tag_id)
+    tagged_taxons_ids = get_tagged_taxons_ids(tag_id)
+    bump_taxons_version(tagged_taxons_ids)
+    content_hashes = delete_origin_images("tag", tag_id)
     db.session.delete(tag)
     db.session.commit()
+    remove_unused_image_files(content_hashes)
+    tag_cache.invalidate(tag_id)
+    taxon_cache.invalidate(*tagged_taxons_ids)
+    facet_cache.clear()
+    taxon_tag_index.mark_stale()
+    autocomplete_index.mark_tags_changed()
     return response(status="success", message="Tag_successfully_deleted", code=200)
@@ -0,0 +1,146 @@
+from collections import defaultdict
+
+from config import db
+from models import Taxon, taxon_closure
+from sqlalchemy import bindparam, case, func, select, update
+
+from .taxon_closure_service import move_taxon_closure
+
+_CHUNK = 1000
+_SPECIES = "species"
+_taxons = Taxon.__table__
+
+
+def _own_counts(taxon_class: str, individuals_number: int) -> tuple[int, int]:
+    """(species, individuals) a single taxon adds to its subtree"""
+    return int(taxon_class == _SPECIES), individuals_number or 0
+
+
+def _shift(taxon_ids: list[int], descendants: int, species: int, individuals: int):
+    if not taxon_ids or not (descendants or species or individuals):
+        return
+    db.session.execute(
+        update(_taxons)
+        .where(_taxons.c.id.in_(taxon_ids))
+        .values(
+            descendant_count=_taxons.c.descendant_count + descendants,
+            species_count=_taxons.c.species_count + species,
+            individuals_sum=_taxons.c.individuals_sum + individuals,
+        )
+    )
+
+
+def add_taxons_aggregates(taxon_ids: list[int], sign: int = 1) -> list[int]:
+    """Add the taxons to the aggregates of their ancestors and their own, or
+    take them out with sign=-1. The taxons must be linked in the closure.
+    Returns the ids whose aggregates changed"""
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for start in range(0, len(taxon_ids), _CHUNK):
+        rows = db.session.execute(
+            select(
+                taxon_closure.c.ancestor_id,
+                func.sum(case((taxon_closure.c.depth > 0, 1), else_=0)),
+                func.sum(case((Taxon.taxon_class == _SPECIES, 1), else_=0)),
+                func.sum(func.coalesce(Taxon.individuals_number, 0)),
+            )
+            .join(Taxon, Taxon.id == taxon_closure.c.descendant_id)
+            .where(taxon_closure.c.descendant_id.in_(taxon_ids[start : start + _CHUNK]))
+            .group_by(taxon_closure.c.ancestor_id)
+        )
+        for ancestor_id, descendants, species, individuals in rows:
+            delta = deltas[ancestor_id]
+            delta[0] += descendants
+            delta[1] += species
+            delta[2] += individuals
+    if not deltas:
+        return []
+    db.session.execute(
+        update(_taxons)
+        .where(_taxons.c.id == bindparam("taxon_id"))
+        .values(
+            descendant_count=_taxons.c.descendant_count + bindparam("descendants"),
+            species_count=_taxons.c.species_count + bindparam("species"),
+            individuals_sum=_taxons.c.individuals_sum + bindparam("individuals"),
+        ),
+        [
+            {
+                "taxon_id": taxon_id,
+                "descendants": sign * descendants,
+                "species": sign * species,
+                "individuals": sign * individuals,
+            }
+            for taxon_id, (descendants, species, individuals) in deltas.items()
+        ],
+    )
+    return list(deltas)
+
+
+def relink_taxon(
+    taxon_id: int, taxon_class: str, individuals_number: int, superior_taxon_id: int
+) -> list[int]:
+    """Apply a taxon update to the closure and the aggregates: its own counts
+    change with taxon_class and individuals_number, and its whole subtree moves
+    under superior_taxon_id if that changed. Run it before assigning the new
+    values to the taxon. Returns the ids whose aggregates changed"""
+    old = db.session.execute(
+        select(
+            _taxons.c.taxon_class,
+            _taxons.c.individuals_number,
+            _taxons.c.superior_taxon,
+            _taxons.c.descendant_count,
+            _taxons.c.species_count,
+            _taxons.c.individuals_sum,
+        ).where(_taxons.c.id == taxon_id)
+    ).one()
+    old_species, old_individuals = _own_counts(old.taxon_class, old.individuals_number)
+    new_species, new_individuals = _own_counts(taxon_class, individuals_number)
+    species = new_species - old_species
+    individuals = new_individuals - old_individuals
+
+    ancestors = select(taxon_closure.c.ancestor_id).where(
+        taxon_closure.c.descendant_id == taxon_id, taxon_closure.c.depth > 0
+    )
+    old_ancestor_ids = db.session.execute(ancestors).scalars().all()
+    _shift([taxon_id], 0, species, individuals)
+    if superior_taxon_id == old.superior_taxon:
+        _shift(old_ancestor_ids, 0, species, individuals)
+        return [taxon_id, *old_ancestor_ids]
+
+    subtree = old.descendant_count + 1
+    _shift(old_ancestor_ids, -subtree, -old.species_count, -old.individuals_sum)
+    move_taxon_closure(taxon_id, superior_taxon_id)
+    new_ancestor_ids = db.session.execute(ancestors).scalars().all()
+    _shift(
+        new_ancestor_ids,
+        subtree,
+        old.species_count + species,
+        old.individuals_sum + individuals,
+    )
+    return [taxon_id, *old_ancestor_ids, *new_ancestor_ids]
+
+
+def rebuild_taxon_aggregates() -> int:
+    """Recompute every aggregate from the closure. Returns the number of taxons
+    updated"""
+    subtree = taxon_closure.alias("subtree")
+    member = _taxons.alias("member")
+
+    def over_subtree(column, *filters):
+        return (
+            select(column)
+            .select_from(subtree.join(member, member.c.id == subtree.c.descendant_id))
+            .where(subtree.c.ancestor_id == _taxons.c.id, *filters)
+            .scalar_subquery()
+        )
+
+    updated = db.session.execute(
+        update(_taxons).values(
+            descendant_count=over_subtree(func.count(), subtree.c.depth > 0),
+            species_count=over_subtree(func.count(), member.c.taxon_class == _SPECIES),
+            individuals_sum=over_subtree(
+                func.coalesce(func.sum(member.c.individuals_number), 0)
+            ),
+        )
+    ).rowcount
+    db.session.commit()
+    return updated
@@ -0,0 +1,244 @@
+import unicodedata
+from bisect import bisect_left, insort
+from threading import RLock
+from time import monotonic
+
+import numpy as np
+from config import Config, db
+from models import TAXON_CLASS_TYPES, Tag, Taxon
+from responses import DefaultException
+from sqlalchemy import select
+from werkzeug.datastructures import ImmutableMultiDict
+
+from .taxon_tag_index_service import get_taxon_tag_index
+
+_RANK = {taxon_class: rank for rank, taxon_class in enumerate(TAXON_CLASS_TYPES)}
+_MAX_AGE = Config.SNAPSHOT_MAX_AGE_SECONDS
+_REFRESH_CHUNK = 500
+_MAX_PENDING = Config.AUTOCOMPLETE_MAX_PENDING
+_DEFAULT_LIMIT = Config.DEFAULT_CONTENT_PER_PAGE
+_MAX_LIMIT = max(Config.CONTENT_PER_PAGE)
+# Sorts after any character, so prefix + _LAST bounds the keys starting with prefix
+_LAST = chr(0x10FFFF)
+_POPULARITY_BITS = 40
+# Read through Core, the index is rebuilt from every taxon row
+_taxons = Taxon.__table__
+_ENTRY_COLUMNS = select(
+    _taxons.c.id,
+    _taxons.c.name,
+    _taxons.c.popular_name,
+    _taxons.c.taxon_class,
+    _taxons.c.descendant_count,
+)
+
+
+def fold_name(text: str) -> str:
+    """Case and accent folded text with its whitespace collapsed: "Ēquus  Ferus"
+    and "equus ferus" fold the same"""
+    if text.isascii():
+        return " ".join(text.lower().split())
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(stripped.casefold().split())
+
+
+def _taxon_entries(rows) -> list[tuple[str, int, int]]:
+    """(key, score, id) of the name and popular name of (id, name, popular_name,
+    taxon_class, descendant_count) rows. Lower scores rank first: higher ranks,
+    then taxons with more descendants"""
+    entries = []
+    for taxon_id, name, popular_name, taxon_class, descendant_count in rows:
+        popularity = min(descendant_count or 0, (1 << _POPULARITY_BITS) - 1)
+        score = (_RANK[taxon_class] << _POPULARITY_BITS) - popularity
+        for text in (name, popular_name):
+            if text:
+                entries.append((fold_name(text), score, taxon_id))
+    return entries
+
+
+def _smallest(scores: np.ndarray, count: int) -> np.ndarray:
+    """Positions of the count smallest scores in score order, ties broken by
+    position"""
+    if count >= len(scores):
+        return np.argsort(scores, kind="stable")
+    threshold = np.partition(scores, count - 1)[count - 1]
+    below = np.flatnonzero(scores < threshold)
+    ties = np.flatnonzero(scores == threshold)[: count - len(below)]
+    positions = np.concatenate([below, ties])
+    return positions[np.argsort(scores[positions], kind="stable")]
+
+
+class AutocompleteIndex:
+    """Sorted folded names and popular names of the taxons, and names of the
+    tags, searched by prefix with bisect.
+
+    Taxon entries live in a base sorted list with their scores and ids in
+    aligned arrays, so the best matches of a prefix are picked with a partial
+    sort of its key range. Writes do not touch the base: mark_changed retires
+    the base entries of the taxons and their fresh entries go to a small sorted
+    pending list, merged into the base on a full reload once it grows past
+    AUTOCOMPLETE_MAX_PENDING. mark_stale forces that reload.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.scores = np.empty(0, np.int64)
+        self.ids = np.empty(0, np.int64)
+        self.tags = []
+        self.version = 0
+        self._pending = []
+        self._retired = set()
+        self._tags_version = None
+        self._loaded_at = None
+        self._changed = set()
+        self._lock = RLock()
+
+    # --------------------- maintenance ---------------------
+
+    def mark_changed(self, *taxon_ids: int) -> None:
+        with self._lock:
+            self._changed.update(taxon_ids)
+
+    def mark_tags_changed(self) -> None:
+        with self._lock:
+            self._tags_version = None
+
+    def mark_stale(self) -> None:
+        with self._lock:
+            self._loaded_at = None
+            self._tags_version = None
+            self._changed.clear()
+
+    def refresh(self) -> "AutocompleteIndex":
+        """Bring the index up to date with the database"""
+        with self._lock:
+            if self._loaded_at is None or monotonic() - self._loaded_at > _MAX_AGE:
+                self._load()
+            elif self._changed:
+                self._patch()
+            tag_index = get_taxon_tag_index()
+            if self._tags_version != tag_index.version:
+                self._load_tags(tag_index)
+        return self
+
+    def _load(self) -> None:
+        rows = db.session.connection().execute(_ENTRY_COLUMNS)
+        entries = _taxon_entries(rows)
+        entries.sort()
+        self.keys = [entry[0] for entry in entries]
+        self.scores = np.fromiter((entry[1] for entry in entries), np.int64)
+        self.ids = np.fromiter((entry[2] for entry in entries), np.int64)
+        self._pending = []
+        self._retired = set()
+        self._changed.clear()
+        self._loaded_at = monotonic()
+        self.version += 1
+
+    def _patch(self) -> None:
+        changed = sorted(self._changed)
+        self._changed.clear()
+        if len(self._pending) + len(self._retired) + 2 * len(changed) > _MAX_PENDING:
+            self._load()
+            return
+
+        self._retired.update(changed)
+        retired = set(changed)
+        self._pending = [entry for entry in self._pending if entry[2] not in retired]
+        for start in range(0, len(changed), _REFRESH_CHUNK):
+            rows = db.session.connection().execute(
+                _ENTRY_COLUMNS.where(
+                    _taxons.c.id.in_(changed[start : start + _REFRESH_CHUNK])
+                )
+            )
+            for entry in _taxon_entries(rows):
+                insort(self._pending, entry)
+        self.version += 1
+
+    def _load_tags(self, tag_index) -> None:
+        """Tags are few, they are reloaded whole with their taxon counts taken
+        from the tag bitmaps"""
+        tags = []
+        for tag_id, name in db.session.execute(select(Tag.id, Tag.name)):
+            bitmap = tag_index.bitmaps.get(tag_id)
+            count = 0 if bitmap is None else int(np.unpackbits(bitmap).sum())
+            tags.append((fold_name(name), -count, tag_id, name))
+        tags.sort()
+        self.tags = tags
+        self._tags_version = tag_index.version
+
+    # --------------------- queries ---------------------
+
+    def taxon_ids(self, prefix: str, limit: int) -> list[int]:
+        """Ids of the best ranked taxons with a name or popular name starting
+        with the folded prefix"""
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix + _LAST, start)
+        # A taxon has up to two entries and retired ones are skipped
+        wanted = 2 * limit + len(self._retired)
+        candidates = [
+            (int(self.scores[position]), self.keys[position], int(self.ids[position]))
+            for position in start + _smallest(self.scores[start:end], wanted)
+            if int(self.ids[position]) not in self._retired
+        ]
+        start = bisect_left(self._pending, (prefix,))
+        end = bisect_left(self._pending, (prefix + _LAST,), start)
+        candidates.extend(
+            (score, key, taxon_id) for key, score, taxon_id in self._pending[start:end]
+        )
+
+        taxon_ids = []
+        for _, _, taxon_id in sorted(candidates):
+            if taxon_id not in taxon_ids:
+                taxon_ids.append(taxon_id)
+                if len(taxon_ids) == limit:
+                    break
+        return taxon_ids
+
+    def tag_matches(self, prefix: str, limit: int) -> list[dict[str, any]]:
+        """Tags with a name starting with the folded prefix, most used first"""
+        start = bisect_left(self.tags, (prefix,))
+        end = bisect_left(self.tags, (prefix + _LAST,), start)
+        matches = sorted(self.tags[start:end], key=lambda tag: (tag[1], tag[0]))
+        return [
+            {"id": tag_id, "name": name, "taxon_count": -count}
+            for _, count, tag_id, name in matches[:limit]
+        ]
+
+
+autocomplete_index = AutocompleteIndex()
+
+
+def get_autocomplete_index() -> AutocompleteIndex:
+    """The process wide autocomplete index, refreshed with the pending writes"""
+    return autocomplete_index.refresh()
+
+
+def autocomplete(params: ImmutableMultiDict) -> dict[str, any]:
+    """Taxons and tags whose name starts with {prefix}, ignoring case and
+    accents. Taxons also match on their popular name and come ranked by rank,
+    then number of descendants; tags by number of tagged taxons"""
+    prefix = params.get("prefix", type=str, default="")
+    limit = params.get("limit", type=int, default=_DEFAULT_LIMIT)
+    limit = max(1, min(limit, _MAX_LIMIT))
+
+    folded = fold_name(prefix)
+    if not folded:
+        raise DefaultException(message="Prefix_is_required", code=400)
+
+    index = get_autocomplete_index()
+    taxon_ids = index.taxon_ids(folded, limit)
+    rows = {}
+    if taxon_ids:
+        rows = {
+            row.id: row
+            for row in db.session.execute(
+                select(
+                    Taxon.id, Taxon.name, Taxon.popular_name, Taxon.taxon_class
+                ).where(Taxon.id.in_(taxon_ids))
+            )
+        }
+    return {
+        "prefix": prefix,
+        "taxons": [rows[taxon_id] for taxon_id in taxon_ids if taxon_id in rows],
+        "tags": index.tag_matches(folded, limit),
+    }
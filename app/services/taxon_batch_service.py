@@ -0,0 +1,263 @@
+from config import Config, db
+from models import TAXON_CLASS_TYPES, Tag, Taxon, taxon_tag
+from responses import DefaultException, response
+from sqlalchemy import insert, select
+
+from .taxon_aggregate_service import add_taxons_aggregates, relink_taxon
+from .taxon_closure_service import insert_taxons_closure
+from .taxon_service import (
+    taxon_loader_options,
+    taxons_changed,
+    taxons_with_inferiors,
+)
+
+_BATCH_MAX_ITEMS = Config.BATCH_MAX_ITEMS
+_taxons = Taxon.__table__
+_TAXON_FIELDS = [
+    "taxon_class",
+    "name",
+    "popular_name",
+    "description",
+    "origin",
+    "extinction",
+    "individuals_number",
+    "superior_taxon",
+]
+
+
+def _superior_taxon_error(
+    taxon_class: str, superior_taxon: any, superior_class: str
+) -> str:
+    """Same rules as verify_superior_taxon. superior_taxon is the id or the name
+    the item gives, superior_class the class it resolved to, None when not
+    found"""
+    if taxon_class == "life":
+        if superior_taxon is not None:
+            return "Life_does_not_have_superior_taxon"
+        return None
+    if superior_taxon is None:
+        return None
+    if superior_class is None:
+        return "Superior_taxon_not_found"
+    expected = TAXON_CLASS_TYPES[TAXON_CLASS_TYPES.index(taxon_class) - 1]
+    if superior_class != expected:
+        return "Taxon_{}_is_not_a_valid_superior_taxon_of_{},_it_should_be_a_{}".format(
+            superior_taxon, taxon_class, expected
+        )
+    return None
+
+
+def _updated_value(item: dict, taxon: Taxon, field: str) -> any:
+    """Updates only change the fields the item carries"""
+    return item[field] if field in item else getattr(taxon, field)
+
+
+def _validate_batch(
+    items: list[dict], existing: dict[int, Taxon]
+) -> tuple[list[dict], dict[str, int]]:
+    """Check every item with a handful of IN queries. Returns the errors and the
+    ids of the existing taxons named by {superior_taxon_name}"""
+    superior_ids = set()
+    for item in items:
+        if item.get("id") in existing:
+            superior_ids.add(
+                _updated_value(item, existing[item["id"]], "superior_taxon")
+            )
+        else:
+            superior_ids.add(item.get("superior_taxon"))
+    superior_names = {item.get("superior_taxon_name") for item in items} - {None}
+    superiors = {}
+    named_superiors = {}
+    for taxon_id, name, taxon_class in db.session.execute(
+        select(Taxon.id, Taxon.name, Taxon.taxon_class).where(
+            db.or_(Taxon.id.in_(superior_ids - {None}), Taxon.name.in_(superior_names))
+        )
+    ):
+        superiors[taxon_id] = taxon_class
+        named_superiors[name] = taxon_id
+    for item in items:  # superiors updated by the batch are checked as updated
+        if item.get("id") in superiors and item.get("id") in existing:
+            superiors[item["id"]] = item.get("taxon_class")
+    # Taxons created by the batch can be named as superior of other new ones
+    new_classes = {
+        item.get("name"): item.get("taxon_class")
+        for item in items
+        if item.get("id") is None
+    }
+
+    names = {item.get("name") for item in items} - {None}
+    taken_names = dict(
+        db.session.execute(
+            select(Taxon.name, Taxon.id).where(Taxon.name.in_(names))
+        ).all()
+    )
+    tag_ids = {tag_id for item in items for tag_id in item.get("tags_ids") or []}
+    found_tag_ids = set(
+        db.session.execute(select(Tag.id).where(Tag.id.in_(tag_ids))).scalars()
+    )
+
+    # Their inferiors were checked against the current class
+    with_inferiors = taxons_with_inferiors(
+        [
+            item["id"]
+            for item in items
+            if item.get("id") in existing
+            and item.get("taxon_class") != existing[item["id"]].taxon_class
+        ]
+    )
+
+    errors = []
+    batch_names = set()
+    for index, item in enumerate(items):
+        taxon_id = item.get("id")
+        name = item.get("name")
+        taxon_class = item.get("taxon_class")
+        superior_name = item.get("superior_taxon_name")
+        if taxon_id is not None and taxon_id not in existing:
+            message = "Taxon_not_found"
+        elif not name or taxon_class not in TAXON_CLASS_TYPES:
+            message = "Invalid_data"
+        elif item.get("origin") is None:
+            message = "Invalid_data"
+        elif name in batch_names:
+            message = "Duplicated_name_in_batch"
+        elif taken_names.get(name, taxon_id) != taxon_id:
+            message = "This_Taxon_already_exists"
+        elif not found_tag_ids.issuperset(item.get("tags_ids") or []):
+            message = "Tag_not_found"
+        elif taxon_id in with_inferiors:
+            message = "Taxon_has_inferior_taxons"
+        elif superior_name is not None and taxon_id is not None:
+            message = "Superior_taxon_name_is_only_for_new_taxons"
+        elif superior_name is not None and item.get("superior_taxon") is not None:
+            message = "Superior_taxon_and_superior_taxon_name_are_exclusive"
+        elif superior_name is not None:
+            superior_class = new_classes.get(superior_name)
+            if superior_class is None and superior_name in named_superiors:
+                superior_class = superiors[named_superiors[superior_name]]
+            message = _superior_taxon_error(taxon_class, superior_name, superior_class)
+        else:
+            superior_id = item.get("superior_taxon")
+            if taxon_id is not None:
+                superior_id = _updated_value(item, existing[taxon_id], "superior_taxon")
+            message = _superior_taxon_error(
+                taxon_class, superior_id, superiors.get(superior_id)
+            )
+        batch_names.add(name)
+        if message is not None:
+            errors.append({"index": index, "message": message})
+    return errors, named_superiors
+
+
+def _insert_new_taxons(
+    new_items: list[dict], named_superiors: dict[str, int]
+) -> list[int]:
+    """Insert the new items one rank at a time, from the highest, so the ones
+    naming a superior taxon created by the batch get its id. The ids come back
+    from RETURNING in the order of the items. Returns them in item order"""
+    ids_by_name = dict(named_superiors)
+    created_ids = {}
+    for taxon_class in TAXON_CLASS_TYPES:
+        rank_items = [
+            (index, item)
+            for index, item in enumerate(new_items)
+            if item["taxon_class"] == taxon_class
+        ]
+        if not rank_items:
+            continue
+        rows = []
+        for _, item in rank_items:
+            row = {field: item.get(field) for field in _TAXON_FIELDS}
+            if item.get("superior_taxon_name") is not None:
+                row["superior_taxon"] = ids_by_name[item["superior_taxon_name"]]
+            rows.append(row)
+        taxon_ids = db.session.scalars(
+            insert(_taxons).returning(_taxons.c.id, sort_by_parameter_order=True),
+            rows,
+        ).all()
+        for (index, item), taxon_id in zip(rank_items, taxon_ids):
+            created_ids[index] = taxon_id
+            ids_by_name[item["name"]] = taxon_id
+    return [created_ids[index] for index in range(len(new_items))]
+
+
+def save_taxon_batch(data: dict[str, any]) -> tuple[dict, int]:
+    """Create the items without {id} and update the ones with it, all validated
+    up front and committed in a single transaction. Updates only change the
+    fields their item carries. New items can name their superior taxon with
+    {superior_taxon_name}, which may be another new item of the batch"""
+    if not isinstance(data, dict):
+        raise DefaultException(message="Invalid_data", code=400)
+    items = data.get("items") or []
+    if not isinstance(items, list) or not all(
+        isinstance(item, dict) for item in items
+    ):
+        raise DefaultException(message="Invalid_data", code=400)
+    if not items:
+        raise DefaultException(message="Batch_is_empty", code=400)
+    if len(items) > _BATCH_MAX_ITEMS:
+        raise DefaultException(message="Batch_is_too_large", code=400)
+
+    update_ids = {item["id"] for item in items if item.get("id") is not None}
+    existing = {}
+    if update_ids:
+        existing = {
+            taxon.id: taxon
+            for taxon in Taxon.query.options(*taxon_loader_options("detail")).filter(
+                Taxon.id.in_(update_ids)
+            )
+        }
+    errors, named_superiors = _validate_batch(items, existing)
+    if errors:
+        raise DefaultException(message="Invalid_batch", code=400, info=errors)
+
+    tag_ids = {tag_id for item in items for tag_id in item.get("tags_ids") or []}
+    tags = {tag.id: tag for tag in Tag.query.filter(Tag.id.in_(tag_ids))}
+
+    changed_ids = set(update_ids)
+    for item in items:
+        if item.get("id") is None:
+            continue
+        taxon = existing[item["id"]]
+        changed_ids.update(
+            relink_taxon(
+                taxon.id,
+                taxon_class=item.get("taxon_class"),
+                individuals_number=_updated_value(item, taxon, "individuals_number"),
+                superior_taxon_id=_updated_value(item, taxon, "superior_taxon"),
+            )
+        )
+        for field in _TAXON_FIELDS:
+            if field in item:
+                setattr(taxon, field, item[field])
+        taxon.version = Taxon.version + 1
+        if "tags_ids" in item:
+            taxon.tags = [tags[tag_id] for tag_id in item["tags_ids"]]
+
+    new_items = [item for item in items if item.get("id") is None]
+    created_ids = []
+    if new_items:
+        created_ids = _insert_new_taxons(new_items, named_superiors)
+        new_tags = [
+            {"taxon_id": taxon_id, "tag_id": tag_id}
+            for taxon_id, item in zip(created_ids, new_items)
+            for tag_id in set(item.get("tags_ids") or [])
+        ]
+        if new_tags:
+            db.session.execute(insert(taxon_tag), new_tags)
+        insert_taxons_closure(
+            [
+                (taxon_id, item["taxon_class"])
+                for taxon_id, item in zip(created_ids, new_items)
+            ]
+        )
+        changed_ids.update(add_taxons_aggregates(created_ids))
+    db.session.commit()
+
+    taxons_changed(*changed_ids)
+    return response(
+        status="success",
+        message="Taxons_successfully_saved",
+        code=200,
+        data={"created_ids": created_ids, "updated_ids": sorted(update_ids)},
+    )
@@ -0,0 +1,192 @@
+from config import db
+from models import TAXON_CLASS_TYPES, Taxon, taxon_closure
+from responses import DefaultException
+from sqlalchemy import delete, exists, insert, literal, select, true
+
+_CLOSURE_COLUMNS = ["ancestor_id", "descendant_id", "depth"]
+
+
+def get_ancestors(taxon_id: int) -> list[Taxon]:
+    """Get every ancestor of a taxon, from the nearest to the root"""
+    return (
+        Taxon.query.join(taxon_closure, taxon_closure.c.ancestor_id == Taxon.id)
+        .filter(taxon_closure.c.descendant_id == taxon_id, taxon_closure.c.depth > 0)
+        .order_by(taxon_closure.c.depth)
+        .all()
+    )
+
+
+def get_descendants(taxon_id: int, max_depth: int = None):
+    """Query every descendant of a taxon, optionally limited to max_depth levels"""
+    filters = [taxon_closure.c.ancestor_id == taxon_id, taxon_closure.c.depth > 0]
+    if max_depth is not None:
+        filters.append(taxon_closure.c.depth <= max_depth)
+    return (
+        Taxon.query.join(taxon_closure, taxon_closure.c.descendant_id == Taxon.id)
+        .filter(*filters)
+        .order_by(taxon_closure.c.depth, Taxon.id)
+    )
+
+
+def is_descendant(taxon_id: int, ancestor_id: int) -> bool:
+    """Verify if a taxon is under another one"""
+    return db.session.query(
+        exists().where(
+            taxon_closure.c.ancestor_id == ancestor_id,
+            taxon_closure.c.descendant_id == taxon_id,
+            taxon_closure.c.depth > 0,
+        )
+    ).scalar()
+
+
+def descendant_of(ancestor_id: int):
+    """Filter expression matching the taxons under ancestor_id"""
+    return Taxon.id.in_(
+        select(taxon_closure.c.descendant_id).where(
+            taxon_closure.c.ancestor_id == ancestor_id, taxon_closure.c.depth > 0
+        )
+    )
+
+
+def insert_taxon_closure(taxon_id: int, superior_taxon_id: int = None) -> None:
+    """Link a new taxon to itself and to every ancestor of its superior taxon"""
+    db.session.execute(
+        insert(taxon_closure).values(
+            ancestor_id=taxon_id, descendant_id=taxon_id, depth=0
+        )
+    )
+    if superior_taxon_id is None:
+        return
+    db.session.execute(
+        insert(taxon_closure).from_select(
+            _CLOSURE_COLUMNS,
+            select(
+                taxon_closure.c.ancestor_id,
+                literal(taxon_id),
+                taxon_closure.c.depth + 1,
+            ).where(taxon_closure.c.descendant_id == superior_taxon_id),
+        )
+    )
+
+
+def insert_taxons_closure(taxons: list[tuple[int, str]]) -> None:
+    """Link many new (id, taxon_class) taxons at once: the self rows with one
+    executemany, then one INSERT ... SELECT per rank, from the highest, so
+    superior taxons created together are linked before their inferiors"""
+    if not taxons:
+        return
+    db.session.execute(
+        insert(taxon_closure),
+        [
+            {"ancestor_id": taxon_id, "descendant_id": taxon_id, "depth": 0}
+            for taxon_id, _ in taxons
+        ],
+    )
+    # A contiguous id block (bulk import) is scanned by range instead of IN
+    first_id = min(taxon_id for taxon_id, _ in taxons)
+    last_id = max(taxon_id for taxon_id, _ in taxons)
+    contiguous = last_id - first_id + 1 == len(taxons)
+    for taxon_class in TAXON_CLASS_TYPES:
+        taxon_ids = [taxon_id for taxon_id, rank in taxons if rank == taxon_class]
+        if not taxon_ids:
+            continue
+        if contiguous:
+            scope = [
+                Taxon.id.between(first_id, last_id),
+                Taxon.taxon_class == taxon_class,
+            ]
+        else:
+            scope = [Taxon.id.in_(taxon_ids)]
+        db.session.execute(
+            insert(taxon_closure).from_select(
+                _CLOSURE_COLUMNS,
+                select(
+                    taxon_closure.c.ancestor_id,
+                    Taxon.id,
+                    taxon_closure.c.depth + 1,
+                )
+                .join(Taxon, Taxon.superior_taxon == taxon_closure.c.descendant_id)
+                .where(*scope),
+            )
+        )
+
+
+def move_taxon_closure(taxon_id: int, superior_taxon_id: int = None) -> None:
+    """Detach the subtree of a taxon from its old ancestors and attach it under
+    superior_taxon_id"""
+    if superior_taxon_id is not None and (
+        superior_taxon_id == taxon_id or is_descendant(superior_taxon_id, taxon_id)
+    ):
+        raise DefaultException(message="Taxon_cannot_be_under_itself", code=400)
+
+    subtree = select(taxon_closure.c.descendant_id).where(
+        taxon_closure.c.ancestor_id == taxon_id
+    )
+    old_ancestors = select(taxon_closure.c.ancestor_id).where(
+        taxon_closure.c.descendant_id == taxon_id, taxon_closure.c.depth > 0
+    )
+    db.session.execute(
+        delete(taxon_closure).where(
+            taxon_closure.c.descendant_id.in_(subtree),
+            taxon_closure.c.ancestor_id.in_(old_ancestors),
+        )
+    )
+    if superior_taxon_id is None:
+        return
+
+    above = taxon_closure.alias("above")
+    below = taxon_closure.alias("below")
+    db.session.execute(
+        insert(taxon_closure).from_select(
+            _CLOSURE_COLUMNS,
+            select(
+                above.c.ancestor_id,
+                below.c.descendant_id,
+                above.c.depth + below.c.depth + 1,
+            )
+            .join_from(above, below, true())
+            .where(
+                above.c.descendant_id == superior_taxon_id,
+                below.c.ancestor_id == taxon_id,
+            ),
+        )
+    )
+
+
+def delete_taxon_closure(taxon_id: int) -> None:
+    """Remove a leaf taxon from the closure"""
+    db.session.execute(
+        delete(taxon_closure).where(taxon_closure.c.descendant_id == taxon_id)
+    )
+
+
+def rebuild_taxon_closure() -> int:
+    """Rebuild the whole closure from the superior_taxon pointers, one
+    INSERT ... SELECT per tree level. Returns the number of rows written"""
+    db.session.execute(delete(taxon_closure))
+    total = db.session.execute(
+        insert(taxon_closure).from_select(
+            _CLOSURE_COLUMNS, select(Taxon.id, Taxon.id, literal(0))
+        )
+    ).rowcount
+
+    depth = 0
+    while True:
+        inserted = db.session.execute(
+            insert(taxon_closure).from_select(
+                _CLOSURE_COLUMNS,
+                select(
+                    taxon_closure.c.ancestor_id,
+                    Taxon.id,
+                    taxon_closure.c.depth + 1,
+                )
+                .join(Taxon, Taxon.superior_taxon == taxon_closure.c.descendant_id)
+                .where(taxon_closure.c.depth == depth),
+            )
+        ).rowcount
+        if not inserted:
+            break
+        total += inserted
+        depth += 1
+    db.session.commit()
+    return total
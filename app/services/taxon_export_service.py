@@ -0,0 +1,309 @@
+import csv
+import io
+import json
+import re
+from typing import Iterator
+from xml.sax.saxutils import escape
+
+from config import Config, db
+from flask import Response, stream_with_context
+from models import Taxon, taxon_tag
+from responses import DefaultException
+from sqlalchemy import BigInteger, Select, Text, cast, literal, null, select
+from sqlalchemy.orm import aliased
+from sqlalchemy.engine import Row
+from werkzeug.datastructures import ImmutableMultiDict
+
+_EXPORT_BATCH_SIZE = Config.EXPORT_BATCH_SIZE
+EXPORT_FIELDS = [
+    "id",
+    "taxon_class",
+    "name",
+    "popular_name",
+    "description",
+    "origin",
+    "extinction",
+    "individuals_number",
+    "superior_taxon",
+]
+# The importer resolves superior taxons by name, ids differ between databases
+EXPORT_COLUMNS = [*EXPORT_FIELDS, "superior_taxon_name"]
+
+
+def iter_taxon_rows() -> Iterator[dict[str, any]]:
+    """Every taxon with its superior_taxon_name and tags_ids, in id order.
+
+    Taxons and taxon_tag are read through two server side cursors, both ordered
+    by taxon id, and merged as they stream, so memory does not grow with the
+    table and no ORM object is built.
+    """
+    superior = aliased(Taxon)
+    taxons = db.session.execute(
+        select(*[getattr(Taxon, field) for field in EXPORT_FIELDS], superior.name)
+        .outerjoin(superior, superior.id == Taxon.superior_taxon)
+        .order_by(Taxon.id)
+        .execution_options(yield_per=_EXPORT_BATCH_SIZE)
+    )
+    tags = db.session.execute(
+        select(taxon_tag.c.taxon_id, taxon_tag.c.tag_id)
+        .order_by(taxon_tag.c.taxon_id, taxon_tag.c.tag_id)
+        .execution_options(yield_per=_EXPORT_BATCH_SIZE)
+    )
+    tag = next(tags, None)
+    for taxon in taxons:
+        row = dict(zip(EXPORT_COLUMNS, taxon))
+        row["tags_ids"] = []
+        while tag is not None and tag.taxon_id <= row["id"]:
+            if tag.taxon_id == row["id"]:
+                row["tags_ids"].append(tag.tag_id)
+            tag = next(tags, None)
+        yield row
+
+
+# Added to the ids so that they all print with the same width and the paths of
+# ids from the root sort in depth first order
+_PATH_OFFSET = 10**10
+# Newick labels that need no quotes
+_NEWICK_PLAIN_LABEL = re.compile(r"[\w.-]+")
+
+
+def subtree_query(taxon_id: int) -> Select:
+    """One recursive query of the subtree under a taxon, ordered by the path of
+    ids from the root"""
+    # Core columns: the rows come back as plain tuples, without ORM loading
+    taxons = Taxon.__table__
+
+    def path_part(column):
+        return cast(cast(column, BigInteger) + _PATH_OFFSET, Text)
+
+    # Both terms of the recursive CTE are cast to the same types: Postgres
+    # rejects a text path or a null origin typed differently in the two
+    tree = (
+        select(
+            taxons.c.id,
+            literal(0).label("depth"),
+            path_part(taxons.c.id).label("path"),
+            taxons.c.origin,
+            cast(null(), taxons.c.origin.type).label("superior_origin"),
+        )
+        .where(taxons.c.id == taxon_id)
+        .cte("subtree", recursive=True)
+    )
+    tree = tree.union_all(
+        select(
+            taxons.c.id,
+            tree.c.depth + 1,
+            cast(tree.c.path + "/" + path_part(taxons.c.id), Text),
+            taxons.c.origin,
+            cast(tree.c.origin, taxons.c.origin.type),
+        ).join(tree, taxons.c.superior_taxon == tree.c.id)
+    )
+    return (
+        select(
+            tree.c.depth,
+            tree.c.superior_origin,
+            taxons.c.id,
+            taxons.c.taxon_class,
+            taxons.c.name,
+            taxons.c.popular_name,
+            taxons.c.origin,
+            taxons.c.extinction,
+        )
+        .join(taxons, taxons.c.id == tree.c.id)
+        .order_by(tree.c.path)
+    )
+
+
+def iter_subtree_rows(taxon_id: int) -> Iterator[Row]:
+    """The subtree under a taxon in depth first preorder, siblings by id, each
+    row with its depth and the origin of its superior taxon.
+
+    Read through a server side cursor: no ORM object and no per level round
+    trip.
+    """
+    if db.session.get(Taxon, taxon_id) is None:
+        raise DefaultException(message="Taxon_not_found", code=404)
+    return db.session.connection().execute(
+        subtree_query(taxon_id).execution_options(yield_per=_EXPORT_BATCH_SIZE)
+    )
+
+
+def _branch_length(superior_origin: int, origin: int) -> int:
+    """Time between the origin of the superior taxon and the taxon's, None
+    when unknown or when the taxon claims to be older than its superior"""
+    if superior_origin is None or origin is None or origin > superior_origin:
+        return None
+    return superior_origin - origin
+
+
+def _newick_label(name: str, superior_origin: int, origin: int) -> str:
+    if not _NEWICK_PLAIN_LABEL.fullmatch(name):
+        name = "'{}'".format(name.replace("'", "''"))
+    length = _branch_length(superior_origin, origin)
+    return name if length is None else "{}:{}".format(name, length)
+
+
+def _newick_chunks(rows: Iterator[Row]) -> Iterator[str]:
+    """Newick from preorder rows. A taxon is only known to be internal when the
+    next row is deeper, so each row is written one step late; the labels of the
+    open internal taxons wait on a stack, at most one per rank"""
+    open_taxons = []
+    previous = None
+    for depth, superior_origin, _, _, name, _, origin, _ in rows:
+        if previous is not None:
+            yield _newick_step(*previous, depth, open_taxons)
+        previous = depth, _newick_label(name, superior_origin, origin)
+    if previous is not None:
+        yield _newick_step(*previous, -1, open_taxons)
+    yield ";\n"
+
+
+def _newick_step(depth: int, label: str, next_depth: int, open_taxons: list) -> str:
+    if next_depth > depth:
+        open_taxons.append((depth, label))
+        return "("
+    while open_taxons and open_taxons[-1][0] >= next_depth:
+        label += ")" + open_taxons.pop()[1]
+    return label + "," if next_depth >= 0 else label
+
+
+# phyloXML has no rank for the root of life
+_PHYLOXML_RANKS = {"life": "other"}
+_PHYLOXML_PROPERTY = (
+    '<property ref="biotree:{}" datatype="xsd:integer" applies_to="clade">'
+    "{}</property>"
+)
+
+
+def _phyloxml_clade(row: Row) -> str:
+    (
+        _,
+        superior_origin,
+        taxon_id,
+        taxon_class,
+        name,
+        popular_name,
+        origin,
+        extinction,
+    ) = row
+    name = escape(name)
+    parts = ["<clade><name>", name, "</name>"]
+    length = _branch_length(superior_origin, origin)
+    if length is not None:
+        parts.append("<branch_length>{}</branch_length>".format(length))
+    parts.append(
+        '<taxonomy><id provider="biotree">{}</id>'
+        "<scientific_name>{}</scientific_name>".format(taxon_id, name)
+    )
+    if popular_name:
+        parts.append("<common_name>{}</common_name>".format(escape(popular_name)))
+    parts.append(
+        "<rank>{}</rank></taxonomy>".format(
+            _PHYLOXML_RANKS.get(taxon_class, taxon_class)
+        )
+    )
+    if origin is not None:
+        parts.append(_PHYLOXML_PROPERTY.format("origin", origin))
+    if extinction is not None:
+        parts.append(_PHYLOXML_PROPERTY.format("extinction", extinction))
+    return "".join(parts)
+
+
+def _phyloxml_chunks(rows: Iterator[Row]) -> Iterator[str]:
+    """phyloXML from preorder rows: the open clades close when a row at their
+    depth or above comes in"""
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<phyloxml xmlns="http://www.phyloxml.org">'
+        '<phylogeny rooted="true">\n'
+    )
+    open_depths = []
+    for row in rows:
+        closing = ""
+        while open_depths and open_depths[-1] >= row[0]:
+            open_depths.pop()
+            closing += "</clade>"
+        open_depths.append(row[0])
+        yield closing + "\n" + _phyloxml_clade(row)
+    yield "</clade>" * len(open_depths) + "\n</phylogeny></phyloxml>\n"
+
+
+def _ndjson_lines(rows: Iterator[dict[str, any]]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+def _csv_lines(rows: Iterator[dict[str, any]]) -> Iterator[str]:
+    """csv with the same layout read by the bulk import, tags_ids joined by ';'"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([*EXPORT_COLUMNS, "tags_ids"])
+    for row in rows:
+        writer.writerow(
+            [
+                *[row[field] for field in EXPORT_COLUMNS],
+                ";".join(str(tag_id) for tag_id in row["tags_ids"]),
+            ]
+        )
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _batched(lines: Iterator[str]) -> Iterator[str]:
+    """Join lines so each chunk written to the client carries many rows"""
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= _EXPORT_BATCH_SIZE:
+            yield "".join(batch)
+            batch = []
+    if batch:
+        yield "".join(batch)
+
+
+EXPORT_FORMATS = {
+    "ndjson": (_ndjson_lines, "application/x-ndjson"),
+    "csv": (_csv_lines, "text/csv"),
+}
+
+
+TREE_EXPORT_FORMATS = {
+    "newick": (_newick_chunks, "text/x-newick", "nwk"),
+    "phyloxml": (_phyloxml_chunks, "application/xml", "xml"),
+}
+
+
+def export_taxon_tree(taxon_id: int, params: ImmutableMultiDict) -> Response:
+    """Stream the subtree under a taxon as Newick or phyloXML"""
+    file_format = params.get("format", type=str, default="newick")
+    if file_format not in TREE_EXPORT_FORMATS:
+        raise DefaultException(message="Invalid_export_format", code=400)
+
+    chunks, mimetype, extension = TREE_EXPORT_FORMATS[file_format]
+    rows = iter_subtree_rows(taxon_id)
+    return Response(
+        stream_with_context(_batched(chunks(rows))),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": "attachment; filename=taxon-{}.{}".format(
+                taxon_id, extension
+            )
+        },
+    )
+
+
+def export_taxons(params: ImmutableMultiDict) -> Response:
+    """Stream the whole taxonomy as ndjson or csv"""
+    file_format = params.get("format", type=str, default="ndjson")
+    if file_format not in EXPORT_FORMATS:
+        raise DefaultException(message="Invalid_export_format", code=400)
+
+    lines, mimetype = EXPORT_FORMATS[file_format]
+    return Response(
+        stream_with_context(_batched(lines(iter_taxon_rows()))),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": "attachment; filename=taxons.{}".format(file_format)
+        },
+    )
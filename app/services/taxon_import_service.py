@@ -0,0 +1,297 @@
+import csv
+import json
+from collections import defaultdict, deque
+from time import perf_counter
+from typing import IO, Iterable, Iterator
+
+from config import Config, db
+from models import TAXON_CLASS_TYPES, Tag, Taxon, taxon_tag
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from .taxon_aggregate_service import add_taxons_aggregates
+from .taxon_closure_service import insert_taxons_closure
+from .taxon_service import taxons_changed
+
+_CHUNK_SIZE = Config.IMPORT_CHUNK_SIZE
+_MAX_REJECTED_REPORTED = Config.IMPORT_MAX_REJECTED_REPORTED
+_RANK = {taxon_class: rank for rank, taxon_class in enumerate(TAXON_CLASS_TYPES)}
+_TAXON_FIELDS = [
+    "taxon_class",
+    "name",
+    "popular_name",
+    "description",
+    "origin",
+    "extinction",
+    "individuals_number",
+]
+_TEXT_LENGTHS = {
+    field: Taxon.__table__.c[field].type.length
+    for field in ("name", "popular_name", "description")
+}
+_INTEGER_RANGE = range(-(2**31), 2**31)
+
+
+def read_taxon_csv(stream: IO[str]) -> Iterator[dict[str, any]]:
+    """Stream taxon records from a csv file with a header line.
+    tags_ids are separated by ';'"""
+    for record in csv.DictReader(stream):
+        tags_ids = record.get("tags_ids")
+        record["tags_ids"] = (
+            [tag for tag in tags_ids.split(";") if tag] if tags_ids else []
+        )
+        yield {key: value if value != "" else None for key, value in record.items()}
+
+
+def read_taxon_ndjson(stream: IO[str]) -> Iterator[dict[str, any]]:
+    """Stream taxon records from a file with one json object per line"""
+    for line in stream:
+        line = line.strip()
+        if not line:
+            yield None
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield line
+
+
+TAXON_FILE_READERS = {"csv": read_taxon_csv, "ndjson": read_taxon_ndjson}
+
+
+class _TaxonImport:
+    """Single pass import state: the in-memory name -> (id, rank) map, the rows
+    waiting for their superior taxon and the chunk being built"""
+
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+        self.names = {
+            name: (taxon_id, _RANK[taxon_class])
+            for taxon_id, name, taxon_class in db.session.execute(
+                select(Taxon.id, Taxon.name, Taxon.taxon_class)
+            )
+        }
+        self.ids = {taxon_id: rank for taxon_id, rank in self.names.values()}
+        self.tag_ids = set(db.session.execute(select(Tag.id)).scalars())
+        self.free_ids = deque()
+        self.last_id = 0
+        self.waiting = defaultdict(list)
+        self.chunk = []
+        self.imported = 0
+        self.rejected = []
+        self.rejected_count = 0
+
+    def reject(self, line: int, record: dict, reason: str) -> None:
+        self.rejected_count += 1
+        if len(self.rejected) < _MAX_REJECTED_REPORTED:
+            name = record.get("name") if isinstance(record, dict) else None
+            self.rejected.append({"line": line, "name": name, "reason": reason})
+
+    def add(self, line: int, record: dict) -> None:
+        pending = deque([(line, record)])
+        while pending:
+            line, record = pending.popleft()
+            row = self.validate(line, record)
+            if row is None:
+                continue
+            self.accept(row)
+            pending.extend(self.waiting.pop(row["name"], []))
+
+    def validate(self, line: int, record: dict) -> dict:
+        """Validate a record against the rows known so far. Returns the row to
+        insert, or None if the record was rejected or deferred"""
+        if not isinstance(record, dict):
+            self.reject(line, {}, "Invalid_record")
+            return None
+        name = record.get("name")
+        taxon_class = record.get("taxon_class")
+        if not isinstance(name, str) or not name or taxon_class not in _RANK:
+            self.reject(line, record, "Invalid_name_or_taxon_class")
+            return None
+        if name in self.names:
+            self.reject(line, record, "This_Taxon_already_exists")
+            return None
+        row = {field: record.get(field) for field in _TAXON_FIELDS}
+        # Checked here so a bad row does not fail the insert of its whole chunk
+        for field, length in _TEXT_LENGTHS.items():
+            if row[field] is not None and not isinstance(row[field], str):
+                self.reject(line, record, "Invalid_text")
+                return None
+            if row[field] is not None and len(row[field]) > length:
+                self.reject(line, record, "Text_too_long")
+                return None
+        superior_name = record.get("superior_taxon_name")
+        superior_id = record.get("superior_taxon")
+        try:
+            for field in ("origin", "extinction", "individuals_number"):
+                if row[field] is not None:
+                    row[field] = int(row[field])
+            tags_ids = [int(tag_id) for tag_id in record.get("tags_ids") or []]
+            if superior_id is not None:
+                superior_id = int(superior_id)
+            numbers = [row["origin"], row["extinction"], row["individuals_number"]]
+            if any(
+                number not in _INTEGER_RANGE for number in numbers if number is not None
+            ):
+                raise ValueError(numbers)
+        except (TypeError, ValueError):
+            self.reject(line, record, "Invalid_number")
+            return None
+        if superior_name is not None and not isinstance(superior_name, str):
+            self.reject(line, record, "Invalid_superior_taxon")
+            return None
+        if row["origin"] is None:
+            self.reject(line, record, "Invalid_origin")
+            return None
+        if not self.tag_ids.issuperset(tags_ids):
+            self.reject(line, record, "Tag_not_found")
+            return None
+
+        rank = _RANK[taxon_class]
+        if superior_name is not None:
+            if superior_name not in self.names:
+                self.waiting[superior_name].append((line, record))
+                return None
+            superior_id, superior_rank = self.names[superior_name]
+        elif superior_id is not None:
+            if superior_id not in self.ids:
+                self.reject(line, record, "Taxon_not_found")
+                return None
+            superior_rank = self.ids[superior_id]
+        else:
+            superior_rank = None
+
+        if rank == 0 and superior_rank is not None:
+            self.reject(line, record, "Life_does_not_have_superior_taxon")
+            return None
+        if superior_rank is not None and superior_rank != rank - 1:
+            self.reject(line, record, "Invalid_superior_taxon")
+            return None
+
+        row["id"] = self.next_taxon_id()
+        row["superior_taxon"] = superior_id
+        row["line"] = line
+        row["tags_ids"] = tags_ids
+        return row
+
+    def next_taxon_id(self) -> int:
+        """Ids are reserved a chunk at a time: rows of a chunk reference their
+        superior taxons in the same chunk by id before it is inserted"""
+        if not self.free_ids:
+            self.free_ids.extend(_reserve_taxon_ids(self.chunk_size, self.last_id))
+            self.last_id = self.free_ids[-1]
+        return self.free_ids.popleft()
+
+    def accept(self, row: dict) -> None:
+        rank = _RANK[row["taxon_class"]]
+        self.names[row["name"]] = (row["id"], rank)
+        self.ids[row["id"]] = rank
+        self.chunk.append(row)
+        if len(self.chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Insert the current chunk in its own transaction"""
+        chunk, self.chunk = self.chunk, []
+        if not chunk:
+            return
+        try:
+            changed_ids = _insert_taxon_chunk(chunk)
+            db.session.commit()
+            self.imported += len(chunk)
+            taxons_changed(*changed_ids)
+        except SQLAlchemyError as error:
+            db.session.rollback()
+            for row in chunk:
+                self.names.pop(row["name"], None)
+                self.ids.pop(row["id"], None)
+                self.reject(
+                    row["line"], row, "Chunk_failed: {}".format(type(error).__name__)
+                )
+
+    def finish(self) -> None:
+        self.flush()
+        for superior_name, records in self.waiting.items():
+            for line, record in records:
+                self.reject(
+                    line, record, "Superior_taxon_{}_not_found".format(superior_name)
+                )
+        self.waiting.clear()
+
+
+def _reserve_taxon_ids(count: int, last_id: int) -> list[int]:
+    """count unused taxon ids after last_id. Postgres takes them from the id
+    sequence, so the taxons created next to or after the import do not
+    collide with them. SQLite assigns max(id) + 1 and has no sequence"""
+    if db.engine.dialect.name == "postgresql":
+        return sorted(
+            db.session.execute(
+                text(
+                    "SELECT nextval(pg_get_serial_sequence('taxons', 'id')) "
+                    "FROM generate_series(1, :count)"
+                ),
+                {"count": count},
+            ).scalars()
+        )
+    first_id = max(
+        db.session.execute(select(func.max(Taxon.id))).scalar() or 0, last_id
+    )
+    return list(range(first_id + 1, first_id + count + 1))
+
+
+def _insert_taxon_chunk(chunk: list[dict]) -> list[int]:
+    """Insert a chunk of validated rows with executemany, link them in the
+    closure and add them to the aggregates. Returns the ids whose aggregates
+    changed"""
+    db.session.execute(
+        insert(Taxon.__table__),
+        [
+            {field: row[field] for field in ["id", "superior_taxon", *_TAXON_FIELDS]}
+            for row in chunk
+        ],
+    )
+    insert_taxons_closure([(row["id"], row["taxon_class"]) for row in chunk])
+    tags = [
+        {"taxon_id": row["id"], "tag_id": tag_id}
+        for row in chunk
+        for tag_id in set(row["tags_ids"])
+    ]
+    if tags:
+        db.session.execute(insert(taxon_tag), tags)
+    return add_taxons_aggregates([row["id"] for row in chunk])
+
+
+def import_taxons(
+    records: Iterable[dict[str, any]], chunk_size: int = _CHUNK_SIZE
+) -> dict[str, any]:
+    """Bulk import taxon records.
+
+    Superior taxons are referenced by {superior_taxon_name} (resolved through an
+    in-memory name map, so they can appear anywhere in the input) or by an
+    existing {superior_taxon} id. Records whose superior taxon was not seen yet
+    are deferred until it shows up. Each chunk is inserted in one transaction.
+    """
+    start = perf_counter()
+    state = _TaxonImport(chunk_size=chunk_size)
+    for line, record in enumerate(records, start=1):
+        if record is not None:
+            state.add(line, record)
+    state.finish()
+    seconds = perf_counter() - start
+    return {
+        "imported": state.imported,
+        "rejected_count": state.rejected_count,
+        "rejected": state.rejected,
+        "seconds": round(seconds, 3),
+        "rows_per_second": (
+            round(state.imported / seconds) if seconds else state.imported
+        ),
+    }
+
+
+def import_taxon_file(
+    stream: IO[str], file_format: str, chunk_size: int = _CHUNK_SIZE
+) -> dict[str, any]:
+    """Bulk import a csv or ndjson taxon file"""
+    reader = TAXON_FILE_READERS[file_format]
+    return import_taxons(reader(stream), chunk_size=chunk_size)
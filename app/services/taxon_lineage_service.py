@@ -0,0 +1,105 @@
+from itertools import combinations
+
+import numpy as np
+from config import Config
+from responses import DefaultException
+from werkzeug.datastructures import ImmutableMultiDict
+
+from .taxon_service import id_list_param
+from .taxonomy_snapshot_service import SnapshotIndex, TaxonomySnapshot
+
+_MAX_IDS = Config.LCA_MAX_IDS
+
+
+class LineageIndex:
+    """Binary lifting table over the snapshot parent pointers: up[k][i] is the
+    row 2**k levels above row i, roots pointing at themselves. The lowest
+    common ancestor of two rows is found in O(log depth) by lifting the deeper
+    one to the other's depth, then both together while their ancestors differ.
+    Built from the snapshot, so it follows its incremental refreshes"""
+
+    def __init__(self, snapshot: TaxonomySnapshot):
+        self.snapshot = snapshot
+        self.version = snapshot.version
+        rows = np.arange(len(snapshot))
+        parent = np.where(snapshot.parent_index >= 0, snapshot.parent_index, rows)
+
+        self.depth = snapshot.depths()
+
+        self.up = [parent]
+        for _ in range(max(1, int(self.depth.max(initial=0)).bit_length()) - 1):
+            self.up.append(self.up[-1][self.up[-1]])
+
+    def lca_rows(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Lowest common ancestor row of each (a, b) pair of rows, -1 for rows
+        in different trees"""
+        a, b = np.asarray(a, np.int64), np.asarray(b, np.int64)
+        deeper = self.depth[a] < self.depth[b]
+        a, b = np.where(deeper, b, a), np.where(deeper, a, b)
+        lift = self.depth[a] - self.depth[b]
+        for k, up in enumerate(self.up):
+            a = np.where((lift >> k) & 1, up[a], a)
+        for up in reversed(self.up):
+            differ = up[a] != up[b]
+            a, b = np.where(differ, up[a], a), np.where(differ, up[b], b)
+        lca = np.where(a == b, a, self.up[0][a])
+        return np.where(self.up[0][a] == self.up[0][b], lca, -1)
+
+    def distance_rows(self, a: np.ndarray, b: np.ndarray, lca: np.ndarray):
+        """Number of parent links between a and b through their lca"""
+        return self.depth[a] + self.depth[b] - 2 * self.depth[lca]
+
+
+lineage_index = SnapshotIndex(LineageIndex)
+
+
+def get_lineage_index() -> tuple[LineageIndex, TaxonomySnapshot]:
+    """Lineage index of the current snapshot and the snapshot it was built
+    from"""
+    return lineage_index.get()
+
+
+def get_taxons_lca(params: ImmutableMultiDict) -> dict[str, any]:
+    """Lowest common ancestor of the {ids} taxons and the lineage distance of
+    every pair of them"""
+    ids = id_list_param(params, "ids")
+    if len(ids) < 2:
+        raise DefaultException(message="At_least_two_ids_are_required", code=400)
+    if len(ids) > _MAX_IDS:
+        raise DefaultException(message="Too_many_ids", code=400)
+
+    index, snapshot = get_lineage_index()
+    rows = np.array([snapshot.position(taxon_id) for taxon_id in ids], np.int64)
+
+    first, second = np.array(list(combinations(range(len(rows)), 2))).T
+    a, b = rows[first], rows[second]
+    pairs_lca = index.lca_rows(a, b)
+    related = pairs_lca >= 0
+    distances = np.where(
+        related, index.distance_rows(a, b, np.maximum(pairs_lca, 0)), -1
+    )
+
+    lca = rows[0]
+    for row in rows[1:]:
+        lca = int(index.lca_rows([lca], [row])[0])
+        if lca < 0:
+            break
+
+    return {
+        "lca": None if lca < 0 else snapshot.summary(lca),
+        "taxons": [
+            dict(snapshot.summary(row), depth=int(index.depth[row]))
+            for row in rows.tolist()
+        ],
+        "pairs": [
+            {
+                "first_id": int(snapshot.ids[first_row]),
+                "second_id": int(snapshot.ids[second_row]),
+                "lca_id": int(snapshot.ids[lca_row]) if lca_row >= 0 else None,
+                "distance": distance if distance >= 0 else None,
+            }
+            for first_row, second_row, lca_row, distance in zip(
+                a.tolist(), b.tolist(), pairs_lca.tolist(), distances.tolist()
+            )
+        ],
+    }
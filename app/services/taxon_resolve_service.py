@@ -0,0 +1,191 @@
+import re
+
+import numpy as np
+from config import Config
+from responses import DefaultException
+
+from .taxon_autocomplete_service import fold_name
+from .taxonomy_snapshot_service import SnapshotIndex, TaxonomySnapshot
+
+_MAX_NAMES = Config.RESOLVE_MAX_NAMES
+_MIN_SCORE = Config.RESOLVE_MIN_SCORE
+_MAX_POSTINGS = Config.RESOLVE_MAX_POSTINGS
+_FUZZY_CANDIDATES = 50
+_WORD = re.compile(r"\w+", re.UNICODE)
+# Trigrams are packed in a uint64, 21 bits per code point
+_CODE_BITS = 21
+
+
+def normalize_name(name: str) -> str:
+    """Folded words of a name: case, accents, punctuation and spacing ignored"""
+    return " ".join(_WORD.findall(fold_name(name)))
+
+
+def _trigrams(key: str) -> set[int]:
+    padded = "  {} ".format(key)
+    return {
+        (ord(padded[i]) << 2 * _CODE_BITS)
+        | (ord(padded[i + 1]) << _CODE_BITS)
+        | ord(padded[i + 2])
+        for i in range(len(padded) - 2)
+    }
+
+
+def _trigram_postings(keys: list[str]) -> tuple[np.ndarray, ...]:
+    """Sorted distinct trigrams, the start of each trigram's rows in the
+    postings, the postings and the number of distinct trigrams of each key.
+    Built with numpy over the code points of all the keys at once"""
+    padded = ["  {} ".format(key) for key in keys]
+    lengths = np.fromiter(map(len, padded), np.int64, len(padded))
+    codes = np.frombuffer("".join(padded).encode("utf-32-le"), np.uint32)
+    codes = codes.astype(np.uint64)
+    owners = np.repeat(np.arange(len(keys)), lengths)
+
+    # Trigrams starting in the last two characters of a key would span two keys
+    starts = np.ones(len(codes), np.bool_)
+    ends = np.cumsum(lengths)
+    starts[np.concatenate([ends - 1, ends - 2])] = False
+    starts = np.flatnonzero(starts)
+    grams = (
+        (codes[starts] << np.uint64(2 * _CODE_BITS))
+        | (codes[starts + 1] << np.uint64(_CODE_BITS))
+        | codes[starts + 2]
+    )
+    owners = owners[starts]
+
+    order = np.lexsort((owners, grams))
+    grams, owners = grams[order], owners[order]
+    distinct = np.ones(len(grams), np.bool_)
+    distinct[1:] = (grams[1:] != grams[:-1]) | (owners[1:] != owners[:-1])
+    grams, owners = grams[distinct], owners[distinct]
+
+    unique_grams, offsets = np.unique(grams, return_index=True)
+    offsets = np.append(offsets, len(grams))
+    counts = np.bincount(owners, minlength=len(keys))
+    return unique_grams, offsets, owners, counts
+
+
+class NameIndex:
+    """Lookups of taxon names built from a snapshot: exact names and
+    normalized names in dicts, and trigram postings for fuzzy matching, built
+    on the first fuzzy lookup.
+
+    A fuzzy lookup gathers the snapshot rows sharing the rarest trigrams of
+    the name, skipping trigrams carried by more than RESOLVE_MAX_POSTINGS
+    names, keeps the ones sharing the most and scores them with the Dice
+    coefficient of their trigram sets.
+    """
+
+    def __init__(self, snapshot: TaxonomySnapshot):
+        self.snapshot = snapshot
+        self.version = snapshot.version
+        self.exact = {}
+        self.normalized = {}
+        for row, name in enumerate(snapshot.names):
+            self.exact.setdefault(name, row)
+            self.normalized.setdefault(normalize_name(name), row)
+        self._keys = list(self.normalized)
+        self._rows = np.fromiter(self.normalized.values(), np.int64, len(self._keys))
+        self._postings = None
+
+    def fuzzy(self, key: str) -> tuple[int, float]:
+        """Row of the closest normalized name and its similarity, None when no
+        name shares a trigram with the key"""
+        if self._postings is None:
+            self._postings = _trigram_postings(self._keys)
+        unique_grams, offsets, owners, counts = self._postings
+
+        grams = _trigrams(key)
+        found = []
+        for gram in grams:
+            index = int(np.searchsorted(unique_grams, gram))
+            if index < len(unique_grams) and unique_grams[index] == gram:
+                found.append((offsets[index + 1] - offsets[index], index))
+        if not found:
+            return None
+        found.sort()
+        rare = [index for size, index in found if size <= _MAX_POSTINGS]
+        candidates = np.concatenate(
+            [
+                owners[offsets[index] : offsets[index + 1]]
+                for index in rare or [found[0][1]]
+            ]
+        )
+        candidates, shared = np.unique(candidates, return_counts=True)
+        # Shared counts of the rare trigrams only, so the best few are rescored
+        best = candidates[np.argsort(-shared, kind="stable")[:_FUZZY_CANDIDATES]]
+
+        scored = []
+        for key_index in best.tolist():
+            similarity = (
+                2
+                * len(grams & _trigrams(self._keys[key_index]))
+                / (len(grams) + int(counts[key_index]))
+            )
+            scored.append((-similarity, key_index))
+        similarity, key_index = min(scored)
+        return int(self._rows[key_index]), -similarity
+
+
+name_index = SnapshotIndex(NameIndex)
+
+
+def get_name_index() -> tuple[NameIndex, TaxonomySnapshot]:
+    """Name index of the current snapshot and the snapshot it was built from"""
+    return name_index.get()
+
+
+def _resolution(
+    snapshot: TaxonomySnapshot, row: int, match_type: str, score: float
+) -> dict[str, any]:
+    return {
+        "taxon": snapshot.summary(row),
+        "match_type": match_type,
+        "score": round(score, 4),
+    }
+
+
+def resolve_taxon_names(data: dict[str, any]) -> dict[str, any]:
+    """Best matching taxon of each name in {names}: exact name first, then
+    normalized name, then, unless {fuzzy} is false, the closest name by
+    trigram similarity when it scores at least {min_score}"""
+    if not isinstance(data, dict):
+        raise DefaultException(message="Invalid_data", code=400)
+    names = data.get("names") or []
+    if not isinstance(names, list):
+        raise DefaultException(message="Names_must_be_a_list", code=400)
+    if not names:
+        raise DefaultException(message="Names_are_required", code=400)
+    if len(names) > _MAX_NAMES:
+        raise DefaultException(message="Too_many_names", code=400)
+    if not all(isinstance(name, str) for name in names):
+        raise DefaultException(message="Names_must_be_strings", code=400)
+    fuzzy = data.get("fuzzy", True)
+    if not isinstance(fuzzy, bool):
+        raise DefaultException(message="Invalid_fuzzy", code=400)
+    min_score = data.get("min_score", _MIN_SCORE)
+    if isinstance(min_score, bool) or not isinstance(min_score, (int, float)):
+        raise DefaultException(message="Invalid_min_score", code=400)
+
+    index, snapshot = get_name_index()
+    resolved = {}
+    items = []
+    for name in names:
+        if name not in resolved:
+            match = None
+            key = normalize_name(name)
+            if name in index.exact:
+                match = _resolution(snapshot, index.exact[name], "exact", 1.0)
+            elif key in index.normalized:
+                match = _resolution(snapshot, index.normalized[key], "normalized", 1.0)
+            elif fuzzy and key:
+                closest = index.fuzzy(key)
+                if closest is not None and closest[1] >= min_score:
+                    match = _resolution(snapshot, closest[0], "fuzzy", closest[1])
+            resolved[name] = match or {"taxon": None, "match_type": None, "score": 0.0}
+        items.append(dict(resolved[name], name=name))
+
+    return {
+        "items": items,
+        "matched": sum(item["taxon"] is not None for item in items),
+    }
@@ -0,0 +1,87 @@
+import re
+
+from config import Config, db
+from models import (
+    TAXON_SEARCH_POSTGRESQL_DDL,
+    TAXON_SEARCH_SQLITE_DDL,
+    Taxon,
+)
+from responses import DefaultException
+from sqlalchemy import Float, Integer, column, text
+from werkzeug.datastructures import ImmutableMultiDict
+
+from .taxon_service import taxon_loader_options
+
+_CONTENT_PER_PAGE = Config.DEFAULT_CONTENT_PER_PAGE
+_MAX_CONTENT_PER_PAGE = max(Config.CONTENT_PER_PAGE)
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+# name matches weigh more than popular_name, which weighs more than description
+_SQLITE_SEARCH = text(
+    "SELECT rowid AS id, bm25(taxons_fts, 10.0, 5.0, 1.0) AS score "
+    "FROM taxons_fts WHERE taxons_fts MATCH :query "
+    "ORDER BY score LIMIT :limit"
+)
+_POSTGRESQL_SEARCH = text(
+    "SELECT id, -ts_rank(search_vector, to_tsquery('simple', :query)) AS score "
+    "FROM taxons WHERE search_vector @@ to_tsquery('simple', :query) "
+    "ORDER BY score LIMIT :limit"
+)
+
+
+def _search_terms(query: str) -> list[str]:
+    return _TERM.findall(query.lower())
+
+
+def search_taxons(params: ImmutableMultiDict) -> dict[str, any]:
+    """Ranked full-text search, every term of {q} is matched as a prefix"""
+    query = params.get("q", type=str, default="")
+    limit = params.get("limit", type=int, default=_CONTENT_PER_PAGE)
+    limit = max(1, min(limit, _MAX_CONTENT_PER_PAGE))
+
+    terms = _search_terms(query)
+    if not terms:
+        raise DefaultException(message="Search_query_is_required", code=400)
+
+    dialect = db.engine.dialect.name
+    if dialect == "sqlite":
+        search = _SQLITE_SEARCH.bindparams(
+            query=" ".join('"{}"*'.format(term) for term in terms), limit=limit
+        )
+    elif dialect == "postgresql":
+        search = _POSTGRESQL_SEARCH.bindparams(
+            query=" & ".join("{}:*".format(term) for term in terms), limit=limit
+        )
+    else:
+        return {
+            "query": query,
+            "items": Taxon.query.options(*taxon_loader_options("list"))
+            .filter(*[Taxon.name.ilike(f"%{term}%") for term in terms])
+            .order_by(Taxon.name)
+            .limit(limit)
+            .all(),
+        }
+
+    ranked = search.columns(column("id", Integer), column("score", Float)).subquery()
+    items = (
+        Taxon.query.options(*taxon_loader_options("list"))
+        .join(ranked, Taxon.id == ranked.c.id)
+        .order_by(ranked.c.score, Taxon.id)
+        .all()
+    )
+    return {"query": query, "items": items}
+
+
+def rebuild_taxon_search_index() -> None:
+    """Create the search structures on an existing database and re-index it"""
+    dialect = db.engine.dialect.name
+    if dialect == "sqlite":
+        for statement in TAXON_SEARCH_SQLITE_DDL:
+            db.session.execute(text(statement))
+        db.session.execute(
+            text("INSERT INTO taxons_fts(taxons_fts) VALUES ('rebuild')")
+        )
+    elif dialect == "postgresql":
+        for statement in TAXON_SEARCH_POSTGRESQL_DDL:
+            db.session.execute(text(statement))
+    db.session.commit()
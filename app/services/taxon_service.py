@@ -1,29 +1,203 @@
 from math import ceil
 
+import numpy as np
 from config import Config, db
-from models import Taxon, Tag, TAXON_CLASS_TYPES
-from responses import DefaultException, response
+from models import Taxon, Tag, TAXON_CLASS_TYPES, taxon_tag
+from responses import DefaultException, make_etag, response
+from sqlalchemy import func, literal, select
+from sqlalchemy.orm import selectinload
 from werkzeug.datastructures import ImmutableMultiDict
-from .tag_service import get_tag
+
+from .cache_service import facet_cache, taxon_cache
+from .image_service import delete_origin_images, remove_unused_image_files
+from .pagination_service import (
+    is_cursor_request,
+    paginate_by_cursor,
+    projected_query,
+    projection_param,
+)
+from .tag_service import get_tag, serialize_tag
+from .taxon_aggregate_service import add_taxons_aggregates, relink_taxon
+from .taxonomy_snapshot_service import taxonomy_snapshot
+from .taxon_autocomplete_service import autocomplete_index
+from .taxon_tag_index_service import get_taxon_tag_index, taxon_tag_index
+from .taxon_closure_service import (
+    delete_taxon_closure,
+    descendant_of,
+    insert_taxon_closure,
+)
 
 _CONTENT_PER_PAGE = Config.DEFAULT_CONTENT_PER_PAGE
+_TAG_FILTER_MAX_IDS = Config.TAG_FILTER_MAX_IDS
+# Loader options per endpoint, so marshalling never lazy loads per item
+TAXON_LOADER_PROFILES = {
+    "list": [selectinload(Taxon.tags)],
+    "detail": [selectinload(Taxon.tags)],
+}
+TAXON_OPTIONAL_LOADERS = {
+    "ancestors": selectinload(Taxon.ancestors),
+}
+_TREE_DEPTH = Config.DEFAULT_TREE_DEPTH
+_TREE_FIELDS = [
+    "id",
+    "taxon_class",
+    "name",
+    "popular_name",
+    "origin",
+    "extinction",
+    "superior_taxon",
+    "descendant_count",
+    "species_count",
+    "individuals_sum",
+]
+# Columns a list can be projected on with {fields}
+TAXON_PROJECTION_COLUMNS = {
+    "taxon_class": Taxon.taxon_class,
+    "name": Taxon.name,
+    "popular_name": Taxon.popular_name,
+    "description": Taxon.description,
+    "origin": Taxon.origin,
+    "extinction": Taxon.extinction,
+    "individuals_number": Taxon.individuals_number,
+    "superior_taxon": Taxon.superior_taxon,
+    "descendant_count": Taxon.descendant_count,
+    "species_count": Taxon.species_count,
+    "individuals_sum": Taxon.individuals_sum,
+    "version": Taxon.version,
+    "updated_at": Taxon.updated_at,
+    "id": Taxon.id,
+}
+_SORT_FIELDS = {
+    "id": Taxon.id,
+    "name": Taxon.name,
+    "origin": Taxon.origin,
+    "extinction": Taxon.extinction,
+    "individuals_number": Taxon.individuals_number,
+    "descendant_count": Taxon.descendant_count,
+    "species_count": Taxon.species_count,
+    "individuals_sum": Taxon.individuals_sum,
+}
 
 
-def get_taxons(params: ImmutableMultiDict) -> dict[str, any]:
-    page = params.get("page", type=int, default=1)
-    per_page = params.get("per_page", type=int, default=_CONTENT_PER_PAGE)
+def taxons_changed(*taxon_ids: int) -> None:
+    """Drop what the process keeps in memory about taxons written to the
+    database. Call it after the commit"""
+    taxon_cache.invalidate(*taxon_ids)
+    facet_cache.clear()
+    taxonomy_snapshot.mark_changed(*taxon_ids)
+    taxon_tag_index.mark_changed(*taxon_ids)
+    autocomplete_index.mark_changed(*taxon_ids)
+
+
+def taxon_loader_options(profile: str, include: list = None) -> list:
+    """Loader options of a profile, plus the optional relationships in include"""
+    options = list(TAXON_LOADER_PROFILES[profile])
+    for relationship in include or []:
+        options.append(TAXON_OPTIONAL_LOADERS[relationship])
+    return options
+
+
+def alive_at_filter(time: int):
+    """Taxons alive at time. origin and extinction count time before present,
+    so a taxon is alive from its origin down to its extinction, if any"""
+    return db.and_(
+        Taxon.origin >= time,
+        db.or_(Taxon.extinction.is_(None), Taxon.extinction <= time),
+    )
+
+
+def taxon_order_by(sort: str) -> list:
+    """ORDER BY of a {sort} parameter: a field of _SORT_FIELDS, descending when
+    prefixed with '-'. Ties are broken by id"""
+    field = sort.lstrip("-")
+    if field not in _SORT_FIELDS:
+        raise DefaultException(message="Invalid_sort_field", code=400)
+    column = _SORT_FIELDS[field]
+    return [column.desc() if sort.startswith("-") else column, Taxon.id]
+
+
+def id_list_param(params: ImmutableMultiDict, key: str) -> list[int]:
+    """Ids of a parameter given as 1,2,3 and/or repeated"""
+    try:
+        return sorted(
+            {
+                int(value)
+                for values in params.getlist(key)
+                for value in values.split(",")
+                if value.strip()
+            }
+        )
+    except ValueError:
+        raise DefaultException(message="Invalid_{}".format(key), code=400)
+
+
+def tagged_with_all(tags_ids: list[int]):
+    """Filter expression matching the taxons carrying every tag, answered by
+    one grouped scan of the taxon_tag (tag_id, taxon_id) index"""
+    return Taxon.id.in_(
+        select(taxon_tag.c.taxon_id)
+        .where(taxon_tag.c.tag_id.in_(tags_ids))
+        .group_by(taxon_tag.c.taxon_id)
+        .having(func.count(taxon_tag.c.tag_id) == len(tags_ids))
+    )
+
+
+def tagged_with_any(tags_ids: list[int]):
+    """Filter expression matching the taxons carrying at least one of the tags"""
+    return Taxon.id.in_(
+        select(taxon_tag.c.taxon_id).where(taxon_tag.c.tag_id.in_(tags_ids))
+    )
+
+
+def tags_filter(tags_all: list[int], tags_any: list[int]):
+    """Filter expression of the tags_all and tags_any parameters. The matching
+    ids are found with the in-memory tag bitmaps and passed as an id list, up to
+    TAG_FILTER_MAX_IDS of them. Larger matches use the grouped subqueries"""
+    index = get_taxon_tag_index()
+    taxon_ids = index.all_of(tags_all) if tags_all else None
+    if tags_any:
+        any_ids = index.any_of(tags_any)
+        taxon_ids = (
+            any_ids
+            if taxon_ids is None
+            else np.intersect1d(taxon_ids, any_ids, assume_unique=True)
+        )
+    if len(taxon_ids) <= _TAG_FILTER_MAX_IDS:
+        return Taxon.id.in_(taxon_ids.tolist())
+
+    filters = []
+    if tags_all:
+        filters.append(tagged_with_all(tags_all))
+    if tags_any:
+        filters.append(tagged_with_any(tags_any))
+    return db.and_(*filters)
+
+
+def taxon_filters(params: ImmutableMultiDict) -> list:
+    """Filter expressions of the taxon list parameters"""
     taxon_class = params.get("taxon_class", type=str)
     name = params.get("name", type=str)
     popular_name = params.get("popular_name", type=str)
     description = params.get("description", type=str)
     origin = params.get("origin", type=int)
     extinction = params.get("extinction", type=int)
+    origin_min = params.get("origin_min", type=int)
+    origin_max = params.get("origin_max", type=int)
+    extinction_min = params.get("extinction_min", type=int)
+    extinction_max = params.get("extinction_max", type=int)
+    alive_at = params.get("alive_at", type=int)
     superior_taxon_id = params.get("superior_taxon_id", type=int)
     tag_id = params.get("tag_id", type=int)
     ancestor_id = params.get("ancestor_id", type=int)
+    tags_all = id_list_param(params, "tags_all")
+    tags_any = id_list_param(params, "tags_any")
+    if None not in (origin_min, origin_max) and origin_min > origin_max:
+        raise DefaultException(message="Invalid_origin_range", code=400)
+    if None not in (extinction_min, extinction_max) and extinction_min > extinction_max:
+        raise DefaultException(message="Invalid_extinction_range", code=400)
     filters = []
     if taxon_class:
-        filters.append(Taxon.taxon == taxon_class)
+        filters.append(Taxon.taxon_class == taxon_class)
     if name:
         filters.append(Taxon.name.ilike(f"%{name}%"))
     if popular_name:
@@ -34,24 +208,55 @@ def get_taxons(params: ImmutableMultiDict) -> dict[str, any]:
         filters.append(Taxon.origin == origin)
     if extinction:
         filters.append(Taxon.extinction == extinction)
+    if origin_min is not None:
+        filters.append(Taxon.origin >= origin_min)
+    if origin_max is not None:
+        filters.append(Taxon.origin <= origin_max)
+    if extinction_min is not None:
+        filters.append(Taxon.extinction >= extinction_min)
+    if extinction_max is not None:
+        filters.append(Taxon.extinction <= extinction_max)
+    if alive_at is not None:
+        filters.append(alive_at_filter(alive_at))
     if superior_taxon_id:
-        filters.append(Taxon.superior_taxon.id == superior_taxon_id)
+        filters.append(Taxon.superior_taxon == superior_taxon_id)
     if tag_id:
         filters.append(Taxon.tags.any(id=tag_id))
+    if tags_all or tags_any:
+        filters.append(tags_filter(tags_all, tags_any))
     if ancestor_id:
-        filters.append(Taxon.ancestors.any(id=ancestor_id))
+        filters.append(descendant_of(ancestor_id))
+    return filters
 
-    pagination = (
-        Taxon.query.filter(*filters)
-        .order_by(Taxon.id)
-        .paginate(page=page, per_page=per_page, error_out=False)
-    )
-    return {
-        "current_page": page,
-        "total_items": pagination.total,
-        "total_pages": ceil(pagination.total / per_page),
-        "items": pagination.items,
-    }
+
+def get_taxons(params: ImmutableMultiDict) -> dict[str, any]:
+    page = params.get("page", type=int, default=1)
+    per_page = params.get("per_page", type=int, default=_CONTENT_PER_PAGE)
+    sort = params.get("sort", type=str, default="id")
+    projection = projection_param(params, TAXON_PROJECTION_COLUMNS)
+    filters = taxon_filters(params)
+
+    query = Taxon.query.filter(*filters)
+    if projection is None:
+        query = query.options(*taxon_loader_options("list"))
+    else:
+        query = projected_query(query, TAXON_PROJECTION_COLUMNS, projection)
+    if is_cursor_request(params):
+        if sort != "id":
+            raise DefaultException(message="Sort_is_not_supported_by_cursor", code=400)
+        page = paginate_by_cursor(query, Taxon.id, params)
+    else:
+        pagination = query.order_by(*taxon_order_by(sort)).paginate(
+            page=page, per_page=per_page, error_out=False
+        )
+        page = {
+            "current_page": page,
+            "total_items": pagination.total,
+            "total_pages": ceil(pagination.total / per_page),
+            "items": pagination.items,
+        }
+    page["fields"] = projection
+    return page
 
 
 def get_taxon(taxon_id: int, options: list = None) -> Taxon:
@@ -64,6 +269,71 @@ def get_taxon(taxon_id: int, options: list = None) -> Taxon:
     return taxon
 
 
+def serialize_taxon(taxon: Taxon) -> dict[str, any]:
+    return {
+        "taxon_class": taxon.taxon_class,
+        "name": taxon.name,
+        "popular_name": taxon.popular_name,
+        "description": taxon.description,
+        "origin": taxon.origin,
+        "extinction": taxon.extinction,
+        "individuals_number": taxon.individuals_number,
+        "superior_taxon": taxon.superior_taxon,
+        "descendant_count": taxon.descendant_count,
+        "species_count": taxon.species_count,
+        "individuals_sum": taxon.individuals_sum,
+        "version": taxon.version,
+        "updated_at": taxon.updated_at,
+        "tags": [serialize_tag(tag) for tag in taxon.tags],
+        "id": taxon.id,
+    }
+
+
+def taxon_etag(taxon: dict[str, any]) -> str:
+    return make_etag("taxon", taxon["id"], taxon["version"], taxon["updated_at"])
+
+
+def get_taxon_payload(taxon_id: int) -> dict[str, any]:
+    """Get a serialized taxon, read through the taxon cache"""
+    return taxon_cache.get_or_load(
+        taxon_id,
+        lambda: serialize_taxon(
+            get_taxon(taxon_id, options=taxon_loader_options("detail"))
+        ),
+    )
+
+
+def get_taxon_tree(taxon_id: int, params: ImmutableMultiDict) -> dict[str, any]:
+    """Get the branch under a taxon, down to {depth} levels, with one recursive
+    query over superior_taxon"""
+    depth = params.get("depth", type=int, default=_TREE_DEPTH)
+    depth = max(0, min(depth, len(TAXON_CLASS_TYPES) - 1))
+
+    columns = [getattr(Taxon, field) for field in _TREE_FIELDS]
+    tree = (
+        select(*columns, literal(0).label("level"))
+        .where(Taxon.id == taxon_id)
+        .cte("tree", recursive=True)
+    )
+    tree = tree.union_all(
+        select(*columns, tree.c.level + 1)
+        .join(tree, Taxon.superior_taxon == tree.c.id)
+        .where(tree.c.level < depth)
+    )
+    rows = db.session.execute(select(tree).order_by(tree.c.level, tree.c.id)).all()
+    if not rows:
+        raise DefaultException(message="Taxon_not_found", code=404)
+
+    nodes = {}
+    for row in rows:
+        node = {field: getattr(row, field) for field in _TREE_FIELDS}
+        node["children"] = []
+        nodes[row.id] = node
+        if row.level > 0:
+            nodes[row.superior_taxon]["children"].append(node)
+    return nodes[taxon_id]
+
+
 def save_new_taxon(data: dict[str, any]) -> dict[str, any]:
     verify_superior_taxon(
         taxon_class=data.get("taxon_class"),
@@ -76,14 +346,8 @@ def save_new_taxon(data: dict[str, any]) -> dict[str, any]:
         raise DefaultException(message="This_Taxon_already_exists", code=409)
 
     tags = []
-    if "tags" in data:
-        tag_ids = data["tags_ids"]
-        tags = Tag.query.filter(Tag.id.in_(tag_ids)).all()
-    
-    ancestors = []
-    if "ancestors" in data:
-        ancestor_ids = data["ancestors_ids"]
-        ancestors = Taxon.query.filter(Taxon.id.in_(ancestor_ids)).all()
+    if "tags_ids" in data:
+        tags = Tag.query.filter(Tag.id.in_(data["tags_ids"])).all()
 
     new_taxon = Taxon(
         taxon_class=data.get("taxon_class"),
@@ -95,27 +359,39 @@ def save_new_taxon(data: dict[str, any]) -> dict[str, any]:
         individuals_number=data.get("individuals_number"),
         superior_taxon=data.get("superior_taxon"),
         tags=tags,
-        ancestors=ancestors,
     )
     db.session.add(new_taxon)
+    db.session.flush()
+    insert_taxon_closure(new_taxon.id, new_taxon.superior_taxon)
+    changed_ids = add_taxons_aggregates([new_taxon.id])
     db.session.commit()
+    taxons_changed(*changed_ids)
     return response(status="success", message="Taxon_successfully_created", code=201)
 
 
 def update_taxon_by_id(taxon_id, data) -> dict[str, any]:
+    taxon = get_taxon(taxon_id)
+    # The taxon only moves when the payload names a superior taxon
+    superior_taxon_id = data.get("superior_taxon", taxon.superior_taxon)
     verify_superior_taxon(
         taxon_class=data.get("taxon_class"),
-        superior_taxon_id=data.get("superior_taxon"),
+        superior_taxon_id=superior_taxon_id,
     )
-    taxon = get_taxon(taxon_id)
+    # Its inferiors were checked against the current class
+    if data.get("taxon_class") != taxon.taxon_class and taxons_with_inferiors(
+        [taxon.id]
+    ):
+        raise DefaultException(message="Taxon_has_inferior_taxons", code=409)
+
+    if "tags_ids" in data:
+        taxon.tags = Tag.query.filter(Tag.id.in_(data["tags_ids"])).all()
 
-    if "tags" in data:
-        tag_ids = data["tags_ids"]
-        tags = Tag.query.filter(Tag.id.in_(tag_ids)).all()
-    
-    if "ancestors" in data:
-        ancestor_ids = data["ancestors_ids"]
-        ancestors = Taxon.query.filter(Taxon.id.in_(ancestor_ids)).all()
+    changed_ids = relink_taxon(
+        taxon.id,
+        taxon_class=data.get("taxon_class"),
+        individuals_number=data.get("individuals_number"),
+        superior_taxon_id=superior_taxon_id,
+    )
 
     taxon.taxon_class = data.get("taxon_class")
     taxon.name = data.get("name")
@@ -124,9 +400,10 @@ def update_taxon_by_id(taxon_id, data) -> dict[str, any]:
     taxon.origin = data.get("origin")
     taxon.extinction = data.get("extinction")
     taxon.individuals_number = data.get("individuals_number")
-    taxon.tags = tags
-    taxon.ancestors = ancestors
+    taxon.superior_taxon = superior_taxon_id
+    taxon.version = Taxon.version + 1  # also when only the tags changed
     db.session.commit()
+    taxons_changed(*changed_ids)
     return response(status="success", message="Taxon_successfully_updated", code=200)
 
 
@@ -134,11 +411,29 @@ def delete_taxon_by_id(taxon_id) -> dict[str, any]:
     taxon = Taxon.query.filter_by(id=taxon_id).first()
     if taxon is None:
         raise DefaultException(message="Taxon_does_not_exist.", code=404)
+    if taxons_with_inferiors([taxon_id]):
+        raise DefaultException(message="Taxon_has_inferior_taxons", code=409)
+    changed_ids = add_taxons_aggregates([taxon_id], sign=-1)
+    delete_taxon_closure(taxon_id)
+    content_hashes = delete_origin_images("taxon", taxon_id)
     db.session.delete(taxon)
     db.session.commit()
+    remove_unused_image_files(content_hashes)
+    taxons_changed(*changed_ids)
     return response(status="success", message="Taxon_successfully_deleted", code=200)
 
 
+def taxons_with_inferiors(taxon_ids: list[int]) -> set[int]:
+    """The taxons among taxon_ids that are the superior taxon of another one"""
+    return set(
+        db.session.execute(
+            select(Taxon.superior_taxon)
+            .where(Taxon.superior_taxon.in_(taxon_ids))
+            .distinct()
+        ).scalars()
+    )
+
+
 def verify_superior_taxon(taxon_class: str, superior_taxon_id: Taxon) -> bool:
     """Verify if the superior taxon is valid"""
     if taxon_class == "life" and superior_taxon_id is None:
@@ -149,23 +444,17 @@ def verify_superior_taxon(taxon_class: str, superior_taxon_id: Taxon) -> bool:
     if superior_taxon_id is None:
         return True
 
-    superior_taxon = get_taxon(superior_taxon_id)
+    superior_taxon = get_taxon_payload(superior_taxon_id)
 
     if TAXON_CLASS_TYPES.index(taxon_class) - 1 != TAXON_CLASS_TYPES.index(
-        superior_taxon.taxon_class
+        superior_taxon["taxon_class"]
     ):
         raise DefaultException(
             message="Taxon_{}_is_not_a_valid_superior_taxon_of_{},_it_should_be_a_{}".format(
-                superior_taxon.name,
+                superior_taxon["name"],
                 taxon_class,
                 TAXON_CLASS_TYPES[TAXON_CLASS_TYPES.index(taxon_class) - 1],
             ),
             code=400,
         )
     return True
-
-def verify_ancestor_taxon(taxon: Taxon, ancestors_taxons_id: list) -> bool:
-    """Verify if an list of taxons can be ancestors of a taxon"""
-    
-
-    
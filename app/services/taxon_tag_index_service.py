@@ -0,0 +1,141 @@
+from collections import defaultdict
+from threading import RLock
+from time import monotonic
+
+import numpy as np
+from config import Config, db
+from models import taxon_tag
+from sqlalchemy import select
+
+_MAX_AGE = Config.SNAPSHOT_MAX_AGE_SECONDS
+_REFRESH_CHUNK = 500
+
+
+def _bit_masks(taxon_ids: np.ndarray) -> np.ndarray:
+    """Masks of the taxon ids in their byte, in np.packbits bit order"""
+    return (np.uint8(0x80) >> (taxon_ids & 7).astype(np.uint8)).astype(np.uint8)
+
+
+class TaxonTagIndex:
+    """Per-tag bitmaps of taxon ids, packed with np.packbits: bit i of a tag's
+    bitmap is set when the taxon with id i carries the tag.
+
+    Multi-tag filters are answered with bitwise AND/OR over the bitmaps instead
+    of grouping taxon_tag rows in SQL. Kept fresh like the taxonomy snapshot:
+    mark_changed patches the bits of the touched taxons on the next read,
+    mark_stale forces a full reload. Published bitmaps are never modified, a
+    refresh swaps in a new dict.
+    """
+
+    def __init__(self):
+        self.bitmaps = {}
+        self.version = 0
+        self._loaded_at = None
+        self._changed = set()
+        self._lock = RLock()
+
+    # --------------------- maintenance ---------------------
+
+    def mark_changed(self, *taxon_ids: int) -> None:
+        with self._lock:
+            self._changed.update(taxon_ids)
+
+    def mark_stale(self) -> None:
+        with self._lock:
+            self._loaded_at = None
+            self._changed.clear()
+
+    def refresh(self) -> "TaxonTagIndex":
+        """Bring the bitmaps up to date with the database"""
+        with self._lock:
+            if self._loaded_at is None or monotonic() - self._loaded_at > _MAX_AGE:
+                self._load()
+            elif self._changed:
+                self._patch()
+        return self
+
+    def _load(self) -> None:
+        rows = db.session.execute(
+            select(taxon_tag.c.tag_id, taxon_tag.c.taxon_id).order_by(
+                taxon_tag.c.tag_id
+            )
+        ).all()
+        tag_ids = np.fromiter((row[0] for row in rows), np.int64, len(rows))
+        taxon_ids = np.fromiter((row[1] for row in rows), np.int64, len(rows))
+        bitmaps = {}
+        if rows:
+            bounds = np.flatnonzero(np.diff(tag_ids)) + 1
+            for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(rows)]):
+                tag_taxon_ids = taxon_ids[start:end]
+                bits = np.zeros(tag_taxon_ids.max() + 1, np.bool_)
+                bits[tag_taxon_ids] = True
+                bitmaps[int(tag_ids[start])] = np.packbits(bits)
+        self.bitmaps = bitmaps
+        self._changed.clear()
+        self._loaded_at = monotonic()
+        self.version += 1
+
+    def _patch(self) -> None:
+        changed = np.array(sorted(self._changed), np.int64)
+        self._changed.clear()
+        rows = []
+        for start in range(0, len(changed), _REFRESH_CHUNK):
+            chunk = changed[start : start + _REFRESH_CHUNK].tolist()
+            rows.extend(
+                db.session.execute(
+                    select(taxon_tag.c.tag_id, taxon_tag.c.taxon_id).where(
+                        taxon_tag.c.taxon_id.in_(chunk)
+                    )
+                ).all()
+            )
+
+        # Patch copies of the touched bitmaps and publish them with one
+        # assignment, a reader keeps the bitmaps it already holds
+        bitmaps = dict(self.bitmaps)
+        masks = _bit_masks(changed)
+        for tag_id, bitmap in self.bitmaps.items():
+            inside = changed < len(bitmap) * 8
+            offsets = changed[inside] >> 3
+            if np.any(bitmap[offsets] & masks[inside]):
+                bitmap = bitmaps[tag_id] = bitmap.copy()
+                np.bitwise_and.at(bitmap, offsets, ~masks[inside])
+        fresh = defaultdict(list)
+        for tag_id, taxon_id in rows:
+            fresh[tag_id].append(taxon_id)
+        for tag_id, taxon_ids in fresh.items():
+            taxon_ids = np.array(taxon_ids, np.int64)
+            bitmap = bitmaps.get(tag_id, np.zeros(0, np.uint8))
+            size = max(len(bitmap), (int(taxon_ids.max()) >> 3) + 1)
+            bitmap = np.concatenate([bitmap, np.zeros(size - len(bitmap), np.uint8)])
+            np.bitwise_or.at(bitmap, taxon_ids >> 3, _bit_masks(taxon_ids))
+            bitmaps[tag_id] = bitmap
+        self.bitmaps = bitmaps
+        self.version += 1
+
+    # --------------------- queries ---------------------
+
+    def _combine(self, tags_ids: list[int], operator: np.ufunc) -> np.ndarray:
+        published = self.bitmaps  # read once, a refresh may swap it meanwhile
+        bitmaps = [published.get(tag_id, np.zeros(0, np.uint8)) for tag_id in tags_ids]
+        size = max(len(bitmap) for bitmap in bitmaps)
+        result = None
+        for bitmap in bitmaps:
+            bitmap = np.pad(bitmap, (0, size - len(bitmap)))
+            result = bitmap if result is None else operator(result, bitmap)
+        return result
+
+    def all_of(self, tags_ids: list[int]) -> np.ndarray:
+        """Sorted ids of the taxons carrying every tag"""
+        return np.flatnonzero(np.unpackbits(self._combine(tags_ids, np.bitwise_and)))
+
+    def any_of(self, tags_ids: list[int]) -> np.ndarray:
+        """Sorted ids of the taxons carrying at least one of the tags"""
+        return np.flatnonzero(np.unpackbits(self._combine(tags_ids, np.bitwise_or)))
+
+
+taxon_tag_index = TaxonTagIndex()
+
+
+def get_taxon_tag_index() -> TaxonTagIndex:
+    """The process wide tag index, refreshed with the pending writes"""
+    return taxon_tag_index.refresh()
@@ -0,0 +1,83 @@
+import numpy as np
+from models import TAXON_CLASS_TYPES
+from responses import DefaultException
+from werkzeug.datastructures import ImmutableMultiDict
+
+from .taxonomy_snapshot_service import SnapshotIndex, TaxonomySnapshot
+
+_MAX_TIMELINE_POINTS = 1000
+
+
+class TimelineIndex:
+    """Snapshot rows sorted by origin. The taxons alive at a time T are a suffix
+    of that order (origin >= T) filtered on extinction <= T; null extinctions
+    are stored as the smallest integer so they always pass"""
+
+    def __init__(self, snapshot: TaxonomySnapshot):
+        self.snapshot = snapshot
+        self.version = snapshot.version
+        self.order = np.argsort(snapshot.origin, kind="stable")
+        self.origin = snapshot.origin[self.order]
+        self.extinction = snapshot.extinction[self.order]
+        self.rank = snapshot.rank[self.order]
+
+    def alive_rows(self, time: int, rows_mask: np.ndarray = None) -> np.ndarray:
+        """Positions (in origin order) of the taxons alive at time"""
+        start = int(np.searchsorted(self.origin, time, side="left"))
+        alive = self.extinction[start:] <= time
+        if rows_mask is not None:
+            alive &= rows_mask[start:]
+        return np.flatnonzero(alive) + start
+
+    def ranks_alive_at(self, time: int, rows_mask: np.ndarray = None) -> np.ndarray:
+        rows = self.alive_rows(time, rows_mask)
+        return np.bincount(self.rank[rows], minlength=len(TAXON_CLASS_TYPES))
+
+
+timeline_index = SnapshotIndex(TimelineIndex)
+
+
+def get_timeline_index() -> tuple[TimelineIndex, TaxonomySnapshot]:
+    """Timeline index of the current snapshot and the snapshot it was built
+    from"""
+    return timeline_index.get()
+
+
+def get_taxon_timeline(params: ImmutableMultiDict) -> dict[str, any]:
+    """Number of taxons alive at each {at} time, grouped by rank. {ancestor_id}
+    restricts the count to a subtree"""
+    times = params.getlist("at", type=int)
+    ancestor_id = params.get("ancestor_id", type=int)
+    if not times:
+        raise DefaultException(message="Timeline_time_is_required", code=400)
+    if len(times) > _MAX_TIMELINE_POINTS:
+        raise DefaultException(message="Too_many_timeline_points", code=400)
+
+    index, snapshot = get_timeline_index()
+    rows_mask = None
+    if ancestor_id is not None:
+        in_subtree = _subtree_mask(snapshot, snapshot.position(ancestor_id))
+        rows_mask = in_subtree[index.order]
+
+    items = []
+    for time in times:
+        counts = index.ranks_alive_at(time, rows_mask)
+        items.append(
+            {
+                "at": time,
+                "total": int(counts.sum()),
+                "ranks": dict(zip(TAXON_CLASS_TYPES, counts.tolist())),
+            }
+        )
+    return {"items": items}
+
+
+def _subtree_mask(snapshot: TaxonomySnapshot, root: int) -> np.ndarray:
+    """Rows under root, root included. Walks down one depth level at a time"""
+    mask = np.zeros(len(snapshot), bool)
+    mask[root] = True
+    depths = snapshot.depths()
+    for depth in range(int(depths[root]) + 1, int(depths.max(initial=0)) + 1):
+        rows = np.flatnonzero(depths == depth)
+        mask[rows[mask[snapshot.parent_index[rows]]]] = True
+    return mask
@@ -0,0 +1,250 @@
+import sys
+from threading import RLock
+from time import monotonic
+from typing import Callable
+
+import numpy as np
+from config import Config, db
+from models import TAXON_CLASS_TYPES, Taxon
+from responses import DefaultException
+from sqlalchemy import select
+
+_RANK = {taxon_class: rank for rank, taxon_class in enumerate(TAXON_CLASS_TYPES)}
+_MAX_AGE = Config.SNAPSHOT_MAX_AGE_SECONDS
+_REFRESH_CHUNK = 500
+# Stored in origin/extinction when the column is null
+NO_TIME = np.iinfo(np.int64).min
+
+
+def _columns(rows: list[tuple]) -> dict[str, np.ndarray]:
+    """Turn (id, superior_taxon, taxon_class, origin, extinction) rows into arrays"""
+    count = len(rows)
+    return {
+        "ids": np.fromiter((row[0] for row in rows), np.int64, count),
+        "parent_ids": np.fromiter(
+            (-1 if row[1] is None else row[1] for row in rows), np.int64, count
+        ),
+        "rank": np.fromiter((_RANK[row[2]] for row in rows), np.int8, count),
+        "origin": np.fromiter(
+            (NO_TIME if row[3] is None else row[3] for row in rows), np.int64, count
+        ),
+        "extinction": np.fromiter(
+            (NO_TIME if row[4] is None else row[4] for row in rows), np.int64, count
+        ),
+    }
+
+
+class TaxonomySnapshot:
+    """Columnar in-memory copy of the taxons table, never modified once built.
+
+    Row i holds ids[i], parent_index[i] (row of the superior taxon, -1 for
+    roots), rank[i] (position in TAXON_CLASS_TYPES), origin[i], extinction[i]
+    (NO_TIME when null) and names[i]. Rows are sorted by id.
+    """
+
+    def __init__(
+        self,
+        columns: dict[str, np.ndarray] = None,
+        names: list[str] = None,
+        version: int = 0,
+    ):
+        if columns is None:
+            columns = _columns([])
+        self.ids = columns["ids"]
+        self.parent_ids = columns["parent_ids"]
+        self.rank = columns["rank"]
+        self.origin = columns["origin"]
+        self.extinction = columns["extinction"]
+        self.names = names or []
+        self.version = version
+        self.parent_index = self.positions(self.parent_ids)
+        self._derived = {}
+
+    # --------------------- queries ---------------------
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def position(self, taxon_id: int) -> int:
+        """Row of a taxon in the snapshot"""
+        index = int(np.searchsorted(self.ids, taxon_id))
+        if index >= len(self.ids) or self.ids[index] != taxon_id:
+            raise DefaultException(message="Taxon_not_found", code=404)
+        return index
+
+    def positions(self, taxon_ids) -> np.ndarray:
+        """Rows of several taxons, -1 for the ones that are not in the snapshot"""
+        taxon_ids = np.asarray(taxon_ids, np.int64)
+        if not len(self.ids):
+            return np.full(len(taxon_ids), -1, np.int64)
+        index = np.searchsorted(self.ids, taxon_ids)
+        index[index >= len(self.ids)] = 0
+        found = self.ids[index] == taxon_ids
+        return np.where(found, index, -1)
+
+    def summary(self, row: int) -> dict[str, any]:
+        """id, name and taxon_class of a row"""
+        return {
+            "id": int(self.ids[row]),
+            "name": self.names[row],
+            "taxon_class": TAXON_CLASS_TYPES[self.rank[row]],
+        }
+
+    def lineage(self, taxon_id: int) -> list[int]:
+        """Ids from the taxon up to its root"""
+        lineage = []
+        index = self.position(taxon_id)
+        while index >= 0:
+            lineage.append(int(self.ids[index]))
+            index = self.parent_index[index]
+        return lineage
+
+    def depths(self) -> np.ndarray:
+        """Number of superiors of each row, found by following parent_index down
+        from the roots one level at a time. Ranks are not used, a row may skip
+        ranks below its superior"""
+        if "depths" not in self._derived:
+            depths = np.zeros(len(self.ids), np.int64)
+            level = np.flatnonzero(self.parent_index < 0)
+            pending = np.flatnonzero(self.parent_index >= 0)
+            while len(level) and len(pending):
+                reached = np.isin(self.parent_index[pending], level)
+                level = pending[reached]
+                pending = pending[~reached]
+                depths[level] = depths[self.parent_index[level]] + 1
+            self._derived["depths"] = depths
+        return self._derived["depths"]
+
+    def subtree_sizes(self) -> np.ndarray:
+        """Number of taxons in the subtree of each row, the row included. Sizes
+        are pushed up to the parents one depth level at a time, deepest first"""
+        if "subtree_sizes" not in self._derived:
+            sizes = np.ones(len(self.ids), np.int64)
+            depths = self.depths()
+            for depth in range(int(depths.max(initial=0)), 0, -1):
+                rows = np.flatnonzero(depths == depth)
+                np.add.at(sizes, self.parent_index[rows], sizes[rows])
+            self._derived["subtree_sizes"] = sizes
+        return self._derived["subtree_sizes"]
+
+    def subtree_size(self, taxon_id: int) -> int:
+        return int(self.subtree_sizes()[self.position(taxon_id)])
+
+    def rank_histogram(self, rows: np.ndarray = None) -> dict[str, int]:
+        """Number of taxons per rank, optionally restricted to some rows"""
+        rank = self.rank if rows is None else self.rank[rows]
+        counts = np.bincount(rank, minlength=len(TAXON_CLASS_TYPES))
+        return dict(zip(TAXON_CLASS_TYPES, counts.tolist()))
+
+
+class TaxonomySnapshotStore:
+    """Keeps the current TaxonomySnapshot up to date with the database.
+
+    Writes call mark_changed with the touched ids and the next read patches only
+    those rows; mark_stale forces a full reload. Other processes' writes are
+    picked up when the snapshot is older than SNAPSHOT_MAX_AGE_SECONDS.
+
+    A refresh builds a whole new snapshot and publishes it with one assignment,
+    so a reader keeps consistent columns for as long as it holds a snapshot.
+    """
+
+    def __init__(self):
+        self.current = TaxonomySnapshot()
+        self._loaded_at = None
+        self._changed = set()
+        self._lock = RLock()
+
+    def mark_changed(self, *taxon_ids: int) -> None:
+        with self._lock:
+            self._changed.update(taxon_ids)
+
+    def mark_stale(self) -> None:
+        with self._lock:
+            self._loaded_at = None
+            self._changed.clear()
+
+    def refresh(self) -> TaxonomySnapshot:
+        """The snapshot, brought up to date with the database"""
+        with self._lock:
+            if self._loaded_at is None or monotonic() - self._loaded_at > _MAX_AGE:
+                self._load()
+            elif self._changed:
+                self._patch()
+            return self.current
+
+    def _select(self, *filters):
+        return db.session.execute(
+            select(
+                Taxon.id,
+                Taxon.superior_taxon,
+                Taxon.taxon_class,
+                Taxon.origin,
+                Taxon.extinction,
+                Taxon.name,
+            )
+            .where(*filters)
+            .order_by(Taxon.id)
+        ).all()
+
+    def _load(self) -> None:
+        rows = self._select()
+        self._publish(_columns(rows), [sys.intern(row[5]) for row in rows])
+        self._changed.clear()
+        self._loaded_at = monotonic()
+
+    def _patch(self) -> None:
+        changed = np.array(sorted(self._changed), np.int64)
+        self._changed.clear()
+        rows = []
+        for start in range(0, len(changed), _REFRESH_CHUNK):
+            chunk = changed[start : start + _REFRESH_CHUNK].tolist()
+            rows.extend(self._select(Taxon.id.in_(chunk)))
+
+        # Drop every changed row, then merge the fresh ones back in id order
+        snapshot = self.current
+        keep = ~np.isin(snapshot.ids, changed)
+        columns = {
+            name: getattr(snapshot, name)[keep]
+            for name in ("ids", "parent_ids", "rank", "origin", "extinction")
+        }
+        names = [name for name, kept in zip(snapshot.names, keep) if kept]
+        if rows:
+            fresh = _columns(rows)
+            columns = {
+                name: np.concatenate([columns[name], fresh[name]]) for name in columns
+            }
+            names.extend(sys.intern(row[5]) for row in rows)
+            order = np.argsort(columns["ids"], kind="stable")
+            columns = {name: column[order] for name, column in columns.items()}
+            names = [names[index] for index in order]
+        self._publish(columns, names)
+
+    def _publish(self, columns: dict[str, np.ndarray], names: list[str]) -> None:
+        self.current = TaxonomySnapshot(columns, names, self.current.version + 1)
+
+
+taxonomy_snapshot = TaxonomySnapshotStore()
+
+
+def get_taxonomy_snapshot() -> TaxonomySnapshot:
+    """The process wide snapshot, refreshed with the pending writes"""
+    return taxonomy_snapshot.refresh()
+
+
+class SnapshotIndex:
+    """An index built from the current snapshot by build, rebuilt when the
+    snapshot changes. The index keeps the snapshot it was built from in its
+    snapshot attribute and its version in its version attribute"""
+
+    def __init__(self, build: Callable[[TaxonomySnapshot], any]):
+        self._build = build
+        self._current = None
+
+    def get(self) -> tuple[any, TaxonomySnapshot]:
+        """The index and the snapshot it was built from. Read the rows the
+        index returns from that snapshot, a newer one may not match them"""
+        snapshot = get_taxonomy_snapshot()
+        index = self._current
+        if index is None or index.version != snapshot.version:
+            index = self._current = self._build(snapshot)
+        return index, index.snapshot
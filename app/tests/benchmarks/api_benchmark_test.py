@@ -0,0 +1,143 @@
+from itertools import count
+
+import pytest
+from sqlalchemy import select
+
+from app import db
+from models import Taxon
+from services import clear_caches
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.usefixtures("synthetic_taxonomy")]
+
+LIST_SCENARIOS = {
+    "list_taxons": {},
+    "list_taxons_per_page_100": {"per_page": 100},
+    "list_taxons_deep_page": {"page": 50},
+    "list_taxons_by_cursor": {"limit": 100},
+    "list_taxons_by_name": {"name": "species 9"},
+    "list_taxons_by_taxon_class": {"taxon_class": "genus"},
+    "list_taxons_by_origin_range": {"origin_min": 100, "origin_max": 500},
+    "list_taxons_alive_at": {"alive_at": 200},
+    "list_taxons_by_superior": {"superior_taxon_id": 2},
+    "list_taxons_by_ancestor": {"ancestor_id": 2},
+    "list_taxons_by_tag": {"tag_id": 1},
+    "list_taxons_tags_all": {"tags_all": "1,2"},
+    "list_taxons_tags_any": {"tags_any": "5,6,7"},
+    "list_taxons_sorted": {"sort": "-individuals_sum"},
+    "list_taxons_projected": {"fields": "name,taxon_class", "per_page": 100},
+}
+
+
+@pytest.mark.parametrize("name", LIST_SCENARIOS)
+def test_list_taxons(client, benchmark_recorder, name):
+    params = LIST_SCENARIOS[name]
+    benchmark_recorder.measure(
+        name, lambda: client.get("/taxon", query_string=params), setup=clear_caches
+    )
+
+
+def test_get_taxon(client, benchmark_recorder, synthetic_taxonomy):
+    taxon_id = synthetic_taxonomy["taxons"] // 2
+    benchmark_recorder.measure(
+        "get_taxon_cold", lambda: client.get(f"/taxon/{taxon_id}"), setup=clear_caches
+    )
+    benchmark_recorder.measure(
+        "get_taxon_warm", lambda: client.get(f"/taxon/{taxon_id}")
+    )
+
+    etag = client.get(f"/taxon/{taxon_id}").headers["ETag"]
+    benchmark_recorder.measure(
+        "get_taxon_not_modified",
+        lambda: client.get(f"/taxon/{taxon_id}", headers={"If-None-Match": etag}),
+    )
+
+
+def test_taxon_tree(client, benchmark_recorder):
+    benchmark_recorder.measure(
+        "get_taxon_tree",
+        lambda: client.get("/taxon/2/tree", query_string={"depth": 2}),
+        setup=clear_caches,
+    )
+
+
+def test_search_taxons(client, benchmark_recorder):
+    benchmark_recorder.measure(
+        "search_taxons",
+        lambda: client.get("/taxon/search", query_string={"q": "genus"}),
+    )
+    benchmark_recorder.measure(
+        "autocomplete_taxons",
+        lambda: client.get("/taxon/autocomplete", query_string={"prefix": "genus 1"}),
+    )
+
+
+def test_resolve_taxon_names(client, benchmark_recorder, synthetic_taxonomy):
+    ids = range(1, synthetic_taxonomy["taxons"], synthetic_taxonomy["taxons"] // 300)
+    names = [
+        name
+        for (name,) in db.session.execute(select(Taxon.name).where(Taxon.id.in_(ids)))
+    ]
+    # One third exact, one third in another case, one third with a typo
+    names = [
+        (name, name.upper(), name[:-1] + "q")[index % 3]
+        for index, name in enumerate(names)
+    ]
+    benchmark_recorder.measure(
+        "resolve_taxon_names",
+        lambda: client.post("/taxon/resolve", json={"names": names}),
+    )
+
+
+def test_tags(client, benchmark_recorder):
+    benchmark_recorder.measure(
+        "list_tags", lambda: client.get("/tag"), setup=clear_caches
+    )
+    benchmark_recorder.measure(
+        "tag_facets", lambda: client.get("/tag/facets"), setup=clear_caches
+    )
+    benchmark_recorder.measure(
+        "tag_facets_by_ancestor",
+        lambda: client.get("/tag/facets", query_string={"ancestor_id": 2}),
+        setup=clear_caches,
+    )
+
+
+def test_writes(client, benchmark_recorder):
+    names = count()
+    genus_id = db.session.execute(
+        select(Taxon.id).where(Taxon.taxon_class == "genus").limit(1)
+    ).scalar()
+
+    def payload(name: str) -> dict:
+        return {
+            "taxon_class": "species",
+            "name": name,
+            "description": "benchmark species",
+            "origin": 1,
+            "individuals_number": 10,
+            "superior_taxon": genus_id,
+            "tags_ids": [1, 2],
+        }
+
+    benchmark_recorder.measure(
+        "create_taxon",
+        lambda: client.post("/taxon", json=payload(f"bench {next(names)}")),
+    )
+    created = (
+        db.session.execute(select(Taxon.id).where(Taxon.name.startswith("bench ")))
+        .scalars()
+        .all()
+    )
+
+    updated = iter(created)
+    benchmark_recorder.measure(
+        "update_taxon",
+        lambda: client.put(
+            f"/taxon/{next(updated)}", json=payload(f"bench {next(names)}")
+        ),
+    )
+
+    deleted = iter(created)
+    benchmark_recorder.measure(
+        "delete_taxon", lambda: client.delete(f"/taxon/{next(deleted)}")
+    )
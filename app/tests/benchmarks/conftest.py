@@ -0,0 +1,98 @@
+import json
+import platform
+import sqlite3
+import subprocess
+from datetime import datetime, timezone
+from time import perf_counter
+
+import numpy as np
+import pytest
+
+from app import db
+from seeders import seed_db_synthetic_taxonomy, seed_db_tags
+from services import clear_caches, taxon_tag_index, taxonomy_snapshot
+from ..conftest import QueryCounter, app
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class BenchmarkRecorder:
+    """Run scenarios, keep latency percentiles and queries per request"""
+
+    def __init__(self, rounds: int):
+        self.rounds = rounds
+        self.results = {}
+
+    def measure(self, name: str, call, setup=None, rounds: int = None) -> dict:
+        timings, queries = [], []
+        for _ in range(rounds or self.rounds):
+            if setup is not None:
+                setup()
+            with QueryCounter(db.engine) as counter:
+                start = perf_counter()
+                response = call()
+                timings.append((perf_counter() - start) * 1000)
+            assert response.status_code < 400, (name, response.json)
+            queries.append(counter.count)
+
+        timings = np.array(timings)
+        result = {
+            "rounds": len(timings),
+            "p50_ms": round(float(np.percentile(timings, 50)), 3),
+            "p90_ms": round(float(np.percentile(timings, 90)), 3),
+            "p99_ms": round(float(np.percentile(timings, 99)), 3),
+            "mean_ms": round(float(timings.mean()), 3),
+            "max_ms": round(float(timings.max()), 3),
+            "queries": round(float(np.mean(queries)), 2),
+        }
+        self.results[name] = result
+        return result
+
+    def record(self, name: str, result: dict) -> None:
+        """Keep a result measured without requests"""
+        self.results[name] = result
+
+
+@pytest.fixture(scope="session")
+def benchmark_recorder(request):
+    """Collects every scenario and writes them as json at the end"""
+    options = request.config.option
+    recorder = BenchmarkRecorder(rounds=options.benchmark_rounds)
+    yield recorder
+    if not recorder.results:
+        return
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "date": datetime.now(timezone.utc).isoformat(),
+            "size": options.benchmark_size,
+            "rounds": options.benchmark_rounds,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "database": app.config["SQLALCHEMY_DATABASE_URI"].split(":")[0],
+        },
+        "results": recorder.results,
+    }
+    with open(options.benchmark_output, "w") as output:
+        json.dump(report, output, indent=2)
+
+
+@pytest.fixture(scope="module")
+def synthetic_taxonomy(request):
+    """Module wide synthetic taxonomy of --benchmark-size taxons"""
+    with app.app_context():
+        db.create_all()
+        clear_caches()
+        taxonomy_snapshot.mark_stale()
+        taxon_tag_index.mark_stale()
+        seed_db_tags()
+        yield seed_db_synthetic_taxonomy(request.config.option.benchmark_size)
+        db.session.remove()
+        db.drop_all()
@@ -0,0 +1,59 @@
+import json
+from time import perf_counter
+
+import pytest
+from flask_restx import marshal
+
+from controllers.taxon_controller import TaxonDto
+from responses import compile_serializer, dump_json
+from seeders import seed_db
+from services import get_taxons, import_taxons
+from werkzeug.datastructures import ImmutableMultiDict
+
+ROUNDS = 200
+
+
+@pytest.fixture()
+def taxon_page(database):
+    """A per_page=100 page of tagged taxons"""
+    seed_db()
+    import_taxons(
+        {
+            "taxon_class": "phylum",
+            "name": "phylum {}".format(index),
+            "description": "description " * 40,
+            "origin": 1,
+            "superior_taxon_name": "Animalia",
+            "tags_ids": [1, 2, 3],
+        }
+        for index in range(100)
+    )
+    return get_taxons(ImmutableMultiDict({"per_page": 100}))
+
+
+def timed(function, *args) -> float:
+    """Mean milliseconds of function(*args) over ROUNDS calls"""
+    start = perf_counter()
+    for _ in range(ROUNDS):
+        function(*args)
+    return round((perf_counter() - start) * 1000 / ROUNDS, 3)
+
+
+@pytest.mark.benchmark
+def test_serializer_benchmark(taxon_page, benchmark_recorder):
+    serializer = compile_serializer(TaxonDto.taxon_get_list)
+    assert serializer(taxon_page) == marshal(taxon_page, TaxonDto.taxon_get_list)
+
+    results = {
+        "marshal_ms": timed(marshal, taxon_page, TaxonDto.taxon_get_list),
+        "compiled_ms": timed(serializer, taxon_page),
+        "marshal_json_ms": timed(
+            lambda page: json.dumps(marshal(page, TaxonDto.taxon_get_list)),
+            taxon_page,
+        ),
+    }
+    if dump_json({}) is not None:
+        results["compiled_orjson_ms"] = timed(
+            lambda page: dump_json(serializer(page)), taxon_page
+        )
+    benchmark_recorder.record("serializer", results)
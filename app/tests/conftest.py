@@ -1,12 +1,78 @@
 import pytest
+from sqlalchemy import event
 
 from app import blueprint
 from app import create_app, db
+from services import (
+    autocomplete_index,
+    clear_caches,
+    taxon_tag_index,
+    taxonomy_snapshot,
+)
 
 app = create_app("test")
 app.register_blueprint(blueprint)
 
 
+def pytest_addoption(parser):
+    parser.addoption(
+        "--benchmark", action="store_true", help="run the tests/benchmarks suite"
+    )
+    parser.addoption(
+        "--benchmark-size",
+        type=int,
+        default=10000,
+        help="number of taxons of the synthetic benchmark taxonomy",
+    )
+    parser.addoption(
+        "--benchmark-rounds",
+        type=int,
+        default=30,
+        help="requests measured per benchmark scenario",
+    )
+    parser.addoption(
+        "--benchmark-output",
+        default="benchmark-results.json",
+        help="json file receiving the benchmark results",
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: slow timing measurement")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--benchmark"):
+        return
+    skip = pytest.mark.skip(reason="benchmarks only run with --benchmark")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+class QueryCounter:
+    """Count the SQL statements sent to the database inside a with block"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        self.statements = []
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._record)
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
 @pytest.fixture()
 def client():
     """Init Flask test client"""
@@ -18,9 +84,20 @@ def client():
 def database(client, request):
     """Init database"""
     db.create_all()
+    clear_caches()
+    taxonomy_snapshot.mark_stale()
+    taxon_tag_index.mark_stale()
+    autocomplete_index.mark_stale()
 
     @request.addfinalizer
     def drop_tables():
+        db.session.remove()
         db.drop_all()
 
-    return
\ No newline at end of file
+    return
+
+
+@pytest.fixture()
+def query_counter(database):
+    """Count the queries of a block: with query_counter: ..."""
+    return QueryCounter(db.engine)
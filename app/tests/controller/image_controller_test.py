@@ -0,0 +1,155 @@
+import io
+import os
+
+import pytest
+from PIL import Image as PillowImage
+
+from seeders import seed_db
+
+
+@pytest.fixture()
+def image_storage(database, tmp_path, monkeypatch):
+    """Seeded database, images stored under tmp_path and rendered in the
+    request"""
+    seed_db()
+    monkeypatch.setattr("services.image_service._STORAGE_PATH", str(tmp_path))
+    monkeypatch.setattr("services.image_service._WORKERS", 0)
+    return tmp_path
+
+
+def image_file(size=(640, 480), image_format="PNG", color="red") -> bytes:
+    stream = io.BytesIO()
+    PillowImage.new("RGB", size, color).save(stream, image_format)
+    return stream.getvalue()
+
+
+def upload(client, content: bytes, origin="taxon", origin_id=3):
+    return client.post(
+        "/image",
+        data={
+            "origin": origin,
+            "origin_id": origin_id,
+            "file": (io.BytesIO(content), "image.png"),
+        },
+        content_type="multipart/form-data",
+    )
+
+
+@pytest.mark.usefixtures("image_storage")
+class TestImageController:
+    def test_upload_image(self, client, image_storage):
+        content = image_file()
+        response = upload(client, content)
+        assert response.status_code == 201
+        image = response.json
+        assert (image["width"], image["height"]) == (640, 480)
+        assert image["content_type"] == "image/png"
+        assert image["size"] == len(content)
+        assert image["renditions_ready"]
+
+        # Same file: same image for the same taxon, shared file for a tag
+        response = upload(client, content)
+        assert response.status_code == 200
+        assert response.json["id"] == image["id"]
+        response = upload(client, content, origin="tag", origin_id=1)
+        assert response.status_code == 201
+        assert response.json["content_hash"] == image["content_hash"]
+        stored = [name for _, _, names in os.walk(image_storage) for name in names]
+        assert sorted(stored) == ["large.webp", "original", "thumbnail.webp"]
+
+        response = client.get(
+            "/image", query_string={"origin": "taxon", "origin_id": 3}
+        )
+        assert [item["id"] for item in response.json["items"]] == [image["id"]]
+
+    def test_image_files(self, client):
+        content = image_file(size=(2000, 1000), image_format="JPEG")
+        image = upload(client, content).json
+
+        response = client.get(image["url"])
+        assert response.status_code == 200
+        assert response.mimetype == "image/jpeg"
+        assert response.get_data() == content
+        assert "immutable" in response.headers["Cache-Control"]
+
+        response = client.get(image["renditions"]["thumbnail"])
+        assert response.mimetype == "image/webp"
+        thumbnail = PillowImage.open(io.BytesIO(response.get_data()))
+        assert (thumbnail.format, thumbnail.size) == ("WEBP", (256, 128))
+
+        response = client.get(image["url"], headers={"Range": "bytes=0-99"})
+        assert response.status_code == 206
+        assert response.get_data() == content[:100]
+        etag = client.get(image["url"]).headers["ETag"]
+        response = client.get(image["url"], headers={"If-None-Match": etag})
+        assert response.status_code == 304
+
+    def test_renditions_in_worker_processes(self, client, image_storage, monkeypatch):
+        monkeypatch.setattr("services.image_service._WORKERS", 1)
+        image = upload(client, image_file(size=(1000, 1000))).json
+
+        # Asking for a rendition waits for its job
+        response = client.get(image["renditions"]["large"])
+        assert response.status_code == 200
+        large = PillowImage.open(io.BytesIO(response.get_data()))
+        assert large.size == (1000, 1000)
+        assert client.get("/image/{}".format(image["id"])).json["renditions_ready"]
+
+    def test_delete_image(self, client, image_storage):
+        content = image_file()
+        first = upload(client, content).json
+        second = upload(client, content, origin="tag", origin_id=1).json
+
+        assert client.delete("/image/{}".format(first["id"])).status_code == 200
+        assert client.get(second["url"]).status_code == 200
+        client.delete("/image/{}".format(second["id"]))
+        assert client.get(second["url"]).status_code == 404
+        assert not any(names for _, _, names in os.walk(image_storage))
+
+    def test_delete_owner_images(self, client, image_storage):
+        client.post(
+            "/taxon",
+            json={
+                "taxon_class": "phylum",
+                "name": "Chordata",
+                "origin": 1,
+                "superior_taxon": 3,
+            },
+        )
+        response = client.get("/taxon", query_string={"name": "Chordata"})
+        phylum = response.json["items"][0]["id"]
+        shared = upload(client, image_file(), origin_id=phylum).json
+        upload(client, image_file(color="blue"), origin_id=phylum)
+        tagged = upload(client, image_file(), origin="tag", origin_id=1).json
+
+        assert client.delete("/taxon/{}".format(phylum)).status_code == 200
+        response = client.get(
+            "/image", query_string={"origin": "taxon", "origin_id": phylum}
+        )
+        assert response.json["items"] == []
+        # Only the file the tag still uses is left
+        stored = [path for path, _, names in os.walk(image_storage) if names]
+        assert [os.path.basename(path) for path in stored] == [shared["content_hash"]]
+
+        assert client.delete("/tag/1").status_code == 200
+        assert client.get("/image/{}".format(tagged["id"])).status_code == 404
+        assert not any(names for _, _, names in os.walk(image_storage))
+
+    def test_delete_while_rendering(self, client, image_storage, monkeypatch):
+        monkeypatch.setattr("services.image_service._WORKERS", 1)
+        image = upload(client, image_file(size=(2000, 2000))).json
+
+        # The pending job is cancelled or waited for, it writes nothing after
+        assert client.delete("/image/{}".format(image["id"])).status_code == 200
+        content_hash = image["content_hash"]
+        assert not (image_storage / content_hash[:2] / content_hash).exists()
+        assert not any(names for _, _, names in os.walk(image_storage))
+
+    def test_invalid_image(self, client):
+        assert upload(client, b"not an image").status_code == 400
+        assert upload(client, image_file(image_format="BMP")).status_code == 400
+        assert upload(client, image_file(), origin_id=404).status_code == 404
+        assert upload(client, image_file(), origin="user").status_code == 400
+        response = client.get("/image/file/{}/original".format("0" * 64))
+        assert response.status_code == 404
+        assert client.get("/image/file/../original").status_code == 404
@@ -0,0 +1,83 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app import blueprint, create_app, db
+from seeders import seed_db
+from services import clear_caches, init_instrumentation
+
+
+@pytest.fixture()
+def instrumented_client():
+    """Client of a separate app with the instrumentation on"""
+    app = create_app("test")
+    app.register_blueprint(blueprint)
+    init_instrumentation(app)
+    with app.test_client() as client, app.app_context():
+        db.create_all()
+        clear_caches()
+        seed_db()
+        yield client
+        db.session.remove()
+        db.drop_all()
+
+
+class TestInstrumentation:
+    def test_server_timing(self, instrumented_client):
+        response = instrumented_client.get("/taxon", query_string={"per_page": 50})
+
+        assert response.status_code == 200
+        timing = response.headers["Server-Timing"]
+        assert 'desc="3 queries"' in timing
+        assert "marshal;dur=" in timing and "total;dur=" in timing
+
+    def test_metrics(self, instrumented_client):
+        instrumented_client.get("/taxon/1")
+        instrumented_client.get("/taxon/1")
+        instrumented_client.get("/taxon/404")
+
+        response = instrumented_client.get("/metrics")
+        assert response.status_code == 200
+        assert response.mimetype == "text/plain"
+        metrics = response.get_data(as_text=True)
+        labels = 'endpoint="api.taxon_taxon_by_id",method="GET"'
+        assert 'http_requests_total{{{},status="200"}} 2'.format(labels) in metrics
+        assert 'http_requests_total{{{},status="404"}} 1'.format(labels) in metrics
+        assert (
+            'http_request_duration_seconds_bucket{{{},le="+Inf"}} 3'.format(labels)
+            in metrics
+        )
+        assert "db_queries_total{{{}}} ".format(labels) in metrics
+        assert "# slowest GET api.taxon_taxon_by_id: SELECT" in metrics
+        assert 'cache_hits_total{cache="taxon"} 1' in metrics
+
+    def test_marshal_with_time(self, instrumented_client):
+        response = instrumented_client.get("/taxon/lca", query_string={"ids": "2,3"})
+
+        assert response.status_code == 200
+        timing = dict(
+            part.strip().split(";")[:2]
+            for part in response.headers["Server-Timing"].split(",")
+        )
+        assert float(timing["marshal"].split("=")[1]) > 0
+        metrics = instrumented_client.get("/metrics").get_data(as_text=True)
+        labels = 'endpoint="api.taxon_taxon_lca",method="GET"'
+        sample = "marshal_seconds_total{{{}}} ".format(labels)
+        assert float(metrics.split(sample)[1].split()[0]) > 0
+
+    def test_failed_statement(self, instrumented_client):
+        with db.engine.connect() as conn:
+            with pytest.raises(OperationalError):
+                conn.execute(text("SELECT * FROM missing_table"))
+            assert conn.info["query_start"] == {}
+            conn.rollback()
+            assert conn.execute(text("SELECT 1")).scalar() == 1
+            assert conn.info["query_start"] == {}
+
+        response = instrumented_client.get("/taxon", query_string={"per_page": 50})
+        assert 'desc="3 queries"' in response.headers["Server-Timing"]
+
+    @pytest.mark.usefixtures("database")
+    def test_not_instrumented_by_default(self, client):
+        assert "Server-Timing" not in client.get("/tag").headers
+        assert client.get("/metrics").status_code == 404
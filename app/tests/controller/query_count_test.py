@@ -0,0 +1,122 @@
+import pytest
+
+from seeders import seed_db
+from services import clear_caches, import_taxons
+
+
+@pytest.fixture()
+def seeded_database(database):
+    """Seed the default data plus 30 tagged phyla under Animalia"""
+    seed_db()
+    import_taxons(
+        {
+            "taxon_class": "phylum",
+            "name": "phylum {}".format(index),
+            "origin": 1,
+            "superior_taxon_name": "Animalia",
+            "tags_ids": [1, 2],
+        }
+        for index in range(30)
+    )
+
+
+@pytest.mark.usefixtures("seeded_database")
+class TestQueryCount:
+    # --------------------- TAXONS ---------------------
+
+    def test_list_taxons(self, client, query_counter):
+        with query_counter:
+            response = client.get("/taxon", query_string={"per_page": 50})
+
+        assert response.status_code == 200
+        assert len(response.json["items"]) == 33
+        # count, page and one selectin for every tag of the page
+        assert query_counter.count == 3
+
+    def test_list_taxons_by_cursor(self, client, query_counter):
+        with query_counter:
+            response = client.get("/taxon", query_string={"limit": 20})
+
+        assert response.status_code == 200
+        assert len(response.json["items"]) == 20
+        assert response.json["next_cursor"] is not None
+        assert query_counter.count == 2
+
+    def test_list_taxons_by_ancestor(self, client, query_counter):
+        with query_counter:
+            response = client.get(
+                "/taxon", query_string={"ancestor_id": 3, "per_page": 50}
+            )
+
+        assert response.status_code == 200
+        assert response.json["total_items"] == 30
+        assert query_counter.count == 3
+
+    def test_get_taxon(self, client, query_counter):
+        clear_caches()
+        with query_counter:
+            response = client.get("/taxon/4")
+
+        assert response.status_code == 200
+        assert len(response.json["tags"]) == 2
+        assert query_counter.count == 2
+
+    def test_get_cached_taxon(self, client, query_counter):
+        client.get("/taxon/4")
+        with query_counter:
+            response = client.get("/taxon/4")
+
+        assert response.status_code == 200
+        assert query_counter.count == 0
+
+    def test_search_taxons(self, client, query_counter):
+        with query_counter:
+            response = client.get("/taxon/search", query_string={"q": "phylum"})
+
+        assert response.status_code == 200
+        assert len(response.json["items"]) == 10
+        assert query_counter.count == 2
+
+    def test_get_taxon_tree(self, client, query_counter):
+        with query_counter:
+            response = client.get("/taxon/1/tree", query_string={"depth": 3})
+
+        assert response.status_code == 200
+        assert len(response.json["children"][0]["children"][0]["children"]) == 30
+        assert query_counter.count == 1
+
+    def test_list_projected_taxons(self, client, query_counter):
+        with query_counter:
+            response = client.get(
+                "/taxon", query_string={"per_page": 50, "fields": "name,taxon_class"}
+            )
+
+        assert response.status_code == 200
+        assert response.json["items"][0] == {
+            "taxon_class": "life",
+            "name": "Celular life",
+        }
+        assert query_counter.count == 2
+        assert "description" not in query_counter.statements[-1]
+
+    # --------------------- TAGS ---------------------
+
+    def test_list_tags(self, client, query_counter):
+        with query_counter:
+            response = client.get("/tag", query_string={"per_page": 50})
+
+        assert response.status_code == 200
+        assert query_counter.count == 2
+
+    def test_get_tag_facets(self, client, query_counter):
+        with query_counter:
+            response = client.get("/tag/facets", query_string={"ancestor_id": 3})
+
+        assert response.status_code == 200
+        assert response.json["items"][0]["taxons_count"] == 30
+        assert query_counter.count == 1
+
+        with query_counter:
+            client.get("/tag/facets", query_string={"ancestor_id": 3})
+
+        assert query_counter.count == 0
@@ -0,0 +1,1215 @@
+import csv
+import io
+import json
+from xml.etree import ElementTree
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from app import db
+from models import taxon_closure
+from responses import DefaultException
+from seeders import seed_db
+from services import (
+    clear_caches,
+    get_cache_stats,
+    get_taxon_tag_index,
+    import_taxon_file,
+    move_taxon_closure,
+    rebuild_taxon_aggregates,
+    rebuild_taxon_closure,
+    subtree_query,
+)
+
+
+@pytest.fixture()
+def seeded_database(database):
+    """Seed database with the default tags and taxons"""
+    seed_db()
+
+
+@pytest.mark.usefixtures("seeded_database")
+class TestTaxonController:
+    # --------------------- CLOSURE ---------------------
+
+    def closure_rows(self) -> set[tuple[int, int, int]]:
+        return set(
+            db.session.execute(
+                select(
+                    taxon_closure.c.ancestor_id,
+                    taxon_closure.c.descendant_id,
+                    taxon_closure.c.depth,
+                )
+            ).all()
+        )
+
+    def create(self, client, taxon_class, name, superior_taxon) -> int:
+        client.post(
+            "/taxon",
+            json={
+                "taxon_class": taxon_class,
+                "name": name,
+                "origin": 1,
+                "superior_taxon": superior_taxon,
+            },
+        )
+        return client.get("/taxon", query_string={"name": name}).json["items"][0]["id"]
+
+    def listed_ids(self, client, **params):
+        response = client.get("/taxon", query_string=params)
+        assert response.status_code == 200
+        return [taxon["id"] for taxon in response.json["items"]]
+
+    def listed_under(self, client, ancestor_id) -> list[int]:
+        return sorted(self.listed_ids(client, ancestor_id=ancestor_id))
+
+    def test_closure_after_create(self, client):
+        chordata = self.create(client, "phylum", "Chordata", 3)
+        rows = {row for row in self.closure_rows() if row[1] == chordata}
+        assert rows == {
+            (chordata, chordata, 0),
+            (3, chordata, 1),
+            (2, chordata, 2),
+            (1, chordata, 3),
+        }
+        assert self.listed_under(client, 2) == [3, chordata]
+
+    def test_move_taxon_subtree(self, client):
+        chordata = self.create(client, "phylum", "Chordata", 3)
+        arthropoda = self.create(client, "phylum", "Arthropoda", 3)
+        mammalia = self.create(client, "class", "Mammalia", chordata)
+        primates = self.create(client, "order", "Primates", mammalia)
+
+        response = client.put(
+            "/taxon/{}".format(mammalia),
+            json={
+                "taxon_class": "class",
+                "name": "Mammalia",
+                "origin": 1,
+                "superior_taxon": arthropoda,
+            },
+        )
+        assert response.status_code == 200
+        assert self.listed_under(client, chordata) == []
+        assert self.listed_under(client, arthropoda) == [mammalia, primates]
+        assert (arthropoda, primates, 2) in self.closure_rows()
+        assert (chordata, primates, 2) not in self.closure_rows()
+
+    def test_update_without_superior_taxon_keeps_it(self, client):
+        response = client.put(
+            "/taxon/3",
+            json={"taxon_class": "kingdom", "name": "Animalia", "origin": 1},
+        )
+        assert response.status_code == 200
+        assert client.get("/taxon/3").json["superior_taxon"] == 2
+        assert self.listed_under(client, 1) == [2, 3]
+        assert (2, 3, 1) in self.closure_rows()
+
+    def test_taxon_cannot_be_under_itself(self, client):
+        chordata = self.create(client, "phylum", "Chordata", 3)
+        # Ranks already forbid it through the API, the closure checks it too
+        for superior_taxon in (3, chordata):
+            with pytest.raises(DefaultException) as error:
+                move_taxon_closure(3, superior_taxon)
+            assert error.value.description == "Taxon_cannot_be_under_itself"
+
+    def test_delete_taxon_with_inferiors(self, client):
+        response = client.delete("/taxon/2")
+        assert response.status_code == 409
+        assert response.json["message"] == "Taxon_has_inferior_taxons"
+
+    def test_rebuild_taxon_closure(self, client):
+        chordata = self.create(client, "phylum", "Chordata", 3)
+        arthropoda = self.create(client, "phylum", "Arthropoda", 3)
+        mammalia = self.create(client, "class", "Mammalia", chordata)
+        self.create(client, "order", "Primates", mammalia)
+        client.put(
+            "/taxon/{}".format(mammalia),
+            json={
+                "taxon_class": "class",
+                "name": "Mammalia",
+                "origin": 1,
+                "superior_taxon": arthropoda,
+            },
+        )
+        incremental = self.closure_rows()
+        assert rebuild_taxon_closure() == len(incremental)
+        assert self.closure_rows() == incremental
+
+    # --------------------- TREE ---------------------
+
+    def tree_names(self, node) -> list:
+        """(name, children) pairs of a tree response"""
+        return [node["name"], [self.tree_names(child) for child in node["children"]]]
+
+    def test_taxon_tree(self, client):
+        chordata = self.create(client, "phylum", "Chordata", 3)
+        self.create(client, "phylum", "Arthropoda", 3)
+        self.create(client, "class", "Mammalia", chordata)
+
+        response = client.get("/taxon/1/tree")
+        assert response.status_code == 200
+        assert response.json["taxon_class"] == "life"
+        assert self.tree_names(response.json) == [
+            "Celular life",
+            [["Eukaryota", [["Animalia", []]]]],
+        ]
+
+        response = client.get("/taxon/3/tree", query_string={"depth": 2})
+        assert self.tree_names(response.json) == [
+            "Animalia",
+            [["Chordata", [["Mammalia", []]]], ["Arthropoda", []]],
+        ]
+
+    def test_taxon_tree_depth(self, client):
+        chordata = self.create(client, "phylum", "Chordata", 3)
+        self.create(client, "class", "Mammalia", chordata)
+
+        response = client.get("/taxon/1/tree", query_string={"depth": 0})
+        assert self.tree_names(response.json) == ["Celular life", []]
+        response = client.get("/taxon/1/tree", query_string={"depth": -5})
+        assert self.tree_names(response.json) == ["Celular life", []]
+
+        # Clamped to the number of ranks, the whole taxonomy still comes back
+        response = client.get("/taxon/1/tree", query_string={"depth": 1000})
+        assert self.tree_names(response.json) == [
+            "Celular life",
+            [["Eukaryota", [["Animalia", [["Chordata", [["Mammalia", []]]]]]]]],
+        ]
+
+    def test_taxon_tree_not_found(self, client):
+        response = client.get("/taxon/99/tree")
+        assert response.status_code == 404
+        assert response.json["message"] == "Taxon_not_found"
+
+    # --------------------- CURSOR PAGINATION ---------------------
+
+    def cursor_pages(self, client, path, **params) -> list[tuple[list[int], int]]:
+        """Ids and total of every page, following next_cursor"""
+        pages = []
+        while True:
+            response = client.get(path, query_string=params)
+            assert response.status_code == 200
+            assert response.json["current_page"] is None
+            assert response.json["total_pages"] is None
+            items = [item["id"] for item in response.json["items"]]
+            pages.append((items, response.json["total_items"]))
+            if response.json["next_cursor"] is None:
+                return pages
+            params["after"] = response.json["next_cursor"]
+
+    def test_taxons_by_cursor(self, client):
+        self.create(client, "phylum", "Chordata", 3)
+
+        assert self.cursor_pages(client, "/taxon", limit=2) == [
+            ([1, 2], None),
+            ([3, 4], None),
+        ]
+        assert self.cursor_pages(client, "/taxon", limit=3, with_total="true") == [
+            ([1, 2, 3], 4),
+            ([4], 4),
+        ]
+        assert self.cursor_pages(client, "/taxon", limit=2, ancestor_id=2) == [
+            ([3, 4], None)
+        ]
+
+    def test_taxons_by_cursor_total(self, client, query_counter):
+        with query_counter:
+            client.get("/taxon", query_string={"limit": 2})
+        assert not any("count(" in query.lower() for query in query_counter.statements)
+        with query_counter:
+            client.get("/taxon", query_string={"limit": 2, "with_total": "true"})
+        assert any("count(" in query.lower() for query in query_counter.statements)
+
+    def assert_tag_filters_by_cursor(self, client):
+        pages = self.cursor_pages(
+            client, "/taxon", limit=2, tags_all="1,2", with_total="true"
+        )
+        assert pages == [([1, 2], 3), ([3], 3)]
+        pages = self.cursor_pages(client, "/taxon", limit=1, tags_any="3,4")
+        assert pages == [([1], None), ([2], None)]
+
+    def test_tag_filters_by_cursor(self, client):
+        self.assert_tag_filters_by_cursor(client)
+
+    def test_tag_filters_by_cursor_without_index(self, client, monkeypatch):
+        monkeypatch.setattr("services.taxon_service._TAG_FILTER_MAX_IDS", 0)
+        self.assert_tag_filters_by_cursor(client)
+
+    def test_tags_by_cursor(self, client):
+        pages = self.cursor_pages(client, "/tag", limit=3, with_total="1")
+        assert pages == [([1, 2, 3], 7), ([4, 5, 6], 7), ([7], 7)]
+        pages = self.cursor_pages(client, "/tag", limit=5, name="tag5")
+        assert pages == [([5, 6], None)]
+
+    def test_invalid_cursor(self, client):
+        response = client.get("/taxon", query_string={"after": "not a cursor"})
+        assert response.status_code == 400
+        assert response.json["message"] == "Invalid_cursor"
+        response = client.get("/tag", query_string={"after": "!!"})
+        assert response.status_code == 400
+
+    # --------------------- SEARCH ---------------------
+
+    def searched_names(self, client, q, **params) -> list[str]:
+        params["q"] = q
+        response = client.get("/taxon/search", query_string=params)
+        assert response.status_code == 200
+        assert response.json["query"] == q
+        return [taxon["name"] for taxon in response.json["items"]]
+
+    def test_search_taxons(self, client):
+        client.post(
+            "/taxon",
+            json={
+                "taxon_class": "phylum",
+                "name": "Chordata",
+                "description": "Animals with a notochord",
+                "origin": 1,
+                "superior_taxon": 3,
+            },
+        )
+
+        # Name matches rank before description matches
+        assert self.searched_names(client, "anim") == ["Animalia", "Chordata"]
+        assert self.searched_names(client, "ANIMAL notochord") == ["Chordata"]
+        assert self.searched_names(client, "Eucariota") == []
+        assert self.searched_names(client, "celular-life") == ["Celular life"]
+        assert len(self.searched_names(client, "description")) == 3
+        assert len(self.searched_names(client, "description", limit=2)) == 2
+
+    def test_search_follows_writes(self, client):
+        client.put(
+            "/taxon/3",
+            json={
+                "taxon_class": "kingdom",
+                "name": "Metazoa",
+                "popular_name": "Animal",
+                "origin": 1,
+                "superior_taxon": 2,
+            },
+        )
+        assert self.searched_names(client, "animalia") == []
+        assert self.searched_names(client, "metaz") == ["Metazoa"]
+
+        client.delete("/taxon/3")
+        assert self.searched_names(client, "metazoa") == []
+
+    def test_invalid_search(self, client):
+        response = client.get("/taxon/search", query_string={"q": " -- "})
+        assert response.status_code == 400
+        assert response.json["message"] == "Search_query_is_required"
+
+    # --------------------- CACHES ---------------------
+
+    def test_cached_taxon(self, client):
+        clear_caches()
+        hits = get_cache_stats()["taxon"]["hits"]
+        first = client.get("/taxon/3").json
+        assert client.get("/taxon/3").json == first
+        assert get_cache_stats()["taxon"]["hits"] == hits + 1
+
+        client.put(
+            "/taxon/3",
+            json={
+                "taxon_class": "kingdom",
+                "name": "Animalia",
+                "popular_name": "Animals",
+                "origin": 1,
+                "superior_taxon": 2,
+                "tags_ids": [1, 4],
+            },
+        )
+        response = client.get("/taxon/3")
+        assert response.json["popular_name"] == "Animals"
+        assert [tag["id"] for tag in response.json["tags"]] == [1, 4]
+
+    def test_cached_taxon_tags(self, client):
+        client.get("/taxon/3")
+        client.get("/tag/1")
+        client.put("/tag/1", json={"name": "renamed", "description": "renamed"})
+        assert client.get("/tag/1").json["name"] == "renamed"
+        tags = client.get("/taxon/3").json["tags"]
+        assert [tag["name"] for tag in tags] == ["renamed", "tag2"]
+
+        client.delete("/tag/1")
+        assert client.get("/tag/1").status_code == 404
+        assert [tag["id"] for tag in client.get("/taxon/3").json["tags"]] == [2]
+
+    def test_cached_deleted_taxon(self, client):
+        chordata = self.create(client, "phylum", "Chordata", 3)
+        assert client.get("/taxon/{}".format(chordata)).status_code == 200
+        client.delete("/taxon/{}".format(chordata))
+        assert client.get("/taxon/{}".format(chordata)).status_code == 404
+
+    # --------------------- TAG FACETS ---------------------
+
+    def facets(self, client, **params) -> list[tuple[str, int]]:
+        response = client.get("/tag/facets", query_string=params)
+        assert response.status_code == 200
+        return [(tag["name"], tag["taxons_count"]) for tag in response.json["items"]]
+
+    def test_tag_facets(self, client):
+        assert self.facets(client) == [
+            ("tag1", 3),
+            ("tag2", 3),
+            ("tag3", 2),
+            ("Pesquisa", 0),
+            ("tag4", 0),
+            ("tag5", 0),
+            ("tag56", 0),
+        ]
+        assert self.facets(client, ancestor_id=1)[:3] == [
+            ("tag1", 2),
+            ("tag2", 2),
+            ("tag3", 1),
+        ]
+        assert self.facets(client, tags_any="3")[:3] == [
+            ("tag1", 2),
+            ("tag2", 2),
+            ("tag3", 2),
+        ]
+
+    def test_tag_facets_follow_writes(self, client):
+        assert self.facets(client, ancestor_id=2)[:2] == [("tag1", 1), ("tag2", 1)]
+        client.put(
+            "/taxon/3",
+            json={
+                "taxon_class": "kingdom",
+                "name": "Animalia",
+                "origin": 1,
+                "superior_taxon": 2,
+                "tags_ids": [5],
+            },
+        )
+        assert self.facets(client, ancestor_id=2)[0] == ("tag5", 1)
+
+        client.put("/tag/5", json={"name": "tag7", "description": "tag7"})
+        assert self.facets(client, ancestor_id=2)[0] == ("tag7", 1)
+
+    # --------------------- TIMELINE ---------------------
+
+    def create_timeline_taxons(self, client) -> tuple[int, int]:
+        chordata = self.create(client, "phylum", "Chordata", 3)
+        client.post(
+            "/taxon",
+            json={
+                "taxon_class": "phylum",
+                "name": "Trilobita",
+                "origin": 2,
+                "extinction": 1,
+                "superior_taxon": 3,
+            },
+        )
+        trilobita = self.listed_ids(client, name="Trilobita")[0]
+        return chordata, trilobita
+
+    def test_time_range_filters(self, client):
+        chordata, trilobita = self.create_timeline_taxons(client)
+
+        assert self.listed_ids(client, origin_min=2) == [1, trilobita]
+        assert self.listed_ids(client, origin_max=1) == [2, 3, chordata]
+        assert self.listed_ids(client, origin_min=1, origin_max=2) == [
+            2,
+            3,
+            chordata,
+            trilobita,
+        ]
+        assert self.listed_ids(client, extinction_min=1) == [trilobita]
+        assert self.listed_ids(client, extinction_max=0) == []
+        assert self.listed_ids(client, alive_at=3) == [1]
+        assert self.listed_ids(client, alive_at=2) == [1, trilobita]
+        assert self.listed_ids(client, alive_at=1) == [1, 2, 3, chordata, trilobita]
+        assert self.listed_ids(client, alive_at=0) == [1, 2, 3, chordata]
+        assert self.listed_ids(client, alive_at=1, ancestor_id=3) == [
+            chordata,
+            trilobita,
+        ]
+
+    def timeline(self, client, **params) -> list[tuple[int, int, int]]:
+        """(at, total, phyla) of every point"""
+        response = client.get("/taxon/timeline", query_string=params)
+        assert response.status_code == 200
+        return [
+            (item["at"], item["total"], item["ranks"]["phylum"])
+            for item in response.json["items"]
+        ]
+
+    def test_taxon_timeline(self, client):
+        assert self.timeline(client, at=[3, 1]) == [(3, 1, 0), (1, 3, 0)]
+
+        # The index follows the writes through the snapshot
+        self.create_timeline_taxons(client)
+        assert self.timeline(client, at=[3, 2, 1, 0]) == [
+            (3, 1, 0),
+            (2, 2, 1),
+            (1, 5, 2),
+            (0, 4, 1),
+        ]
+        assert self.timeline(client, at=[2, 1, 0], ancestor_id=3) == [
+            (2, 1, 1),
+            (1, 3, 2),
+            (0, 2, 1),
+        ]
+        response = client.get("/taxon/timeline", query_string={"at": 1})
+        assert response.json["items"][0]["ranks"]["kingdom"] == 1
+
+    def test_invalid_time_ranges(self, client):
+        response = client.get("/taxon", query_string={"origin_min": 3, "origin_max": 1})
+        assert response.status_code == 400
+        assert response.json["message"] == "Invalid_origin_range"
+        response = client.get(
+            "/taxon", query_string={"extinction_min": 2, "extinction_max": 1}
+        )
+        assert response.status_code == 400
+        assert response.json["message"] == "Invalid_extinction_range"
+
+        response = client.get("/taxon/timeline")
+        assert response.status_code == 400
+        assert response.json["message"] == "Timeline_time_is_required"
+        response = client.get(
+            "/taxon/timeline", query_string={"at": 1, "ancestor_id": 99}
+        )
+        assert response.status_code == 404
+
+    # --------------------- EXPORT ---------------------
+
+    def create_export_taxons(self, client) -> None:
+        """Chordata and Mammalia, after a deleted taxon so the ids have a gap"""
+        self.create(client, "phylum", "Arthropoda", 3)
+        chordata = self.create(client, "phylum", "Chordata", 3)
+        client.put(
+            "/taxon/{}".format(chordata),
+            json={
+                "taxon_class": "phylum",
+                "name": "Chordata",
+                "description": 'Has a notochord, "mostly"',
+                "origin": 1,
+                "superior_taxon": 3,
+                "tags_ids": [2, 5],
+            },
+        )
+        self.create(client, "class", "Mammalia", chordata)
+        client.delete("/taxon/4")
+
+    def test_export_ndjson(self, client):
+        self.create_export_taxons(client)
+        response = client.get("/taxon/export")
+
+        assert response.status_code == 200
+        assert response.mimetype == "application/x-ndjson"
+        assert "taxons.ndjson" in response.headers["Content-Disposition"]
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert [row["id"] for row in rows] == [1, 2, 3, 5, 6]
+        assert rows[0]["superior_taxon"] is None
+        assert rows[0]["superior_taxon_name"] is None
+        assert rows[0]["tags_ids"] == [1, 2, 3]
+        assert rows[3] == {
+            "id": 5,
+            "taxon_class": "phylum",
+            "name": "Chordata",
+            "popular_name": None,
+            "description": 'Has a notochord, "mostly"',
+            "origin": 1,
+            "extinction": None,
+            "individuals_number": None,
+            "superior_taxon": 3,
+            "superior_taxon_name": "Animalia",
+            "tags_ids": [2, 5],
+        }
+        assert rows[4]["superior_taxon_name"] == "Chordata"
+        assert rows[4]["tags_ids"] == []
+
+    def test_export_csv(self, client):
+        self.create_export_taxons(client)
+        response = client.get("/taxon/export", query_string={"format": "csv"})
+
+        assert response.status_code == 200
+        assert response.mimetype == "text/csv"
+        lines = response.text.splitlines()
+        assert lines[0] == (
+            "id,taxon_class,name,popular_name,description,origin,extinction,"
+            "individuals_number,superior_taxon,superior_taxon_name,tags_ids"
+        )
+        rows = list(csv.DictReader(io.StringIO(response.text)))
+        assert [row["id"] for row in rows] == ["1", "2", "3", "5", "6"]
+        assert rows[0]["tags_ids"] == "1;2;3"
+        assert rows[3]["description"] == 'Has a notochord, "mostly"'
+        assert rows[3]["superior_taxon_name"] == "Animalia"
+        assert rows[3]["tags_ids"] == "2;5"
+        assert rows[4]["tags_ids"] == ""
+
+    def portable_row(self, line: str) -> dict[str, any]:
+        row = json.loads(line)
+        del row["id"], row["superior_taxon"]
+        return row
+
+    def test_export_import_round_trip(self, client):
+        self.create_export_taxons(client)
+        exported = client.get("/taxon/export", query_string={"format": "csv"}).text
+        before = client.get("/taxon/export").text.splitlines()
+
+        # A database with the same tags and none of the taxons
+        for taxon_id in (6, 5, 3, 2, 1):
+            assert client.delete("/taxon/{}".format(taxon_id)).status_code == 200
+        report = import_taxon_file(io.StringIO(exported), "csv")
+
+        assert report["imported"] == 5
+        assert report["rejected_count"] == 0
+        after = client.get("/taxon/export").text.splitlines()
+        # Ids are assigned by the target database, names carry the links
+        assert [self.portable_row(line) for line in after] == [
+            self.portable_row(line) for line in before
+        ]
+        mammalia = self.listed_ids(client, name="Mammalia")[0]
+        chordata = self.listed_ids(client, name="Chordata")[0]
+        assert self.listed_ids(client, ancestor_id=chordata) == [mammalia]
+
+    def test_invalid_export(self, client):
+        response = client.get("/taxon/export", query_string={"format": "xml"})
+        assert response.status_code == 400
+        assert response.json["message"] == "Invalid_export_format"
+
+    # --------------------- BATCH ---------------------
+
+    def test_save_taxon_batch(self, client):
+        items = [
+            {
+                "taxon_class": "phylum",
+                "name": "phylum {}".format(index),
+                "origin": 1,
+                "superior_taxon": 3,
+                "tags_ids": [1],
+            }
+            for index in range(20)
+        ]
+        items.append(
+            {
+                "id": 3,
+                "taxon_class": "kingdom",
+                "name": "Animalia",
+                "popular_name": "Animals",
+                "origin": 1,
+                "superior_taxon": 2,
+                "tags_ids": [3],
+            }
+        )
+        response = client.post("/taxon/batch", json={"items": items})
+
+        assert response.status_code == 200
+        assert len(response.json["data"]["created_ids"]) == 20
+        assert response.json["data"]["updated_ids"] == [3]
+
+        response = client.get("/taxon", query_string={"ancestor_id": 2})
+        assert response.json["total_items"] == 21
+
+        response = client.get("/taxon/3")
+        assert response.json["popular_name"] == "Animals"
+        assert [tag["id"] for tag in response.json["tags"]] == [3]
+
+    def test_save_invalid_taxon_batch(self, client):
+        items = [
+            {
+                "taxon_class": "phylum",
+                "name": "Chordata",
+                "origin": 1,
+                "superior_taxon": 3,
+            },
+            {
+                "taxon_class": "phylum",
+                "name": "Animalia",
+                "origin": 1,
+                "superior_taxon": 3,
+            },
+            {
+                "taxon_class": "class",
+                "name": "Mammalia",
+                "origin": 1,
+                "superior_taxon": 3,
+            },
+            {
+                "taxon_class": "phylum",
+                "name": "Chordata",
+                "origin": 1,
+                "superior_taxon": 3,
+            },
+            {"id": 99, "taxon_class": "phylum", "name": "Arthropoda", "origin": 1},
+        ]
+        response = client.post("/taxon/batch", json={"items": items})
+
+        assert response.status_code == 400
+        assert response.json["message"] == "Invalid_batch"
+        assert [error["index"] for error in response.json["info"]] == [1, 2, 3, 4]
+        assert response.json["info"][0]["message"] == "This_Taxon_already_exists"
+        assert response.json["info"][3]["message"] == "Taxon_not_found"
+        assert client.get("/taxon").json["total_items"] == 3
+
+        for body in (items, {"items": items[0]}, {"items": [items[0], 3]}):
+            response = client.post("/taxon/batch", json=body)
+            assert response.status_code == 400
+            assert response.json["message"] == "Invalid_data"
+
+    def test_save_taxon_batch_with_new_superiors(self, client):
+        items = [
+            {
+                "taxon_class": "order",
+                "name": "Primates",
+                "origin": 1,
+                "superior_taxon_name": "Mammalia",
+            },
+            {
+                "taxon_class": "class",
+                "name": "Mammalia",
+                "origin": 1,
+                "superior_taxon_name": "Chordata",
+                "tags_ids": [4],
+            },
+            {
+                "taxon_class": "phylum",
+                "name": "Chordata",
+                "origin": 1,
+                "superior_taxon_name": "Animalia",
+            },
+            {
+                "taxon_class": "phylum",
+                "name": "Arthropoda",
+                "origin": 1,
+                "superior_taxon": 3,
+            },
+        ]
+        response = client.post("/taxon/batch", json={"items": items})
+
+        assert response.status_code == 200
+        created_ids = response.json["data"]["created_ids"]
+        for taxon_id, item in zip(created_ids, items):
+            assert client.get("/taxon/{}".format(taxon_id)).json["name"] == item["name"]
+        primates, mammalia, chordata, _ = created_ids
+        assert self.listed_ids(client, ancestor_id=chordata) == [mammalia, primates]
+        assert client.get("/taxon/{}".format(mammalia)).json["tags"][0]["id"] == 4
+        response = client.get("/taxon/lca", query_string={"ids": [primates, 3]})
+        assert response.json["lca"]["id"] == 3
+
+    def test_update_taxon_batch_keeps_omitted_fields(self, client):
+        items = [
+            {"id": 3, "taxon_class": "kingdom", "name": "Metazoa", "origin": 2},
+            {
+                "taxon_class": "phylum",
+                "name": "Chordata",
+                "origin": 1,
+                "superior_taxon": 3,
+            },
+        ]
+        response = client.post("/taxon/batch", json={"items": items})
+
+        assert response.status_code == 200
+        taxon = client.get("/taxon/3").json
+        assert taxon["name"] == "Metazoa"
+        assert taxon["origin"] == "2"
+        assert taxon["superior_taxon"] == 2
+        assert taxon["popular_name"] == "Animal"
+        assert self.listed_ids(client, ancestor_id=1) == [2, 3, 4]
+
+    def test_invalid_taxon_batch_superior_names(self, client):
+        items = [
+            {
+                "taxon_class": "phylum",
+                "name": "Chordata",
+                "origin": 1,
+                "superior_taxon_name": "Nowhere",
+            },
+            {
+                "taxon_class": "order",
+                "name": "Primates",
+                "origin": 1,
+                "superior_taxon_name": "Animalia",
+            },
+            {
+                "id": 3,
+                "taxon_class": "kingdom",
+                "name": "Animalia",
+                "origin": 1,
+                "superior_taxon_name": "Eukaryota",
+            },
+            {
+                "taxon_class": "phylum",
+                "name": "Arthropoda",
+                "origin": 1,
+                "superior_taxon": 3,
+                "superior_taxon_name": "Animalia",
+            },
+        ]
+        response = client.post("/taxon/batch", json={"items": items})
+
+        assert response.status_code == 400
+        assert [error["message"] for error in response.json["info"]] == [
+            "Superior_taxon_not_found",
+            "Taxon_Animalia_is_not_a_valid_superior_taxon_of_order,_it_should_be_a_class",
+            "Superior_taxon_name_is_only_for_new_taxons",
+            "Superior_taxon_and_superior_taxon_name_are_exclusive",
+        ]
+        assert client.get("/taxon").json["total_items"] == 3
+
+    # --------------------- AGGREGATES ---------------------
+
+    def aggregates(self, client, taxon_id):
+        taxon = client.get("/taxon/{}".format(taxon_id)).json
+        return (
+            taxon["descendant_count"],
+            taxon["species_count"],
+            taxon["individuals_sum"],
+        )
+
+    def test_taxon_aggregates(self, client):
+        items = [
+            {
+                "taxon_class": "phylum",
+                "name": "Chordata",
+                "origin": 1,
+                "superior_taxon": 3,
+            },
+            {
+                "taxon_class": "phylum",
+                "name": "Arthropoda",
+                "origin": 1,
+                "superior_taxon": 3,
+            },
+        ]
+        created_ids = client.post("/taxon/batch", json={"items": items}).json["data"][
+            "created_ids"
+        ]
+        chordata, arthropoda = created_ids
+        parent = chordata
+        for taxon_class in ["class", "order", "family", "genus"]:
+            client.post(
+                "/taxon",
+                json={
+                    "taxon_class": taxon_class,
+                    "name": taxon_class,
+                    "origin": 1,
+                    "superior_taxon": parent,
+                },
+            )
+            parent = client.get("/taxon", query_string={"name": taxon_class}).json[
+                "items"
+            ][0]["id"]
+        genus = parent
+        for index in range(3):
+            client.post(
+                "/taxon",
+                json={
+                    "taxon_class": "species",
+                    "name": "species {}".format(index),
+                    "origin": 1,
+                    "individuals_number": 10,
+                    "superior_taxon": genus,
+                },
+            )
+        assert self.aggregates(client, 1) == (11, 3, 11130)
+        assert self.aggregates(client, chordata) == (7, 3, 30)
+
+        class_id = client.get("/taxon", query_string={"name": "class"}).json["items"][
+            0
+        ]["id"]
+        response = client.put(
+            "/taxon/{}".format(class_id),
+            json={
+                "taxon_class": "class",
+                "name": "class",
+                "origin": 1,
+                "individuals_number": 5,
+                "superior_taxon": arthropoda,
+            },
+        )
+        assert response.status_code == 200
+        assert self.aggregates(client, chordata) == (0, 0, 0)
+        assert self.aggregates(client, arthropoda) == (7, 3, 35)
+        assert self.aggregates(client, 1) == (11, 3, 11135)
+
+        species = client.get("/taxon", query_string={"name": "species 0"}).json[
+            "items"
+        ][0]["id"]
+        client.delete("/taxon/{}".format(species))
+        assert self.aggregates(client, 1) == (10, 2, 11125)
+        assert self.aggregates(client, genus) == (2, 2, 20)
+
+        response = client.get("/taxon", query_string={"sort": "-species_count"})
+        species_counts = [taxon["species_count"] for taxon in response.json["items"]]
+        assert species_counts == [2] * 8 + [1] * 2
+
+    def test_rebuild_taxon_aggregates(self, client):
+        client.post(
+            "/taxon",
+            json={
+                "taxon_class": "phylum",
+                "name": "Chordata",
+                "origin": 1,
+                "superior_taxon": 3,
+            },
+        )
+        expected = [self.aggregates(client, taxon_id) for taxon_id in (1, 2, 3, 4)]
+        assert expected[0] == (3, 0, 11100)
+        assert rebuild_taxon_aggregates() == 4
+        clear_caches()
+        assert [
+            self.aggregates(client, taxon_id) for taxon_id in (1, 2, 3, 4)
+        ] == expected
+
+    def test_invalid_taxon_sort(self, client):
+        response = client.get("/taxon", query_string={"sort": "popularity"})
+        assert response.status_code == 400
+        response = client.get("/taxon", query_string={"sort": "name", "limit": 2})
+        assert response.status_code == 400
+
+    # --------------------- TAG FILTERS ---------------------
+
+    def assert_tag_filters(self, client):
+        assert self.listed_ids(client, tags_all="1,2") == [1, 2, 3]
+        assert self.listed_ids(client, tags_all="1,3") == [1, 2]
+        assert self.listed_ids(client, tags_all="1,4") == []
+        assert self.listed_ids(client, tags_any="3,4") == [1, 2]
+        assert self.listed_ids(client, tags_all="2", tags_any="3,4") == [1, 2]
+
+        client.put(
+            "/taxon/3",
+            json={
+                "taxon_class": "kingdom",
+                "name": "Animalia",
+                "origin": 1,
+                "superior_taxon": 2,
+                "tags_ids": [3, 4],
+            },
+        )
+        assert self.listed_ids(client, tags_all="1,3") == [1, 2]
+        assert self.listed_ids(client, tags_all="3,4") == [3]
+        assert self.listed_ids(client, tags_any="4") == [3]
+
+    def test_tag_filters(self, client):
+        self.assert_tag_filters(client)
+
+    def test_tag_filters_without_index(self, client, monkeypatch):
+        monkeypatch.setattr("services.taxon_service._TAG_FILTER_MAX_IDS", 0)
+        self.assert_tag_filters(client)
+
+    def test_tag_index_publishes_new_bitmaps(self, client):
+        index = get_taxon_tag_index()
+        held = index.bitmaps
+        kept = {tag_id: bitmap.tolist() for tag_id, bitmap in held.items()}
+
+        self.assert_tag_filters(client)
+        assert get_taxon_tag_index().bitmaps is not held
+        assert {tag_id: bitmap.tolist() for tag_id, bitmap in held.items()} == kept
+
+    def test_invalid_tag_filter(self, client):
+        response = client.get("/taxon", query_string={"tags_all": "1,a"})
+        assert response.status_code == 400
+        assert response.json["message"] == "Invalid_tags_all"
+
+    # --------------------- CONDITIONAL REQUESTS ---------------------
+
+    def test_taxon_etag(self, client):
+        response = client.get("/taxon/3")
+        etag = response.headers["ETag"]
+        assert response.headers["Last-Modified"]
+
+        response = client.get("/taxon/3", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.data == b""
+
+        client.put("/tag/1", json={"name": "renamed tag"})
+        response = client.get("/taxon/3", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
+    def test_taxon_list_etag(self, client):
+        etag = client.get("/taxon").headers["ETag"]
+        response = client.get("/taxon", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+
+        client.post(
+            "/taxon",
+            json={
+                "taxon_class": "phylum",
+                "name": "Chordata",
+                "origin": 1,
+                "superior_taxon": 3,
+            },
+        )
+        response = client.get("/taxon", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.json["total_items"] == 4
+
+    # --------------------- AUTOCOMPLETE ---------------------
+
+    def test_autocomplete(self, client):
+        response = client.get("/taxon/autocomplete", query_string={"prefix": "ANIM"})
+        assert response.status_code == 200
+        assert [taxon["name"] for taxon in response.json["taxons"]] == ["Animalia"]
+
+        # Written taxons show up, accents are ignored, higher ranks come first
+        client.post(
+            "/taxon",
+            json={
+                "taxon_class": "phylum",
+                "name": "Ánimo",
+                "popular_name": "Cordados",
+                "origin": 1,
+                "superior_taxon": 3,
+            },
+        )
+        response = client.get("/taxon/autocomplete", query_string={"prefix": "ani"})
+        assert [taxon["name"] for taxon in response.json["taxons"]] == [
+            "Animalia",
+            "Ánimo",
+        ]
+        response = client.get(
+            "/taxon/autocomplete", query_string={"prefix": "cor", "limit": 1}
+        )
+        assert response.json["taxons"] == [
+            {
+                "id": 4,
+                "name": "Ánimo",
+                "popular_name": "Cordados",
+                "taxon_class": "phylum",
+            }
+        ]
+
+        client.delete("/taxon/4")
+        response = client.get("/taxon/autocomplete", query_string={"prefix": "ani"})
+        assert [taxon["id"] for taxon in response.json["taxons"]] == [3]
+
+    def test_autocomplete_tags(self, client):
+        client.post("/tag", json={"name": "Tagged", "description": "new tag"})
+        response = client.get(
+            "/taxon/autocomplete", query_string={"prefix": "tag", "limit": 3}
+        )
+        assert response.json["taxons"] == []
+        tags = [(tag["name"], tag["taxon_count"]) for tag in response.json["tags"]]
+        assert tags == [("tag1", 3), ("tag2", 3), ("tag3", 2)]
+        response = client.get("/taxon/autocomplete", query_string={"prefix": "tagge"})
+        assert [tag["name"] for tag in response.json["tags"]] == ["Tagged"]
+
+    def test_invalid_autocomplete(self, client):
+        response = client.get("/taxon/autocomplete", query_string={"prefix": "  "})
+        assert response.status_code == 400
+
+    # --------------------- NAME RESOLUTION ---------------------
+
+    def test_resolve_taxon_names(self, client):
+        names = ["Animalia", " animália. ", "Eukariota", "Zzzz", "Animalia"]
+        response = client.post("/taxon/resolve", json={"names": names})
+        assert response.status_code == 200
+        assert response.json["matched"] == 4
+        items = response.json["items"]
+        assert [item["name"] for item in items] == names
+        assert [item["match_type"] for item in items] == [
+            "exact",
+            "normalized",
+            "fuzzy",
+            None,
+            "exact",
+        ]
+        assert [(item["taxon"] or {}).get("id") for item in items] == [
+            3,
+            3,
+            2,
+            None,
+            3,
+        ]
+        assert 0.5 <= items[2]["score"] < 1
+
+        response = client.post(
+            "/taxon/resolve", json={"names": ["Eukariota"], "fuzzy": False}
+        )
+        assert response.json["items"][0]["taxon"] is None
+        response = client.post(
+            "/taxon/resolve", json={"names": ["Eukariota"], "min_score": 0.9}
+        )
+        assert response.json["items"][0]["taxon"] is None
+
+        # Follows the writes through the taxonomy snapshot
+        client.put(
+            "/taxon/3",
+            json={
+                "taxon_class": "kingdom",
+                "name": "Metazoa",
+                "origin": 1,
+                "superior_taxon": 2,
+            },
+        )
+        response = client.post("/taxon/resolve", json={"names": ["metazoa"]})
+        assert response.json["items"][0]["taxon"]["id"] == 3
+
+    def test_invalid_resolve_taxon_names(self, client):
+        response = client.post("/taxon/resolve", json={"names": []})
+        assert response.status_code == 400
+        response = client.post("/taxon/resolve", json={"names": [1]})
+        assert response.status_code == 400
+        for body, message in (
+            ({"names": "Animalia"}, "Names_must_be_a_list"),
+            ({"names": ["Animalia"], "fuzzy": "false"}, "Invalid_fuzzy"),
+            ({"names": ["Animalia"], "min_score": True}, "Invalid_min_score"),
+            (["Animalia"], "Invalid_data"),
+        ):
+            response = client.post("/taxon/resolve", json=body)
+            assert response.status_code == 400
+            assert response.json["message"] == message
+
+    # --------------------- LOWEST COMMON ANCESTOR ---------------------
+
+    def test_taxon_lca(self, client):
+        for name in ("Chordata", "Arthropoda"):  # ids 4 and 5
+            client.post(
+                "/taxon",
+                json={
+                    "taxon_class": "phylum",
+                    "name": name,
+                    "origin": 1,
+                    "superior_taxon": 3,
+                },
+            )
+
+        response = client.get("/taxon/lca", query_string={"ids": "4,5,2"})
+        assert response.status_code == 200
+        assert response.json["lca"]["id"] == 2
+        assert [taxon["depth"] for taxon in response.json["taxons"]] == [1, 3, 3]
+        pairs = {
+            (pair["first_id"], pair["second_id"]): (pair["lca_id"], pair["distance"])
+            for pair in response.json["pairs"]
+        }
+        assert pairs == {(2, 4): (2, 2), (2, 5): (2, 2), (4, 5): (3, 2)}
+
+        # A new life root is unrelated to the seeded tree
+        client.post(
+            "/taxon", json={"taxon_class": "life", "name": "Other life", "origin": 1}
+        )
+        response = client.get("/taxon/lca", query_string=[("ids", 4), ("ids", 6)])
+        assert response.json["lca"] is None
+        assert response.json["pairs"][0]["distance"] is None
+
+    def test_class_change_with_inferiors(self, client):
+        phylum = self.create(client, "phylum", "Chordata", 3)
+        other_phylum = self.create(client, "phylum", "Arthropoda", 3)
+        class_ = self.create(client, "class", "Mammalia", phylum)
+        order = self.create(client, "order", "Primates", class_)
+
+        # Mammalia would be a class under a class and Primates two ranks down
+        response = client.put(
+            "/taxon/{}".format(phylum),
+            json={
+                "taxon_class": "class",
+                "name": "Chordata",
+                "origin": 1,
+                "superior_taxon": other_phylum,
+            },
+        )
+        assert response.status_code == 409
+        assert response.json["message"] == "Taxon_has_inferior_taxons"
+        response = client.post(
+            "/taxon/batch",
+            json={
+                "items": [
+                    {
+                        "id": phylum,
+                        "taxon_class": "class",
+                        "name": "Chordata",
+                        "origin": 1,
+                        "superior_taxon": other_phylum,
+                    }
+                ]
+            },
+        )
+        assert response.status_code == 400
+        assert response.json["info"][0]["message"] == "Taxon_has_inferior_taxons"
+
+        response = client.get(
+            "/taxon/lca", query_string={"ids": "{},{}".format(other_phylum, order)}
+        )
+        assert response.json["lca"]["id"] == 3
+        assert [taxon["depth"] for taxon in response.json["taxons"]] == [3, 5]
+        assert response.json["pairs"][0]["distance"] == 4
+
+    def test_invalid_taxon_lca(self, client):
+        response = client.get("/taxon/lca", query_string={"ids": "3"})
+        assert response.status_code == 400
+        response = client.get("/taxon/lca", query_string={"ids": "3,404"})
+        assert response.status_code == 404
+
+    # --------------------- TREE EXPORT ---------------------
+
+    def test_export_taxon_tree(self, client):
+        # Claims to be older than Animalia, so it gets no branch length
+        client.post(
+            "/taxon",
+            json={
+                "taxon_class": "phylum",
+                "name": "Chordata",
+                "origin": 2,
+                "superior_taxon": 3,
+            },
+        )
+
+        response = client.get("/taxon/1/export")
+        assert response.status_code == 200
+        assert response.mimetype == "text/x-newick"
+        assert response.get_data(as_text=True) == (
+            "(((Chordata)Animalia:0)Eukaryota:2)'Celular life';\n"
+        )
+        response = client.get("/taxon/3/export")
+        assert response.get_data(as_text=True) == "(Chordata)Animalia;\n"
+
+        response = client.get("/taxon/2/export", query_string={"format": "phyloxml"})
+        assert response.status_code == 200
+        assert "filename=taxon-2.xml" in response.headers["Content-Disposition"]
+        namespace = {"px": "http://www.phyloxml.org"}
+        root = ElementTree.fromstring(response.get_data())
+        clade = root.find("px:phylogeny/px:clade", namespace)
+        assert clade.findtext("px:name", namespaces=namespace) == "Eukaryota"
+        assert [
+            child.findtext("px:taxonomy/px:rank", namespaces=namespace)
+            for child in clade.iterfind("px:clade/px:clade", namespace)
+        ] == ["phylum"]
+
+    def test_export_subtree(self, client):
+        chordata = self.create(client, "phylum", "Chordata", 3)
+        arthropoda = self.create(client, "phylum", "Arthropoda", 3)
+        self.create(client, "class", "Mammalia", chordata)
+        self.create(client, "class", "Insecta", arthropoda)
+        self.create(client, "class", "Aves", chordata)
+
+        response = client.get("/taxon/3/export")
+        assert response.get_data(as_text=True) == (
+            "((Mammalia:0,Aves:0)Chordata:0,(Insecta:0)Arthropoda:0)Animalia;\n"
+        )
+        response = client.get(
+            "/taxon/{}/export".format(chordata), query_string={"format": "phyloxml"}
+        )
+        namespace = {"px": "http://www.phyloxml.org"}
+        clade = ElementTree.fromstring(response.get_data()).find(
+            "px:phylogeny/px:clade", namespace
+        )
+        assert clade.findtext("px:name", namespaces=namespace) == "Chordata"
+        assert clade.find("px:branch_length", namespace) is None
+        assert [
+            (
+                child.findtext("px:name", namespaces=namespace),
+                child.findtext("px:branch_length", namespaces=namespace),
+            )
+            for child in clade.iterfind("px:clade", namespace)
+        ] == [("Mammalia", "0"), ("Aves", "0")]
+
+    def test_subtree_query_types(self, client):
+        # Postgres needs both terms of the recursive CTE typed the same
+        sql = str(subtree_query(3).compile(dialect=postgresql.dialect()))
+        anchor, recursive = sql.split("UNION ALL")
+        assert "CAST(NULL AS INTEGER) AS superior_origin" in anchor
+        assert "CAST(subtree.origin AS INTEGER)" in recursive
+        assert anchor.count("AS TEXT)") == 1
+        assert recursive.count("AS TEXT) AS TEXT)") == 1
+        assert "::BIGINT" in anchor and "::BIGINT" in recursive
+
+    def test_invalid_export_taxon_tree(self, client):
+        response = client.get("/taxon/404/export")
+        assert response.status_code == 404
+        response = client.get("/taxon/1/export", query_string={"format": "nexus"})
+        assert response.status_code == 400
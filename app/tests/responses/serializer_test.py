@@ -0,0 +1,71 @@
+import json
+
+import pytest
+from flask_restx import marshal
+
+from controllers.tag_controller import TagDto
+from controllers.taxon_controller import TaxonDto
+from responses import compile_serializer, dump_json
+from seeders import seed_db
+from services import get_taxon_payload, get_taxons, get_tags
+from werkzeug.datastructures import ImmutableMultiDict
+
+
+@pytest.fixture()
+def seeded_database(database):
+    """Seed database with the default tags and taxons"""
+    seed_db()
+
+
+@pytest.mark.usefixtures("seeded_database")
+class TestSerializer:
+    def test_taxon_list(self):
+        page = get_taxons(ImmutableMultiDict())
+        expected = marshal(page, TaxonDto.taxon_get_list)
+
+        assert compile_serializer(TaxonDto.taxon_get_list)(page) == expected
+
+    def test_taxon_payload(self):
+        taxon = get_taxon_payload(3)
+        expected = marshal(taxon, TaxonDto.taxon_get)
+
+        assert compile_serializer(TaxonDto.taxon_get)(taxon) == expected
+
+    def test_tag_list(self):
+        page = get_tags(ImmutableMultiDict({"limit": 2}))
+        expected = marshal(page, TagDto.tag_get_list)
+
+        assert compile_serializer(TagDto.tag_get_list)(page) == expected
+
+    def test_missing_values(self):
+        serializer = compile_serializer(TaxonDto.taxon_get)
+
+        assert serializer({}) == marshal({}, TaxonDto.taxon_get)
+        assert serializer({"tags": [None]}) == marshal(
+            {"tags": [None]}, TaxonDto.taxon_get
+        )
+
+    def test_dump_json(self):
+        body = compile_serializer(TaxonDto.taxon_get)(get_taxon_payload(3))
+        dumped = dump_json(body)
+
+        if dumped is not None:
+            assert json.loads(dumped) == body
+
+    def test_orjson_responses(self, client, monkeypatch):
+        if dump_json({}) is None:
+            pytest.skip("orjson is not installed")
+        page = get_taxons(ImmutableMultiDict())
+        expected_bodies = {
+            "/taxon/3": marshal(get_taxon_payload(3), TaxonDto.taxon_get),
+            "/taxon": marshal(page, TaxonDto.taxon_get_list),
+        }
+
+        for path, expected in expected_bodies.items():
+            monkeypatch.setitem(client.application.config, "ORJSON_RESPONSES", True)
+            assert client.get(path).data == dump_json(expected)
+            # flask_restx encodes the same body, indented under DEBUG
+            monkeypatch.setitem(client.application.config, "ORJSON_RESPONSES", False)
+            response = client.get(path)
+            assert response.data != dump_json(expected)
+            assert json.loads(response.data) == expected
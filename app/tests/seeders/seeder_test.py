@@ -0,0 +1,72 @@
+import pytest
+from sqlalchemy import select, text
+
+from app import db
+from models import TAXON_CLASS_TYPES, Taxon
+from seeders import generate_taxonomy, seed_db, seed_db_synthetic_taxonomy
+from services import rebuild_taxon_aggregates, rebuild_taxon_closure
+
+
+@pytest.fixture()
+def synthetic_database(database):
+    """The default data plus a 3000 taxons synthetic tree"""
+    seed_db()
+    return seed_db_synthetic_taxonomy(3000, seed=1)
+
+
+def aggregates() -> list:
+    return db.session.execute(
+        select(
+            Taxon.id, Taxon.descendant_count, Taxon.species_count, Taxon.individuals_sum
+        ).order_by(Taxon.id)
+    ).all()
+
+
+def closure() -> list:
+    return db.session.execute(
+        text("SELECT * FROM taxon_closure ORDER BY ancestor_id, descendant_id")
+    ).all()
+
+
+class TestSyntheticTaxonomy:
+    def test_generate_taxonomy(self):
+        taxonomy = generate_taxonomy(
+            5000, tags_ids=[1, 2, 3], first_id=10, extinction_rate=0.5
+        )
+        ids = taxonomy["id"].tolist()
+        superior = dict(zip(ids, taxonomy["superior_taxon"].tolist()))
+        rank = dict(zip(ids, taxonomy["rank"].tolist()))
+        origin = dict(zip(ids, taxonomy["origin"].tolist()))
+        extinction = dict(zip(ids, taxonomy["extinction"].tolist()))
+
+        assert 4500 <= len(ids) <= 5000
+        assert ids[0] == 10 and superior[10] == -1
+        assert rank[ids[-1]] == TAXON_CLASS_TYPES.index("species")
+        for taxon_id in ids[1:]:
+            parent = superior[taxon_id]
+            assert rank[taxon_id] == rank[parent] + 1
+            assert origin[taxon_id] <= origin[parent]
+            if extinction[parent] >= 0:
+                assert extinction[parent] <= extinction[taxon_id] < origin[taxon_id]
+        pairs = list(zip(taxonomy["tag_taxon_id"], taxonomy["tag_id"]))
+        assert len(set(pairs)) == len(pairs)
+
+    def test_same_seed_same_taxonomy(self):
+        first, second = generate_taxonomy(2000), generate_taxonomy(2000)
+        assert all((first[key] == second[key]).all() for key in first)
+
+    def test_seed_synthetic_taxonomy(self, client, synthetic_database):
+        assert synthetic_database["first_id"] == 4
+
+        written_closure, written_aggregates = closure(), aggregates()
+        rebuild_taxon_closure()
+        rebuild_taxon_aggregates()
+        assert closure() == written_closure
+        assert aggregates() == written_aggregates
+
+        response = client.get("/taxon/search", query_string={"q": "genus"})
+        assert response.status_code == 200
+        assert response.json["items"]
+
+        response = client.get("/taxon", query_string={"ancestor_id": 4})
+        assert response.json["total_items"] == synthetic_database["taxons"] - 1
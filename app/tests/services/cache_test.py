@@ -0,0 +1,56 @@
+from services import PayloadCache
+
+
+class TestPayloadCache:
+    def test_least_recently_used_evicted(self):
+        cache = PayloadCache(max_size=2, ttl=60)
+        cache.set(1, "one")
+        cache.set(2, "two")
+        assert cache.get(1) == "one"
+        cache.set(3, "three")
+
+        assert cache.get(2) is None
+        assert cache.get(1) == "one"
+        assert cache.get(3) == "three"
+        assert cache.stats() == {"size": 2, "max_size": 2, "hits": 3, "misses": 1}
+
+    def test_expired_entries(self, monkeypatch):
+        now = [100.0]
+        monkeypatch.setattr("services.cache_service.monotonic", lambda: now[0])
+        cache = PayloadCache(max_size=10, ttl=5)
+        cache.set(1, "one")
+        now[0] += 4
+        assert cache.get(1) == "one"
+        now[0] += 2
+        assert cache.get(1) is None
+        assert cache.stats()["size"] == 0
+
+    def test_get_or_load(self):
+        cache = PayloadCache(max_size=10, ttl=60)
+        loads = []
+        for _ in range(3):
+            assert cache.get_or_load(1, lambda: loads.append(1) or "one") == "one"
+        assert loads == [1]
+
+        cache.invalidate(1, 2)
+        assert cache.get_or_load(1, lambda: "again") == "again"
+
+    def test_invalidated_while_loading(self):
+        cache = PayloadCache(max_size=10, ttl=60)
+
+        def loader():
+            # A write lands between the read and the store of the payload
+            cache.invalidate(1)
+            return "stale"
+
+        assert cache.get_or_load(1, loader) == "stale"
+        assert cache.get(1) is None
+        assert cache.get_or_load(1, lambda: "fresh") == "fresh"
+        assert cache.get(1) == "fresh"
+
+    def test_disabled(self):
+        cache = PayloadCache(max_size=0, ttl=60)
+        cache.set(1, "one")
+        assert cache.get(1) is None
+        assert cache.get_or_load(1, lambda: "one") == "one"
+        assert cache.stats()["size"] == 0
@@ -0,0 +1,228 @@
+import io
+import json
+
+import pytest
+from flask import current_app
+from sqlalchemy import select, text
+
+from app import db
+from app import import_taxons as import_taxons_command
+from models import Taxon
+from seeders import seed_db
+from services import import_taxon_file, import_taxons, rebuild_taxon_closure
+
+CSV_HEADER = "taxon_class,name,origin,superior_taxon,superior_taxon_name,tags_ids\n"
+
+
+def closure() -> list:
+    return db.session.execute(
+        text("SELECT * FROM taxon_closure ORDER BY ancestor_id, descendant_id")
+    ).all()
+
+
+@pytest.fixture()
+def seeded_database(database):
+    seed_db()
+
+
+@pytest.mark.usefixtures("seeded_database")
+class TestTaxonImport:
+    def test_import_csv(self, client):
+        stream = io.StringIO(
+            CSV_HEADER + "phylum,Chordata,2,3,,1;2\n" + "class,Mammalia,1,,Chordata,\n"
+        )
+        report = import_taxon_file(stream, "csv")
+
+        assert report["imported"] == 2
+        assert report["rejected_count"] == 0
+        response = client.get("/taxon", query_string={"ancestor_id": 3})
+        assert [taxon["name"] for taxon in response.json["items"]] == [
+            "Chordata",
+            "Mammalia",
+        ]
+        response = client.get("/taxon", query_string={"name": "Chordata"})
+        assert [tag["id"] for tag in response.json["items"][0]["tags"]] == [1, 2]
+
+    def test_import_follows_caches(self, client):
+        facets = client.get("/tag/facets").json["items"]
+        assert {tag["name"]: tag["taxons_count"] for tag in facets}["tag4"] == 0
+        client.get("/taxon/autocomplete", query_string={"prefix": "chor"})
+
+        records = [
+            {
+                "taxon_class": "phylum",
+                "name": "Chordata",
+                "origin": 1,
+                "superior_taxon": 3,
+                "tags_ids": [4],
+            }
+        ]
+        assert import_taxons(records)["imported"] == 1
+
+        facets = client.get("/tag/facets").json["items"]
+        assert {tag["name"]: tag["taxons_count"] for tag in facets}["tag4"] == 1
+        response = client.get("/taxon", query_string={"tags_all": "4"})
+        assert [taxon["name"] for taxon in response.json["items"]] == ["Chordata"]
+        response = client.get("/taxon/autocomplete", query_string={"prefix": "chor"})
+        assert [taxon["name"] for taxon in response.json["taxons"]] == ["Chordata"]
+
+    def test_rejected_rows(self, client):
+        records = [
+            {"taxon_class": "phylum", "name": "P1", "origin": 1, "superior_taxon": 3},
+            {"taxon_class": "phylum", "name": "P2", "origin": 1, "superior_taxon": "x"},
+            {"taxon_class": "phylum", "name": "P3", "origin": "x", "superior_taxon": 3},
+            {"taxon_class": "phylum", "name": "P" * 81, "origin": 1},
+            {"taxon_class": "phylum", "name": "P5", "origin": 1, "description": 5},
+            {"taxon_class": "phylum", "name": "P6", "origin": 2**40},
+            {"taxon_class": "phylum", "name": "P7", "superior_taxon": 3},
+            {"taxon_class": "phylum", "name": "P8", "origin": 1, "tags_ids": [99]},
+            {"taxon_class": "phylum", "name": "P9", "origin": 1, "superior_taxon": 99},
+            {"taxon_class": "class", "name": "P10", "origin": 1, "superior_taxon": 3},
+            {"taxon_class": "phylum", "name": "Animalia", "origin": 1},
+            {"taxon_class": "phyla", "name": "P12", "origin": 1},
+            {"taxon_class": "phylum", "name": ["P13"], "origin": 1},
+            {"taxon_class": "life", "name": "P14", "origin": 1, "superior_taxon": 1},
+            "not json",
+            {"taxon_class": "phylum", "name": "P16", "origin": 1, "superior_taxon": 3},
+        ]
+        # A single chunk: the bad rows must not fail the insert of the good ones
+        report = import_taxons(records, chunk_size=100)
+
+        assert report["imported"] == 2
+        assert report["rejected_count"] == 14
+        assert [
+            (rejected["line"], rejected["reason"]) for rejected in report["rejected"]
+        ] == [
+            (2, "Invalid_number"),
+            (3, "Invalid_number"),
+            (4, "Text_too_long"),
+            (5, "Invalid_text"),
+            (6, "Invalid_number"),
+            (7, "Invalid_origin"),
+            (8, "Tag_not_found"),
+            (9, "Taxon_not_found"),
+            (10, "Invalid_superior_taxon"),
+            (11, "This_Taxon_already_exists"),
+            (12, "Invalid_name_or_taxon_class"),
+            (13, "Invalid_name_or_taxon_class"),
+            (14, "Life_does_not_have_superior_taxon"),
+            (15, "Invalid_record"),
+        ]
+        response = client.get("/taxon", query_string={"ancestor_id": 3})
+        assert [taxon["name"] for taxon in response.json["items"]] == ["P1", "P16"]
+
+    def test_deferred_superior_taxons(self, client):
+        records = [
+            {
+                "taxon_class": "order",
+                "name": "Primates",
+                "origin": 1,
+                "superior_taxon_name": "Mammalia",
+            },
+            {
+                "taxon_class": "class",
+                "name": "Mammalia",
+                "origin": 1,
+                "superior_taxon_name": "Chordata",
+            },
+            {
+                "taxon_class": "genus",
+                "name": "Equus",
+                "origin": 1,
+                "superior_taxon_name": "Equidae",
+            },
+            {
+                "taxon_class": "phylum",
+                "name": "Chordata",
+                "origin": 1,
+                "superior_taxon_name": "Animalia",
+            },
+        ]
+        report = import_taxons(records)
+
+        assert report["imported"] == 3
+        assert report["rejected"] == [
+            {"line": 3, "name": "Equus", "reason": "Superior_taxon_Equidae_not_found"}
+        ]
+        response = client.get("/taxon", query_string={"ancestor_id": 3})
+        assert [taxon["name"] for taxon in response.json["items"]] == [
+            "Chordata",
+            "Mammalia",
+            "Primates",
+        ]
+
+    def test_chunk_commits(self, client):
+        records = [
+            {
+                "taxon_class": "phylum",
+                "name": "phylum {}".format(index),
+                "origin": 1,
+                "superior_taxon_name": "Animalia",
+            }
+            for index in range(10)
+        ]
+        records += [
+            {
+                "taxon_class": "class",
+                "name": "class {}".format(index),
+                "origin": 1,
+                "superior_taxon_name": "phylum {}".format(index % 10),
+            }
+            for index in range(15)
+        ]
+        report = import_taxons(records, chunk_size=4)
+
+        assert report["imported"] == 25
+        assert report["rejected_count"] == 0
+        ids = db.session.execute(select(Taxon.id).order_by(Taxon.id)).scalars().all()
+        assert len(ids) == len(set(ids)) == 28
+        response = client.get("/taxon", query_string={"ancestor_id": 1})
+        assert response.json["total_items"] == 27
+
+        # Taxons created after the import get fresh ids
+        client.post(
+            "/taxon",
+            json={
+                "taxon_class": "phylum",
+                "name": "After",
+                "origin": 1,
+                "superior_taxon": 3,
+            },
+        )
+        after = client.get("/taxon", query_string={"name": "After"}).json["items"]
+        assert after[0]["id"] > max(ids)
+
+        written = closure()
+        rebuild_taxon_closure()
+        assert closure() == written
+
+    def test_import_cli(self, client, tmp_path):
+        path = tmp_path / "taxons.ndjson"
+        records = [
+            {
+                "taxon_class": "phylum",
+                "name": "Chordata",
+                "origin": 1,
+                "superior_taxon": 3,
+            },
+            {
+                "taxon_class": "phylum",
+                "name": "Nope",
+                "origin": 1,
+                "superior_taxon": "x",
+            },
+        ]
+        path.write_text("\n".join(json.dumps(record) for record in records))
+
+        result = current_app.test_cli_runner().invoke(
+            import_taxons_command, [str(path)]
+        )
+
+        assert result.exit_code == 0
+        lines = result.output.splitlines()
+        assert lines[0] == "line 2: Nope rejected (Invalid_number)"
+        assert lines[1].startswith("Imported 1 taxons, rejected 1 in ")
+        assert (
+            client.get("/taxon", query_string={"name": "Chordata"}).json["total_items"]
+            == 1
+        )
@@ -0,0 +1,201 @@
+import pytest
+from sqlalchemy import update
+
+from app import db
+from models import Taxon
+from responses import DefaultException
+from seeders import seed_db
+from services import (
+    TaxonomySnapshotStore,
+    get_lineage_index,
+    get_name_index,
+    get_taxonomy_snapshot,
+    taxonomy_snapshot,
+)
+
+
+@pytest.fixture()
+def seeded_database(database):
+    seed_db()
+
+
+def columns(snapshot) -> dict[str, list]:
+    return {
+        "ids": snapshot.ids.tolist(),
+        "parent_index": snapshot.parent_index.tolist(),
+        "rank": snapshot.rank.tolist(),
+        "origin": snapshot.origin.tolist(),
+        "extinction": snapshot.extinction.tolist(),
+        "names": snapshot.names,
+    }
+
+
+def fresh_snapshot():
+    """A snapshot loaded whole from the database"""
+    return TaxonomySnapshotStore().refresh()
+
+
+def create(client, taxon_class, name, superior_taxon, **data) -> int:
+    data.setdefault("origin", 1)
+    client.post(
+        "/taxon",
+        json={
+            "taxon_class": taxon_class,
+            "name": name,
+            "superior_taxon": superior_taxon,
+            **data,
+        },
+    )
+    return client.get("/taxon", query_string={"name": name}).json["items"][0]["id"]
+
+
+def skip_a_rank(client) -> dict[str, int]:
+    """Phylum P holds class K, which holds order O. P is then turned into a
+    class under the phylum Q behind the API's back, so K is a class right
+    under a class and P skips a rank under Q"""
+    ids = {
+        "P": create(client, "phylum", "Chordata", 3),
+        "Q": create(client, "phylum", "Arthropoda", 3),
+    }
+    ids["K"] = create(client, "class", "Mammalia", ids["P"])
+    ids["O"] = create(client, "order", "Primates", ids["K"])
+    db.session.execute(
+        update(Taxon)
+        .where(Taxon.id == ids["P"])
+        .values(taxon_class="class", superior_taxon=ids["Q"])
+    )
+    db.session.commit()
+    taxonomy_snapshot.mark_stale()
+    return ids
+
+
+@pytest.mark.usefixtures("seeded_database")
+class TestTaxonomySnapshot:
+    def test_load(self, client):
+        snapshot = get_taxonomy_snapshot()
+
+        assert len(snapshot) == 3
+        assert columns(snapshot)["parent_index"] == [-1, 0, 1]
+        assert snapshot.summary(2) == {
+            "id": 3,
+            "name": "Animalia",
+            "taxon_class": "kingdom",
+        }
+        assert snapshot.lineage(3) == [3, 2, 1]
+        assert snapshot.positions([3, 99, 1]).tolist() == [2, -1, 0]
+        with pytest.raises(DefaultException):
+            snapshot.position(99)
+
+    def test_subtree_sizes_and_rank_histogram(self, client):
+        chordata = create(client, "phylum", "Chordata", 3)
+        create(client, "phylum", "Arthropoda", 3)
+        create(client, "class", "Mammalia", chordata)
+        snapshot = get_taxonomy_snapshot()
+
+        assert snapshot.subtree_sizes().tolist() == [6, 5, 4, 2, 1, 1]
+        assert snapshot.subtree_size(chordata) == 2
+        histogram = snapshot.rank_histogram()
+        assert histogram["phylum"] == 2 and histogram["class"] == 1
+        assert sum(histogram.values()) == 6
+        rows = snapshot.positions([chordata, 3])
+        assert snapshot.rank_histogram(rows)["phylum"] == 1
+
+    def test_derived_columns_follow_parents(self, client):
+        ids = skip_a_rank(client)
+        snapshot = get_taxonomy_snapshot()
+
+        depths = snapshot.depths()
+        rows = snapshot.positions([ids["O"], ids["P"], 3])
+        assert depths[rows].tolist() == [6, 4, 2]
+        assert snapshot.subtree_size(ids["Q"]) == 4
+        assert snapshot.subtree_size(3) == 5
+        assert snapshot.subtree_sizes().tolist()[:3] == [7, 6, 5]
+
+    def test_timeline_subtree_follows_parents(self, client):
+        ids = skip_a_rank(client)
+
+        response = client.get(
+            "/taxon/timeline", query_string={"at": 1, "ancestor_id": ids["Q"]}
+        )
+        item = response.json["items"][0]
+        assert item["total"] == 4
+        assert item["ranks"]["class"] == 2 and item["ranks"]["order"] == 1
+
+    def test_lineage_index_follows_parents(self, client):
+        ids = skip_a_rank(client)
+
+        response = client.get(
+            "/taxon/lca", query_string={"ids": "{},{}".format(ids["Q"], ids["O"])}
+        )
+        assert response.json["lca"]["id"] == ids["Q"]
+        assert [taxon["depth"] for taxon in response.json["taxons"]] == [3, 6]
+        assert response.json["pairs"][0]["distance"] == 3
+
+    def test_patch_after_writes(self, client):
+        get_taxonomy_snapshot()
+        chordata = create(client, "phylum", "Chordata", 3, extinction=0)
+        arthropoda = create(client, "phylum", "Arthropoda", 3)
+        mammalia = create(client, "class", "Mammalia", chordata)
+        client.put(
+            "/taxon/{}".format(mammalia),
+            json={
+                "taxon_class": "class",
+                "name": "Mammals",
+                "origin": 2,
+                "superior_taxon": arthropoda,
+            },
+        )
+        client.delete("/taxon/{}".format(chordata))
+
+        patched = get_taxonomy_snapshot()
+        assert columns(patched) == columns(fresh_snapshot())
+        assert patched.lineage(mammalia) == [mammalia, arthropoda, 3, 2, 1]
+        assert patched.subtree_sizes().tolist() == [5, 4, 3, 2, 1]
+
+    def test_published_snapshots_do_not_change(self, client):
+        before = get_taxonomy_snapshot()
+        kept = columns(before)
+        before.subtree_sizes()
+        create(client, "phylum", "Chordata", 3)
+
+        after = get_taxonomy_snapshot()
+        assert after is not before
+        assert after.version > before.version
+        assert columns(before) == kept
+        assert before.subtree_sizes().tolist() == [3, 2, 1]
+        assert after.subtree_sizes().tolist() == [4, 3, 2, 1]
+        assert get_taxonomy_snapshot() is after
+
+    def test_mark_stale(self, client):
+        before = get_taxonomy_snapshot()
+        taxonomy_snapshot.mark_stale()
+        after = get_taxonomy_snapshot()
+        assert after is not before
+        assert columns(after) == columns(before)
+
+    def test_lineage_index_keeps_its_snapshot(self, client):
+        index, snapshot = get_lineage_index()
+        assert snapshot is index.snapshot is get_taxonomy_snapshot()
+        assert get_lineage_index() == (index, snapshot)
+
+        chordata = create(client, "phylum", "Chordata", 3)
+        fresh, newer_snapshot = get_lineage_index()
+        assert fresh is not index
+        assert newer_snapshot is get_taxonomy_snapshot()
+        assert len(snapshot) == len(index.depth) == 3
+        assert fresh.depth[newer_snapshot.position(chordata)] == 3
+
+    def test_name_index_keeps_its_snapshot(self, client):
+        index, snapshot = get_name_index()
+        assert snapshot is get_taxonomy_snapshot()
+
+        client.put(
+            "/taxon/3",
+            json={"taxon_class": "kingdom", "name": "Metazoa", "origin": 1},
+        )
+        fresh, newer_snapshot = get_name_index()
+        assert newer_snapshot is get_taxonomy_snapshot()
+        # Each index points at rows of its own snapshot
+        assert snapshot.names[index.exact["Animalia"]] == "Animalia"
+        assert newer_snapshot.names[fresh.exact["Metazoa"]] == "Metazoa"
+        assert "Animalia" not in fresh.exact